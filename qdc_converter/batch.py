@@ -0,0 +1,261 @@
+import csv
+import json
+import multiprocessing as mp
+import os
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from pebble import ProcessExpired, ProcessPool
+from tqdm import tqdm
+
+from .cli import run_cli
+from .contours import DEFAULT_CONTOUR_INTERVAL
+from .utils import PROGRESS_FREQUENCY, get_cpu_count, mute_tqdm, print_error
+
+# Optional job parameters and their defaults,
+# names are the same as `run_cli` arguments.
+JOB_DEFAULTS = {
+    'validity_codes': False,
+    'x_correction': 0.0,
+    'y_correction': 0.0,
+    'z_correction': 0.0,
+    'csv_delimiter': ',',
+    'csv_skip_headers': False,
+    'csv_yxz': False,
+    'contour_interval': DEFAULT_CONTOUR_INTERVAL,
+    'resume': False,
+    'fixed_width': False,
+}
+
+JOB_REQUIRED = ('qdc_folder_path', 'output_path', 'layer')
+
+# State of a worker process, set up by `init_worker`
+worker_state = {}
+
+
+class JobMessageQueue:
+    """Message queue proxy tagging messages of the converter with the job id."""
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def put(self, message):
+        self.queue.put((self.job_id, message))
+
+
+def parse_bool(value):
+    """Parse boolean value of a manifest field."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y', 'on')
+    return bool(value)
+
+
+def normalize_job(raw_job, base_path):
+    """Validate manifest entry and fill it with defaults.
+
+    Args:
+        raw_job (dict): Manifest entry.
+        base_path (str): Directory relative paths are resolved against.
+
+    Returns:
+        Job parameters ready to be passed to `run_cli`.
+    """
+    raw_job = {k.strip().replace('-', '_'): v for k, v in raw_job.items() if k}
+    missing = [name for name in JOB_REQUIRED if raw_job.get(name) in (None, '')]
+    if missing:
+        raise ValueError(_('Missing job parameter(s): %s') % ', '.join(missing))
+
+    unknown = set(raw_job) - set(JOB_REQUIRED) - set(JOB_DEFAULTS)
+    if unknown:
+        raise ValueError(_('Unknown job parameter(s): %s') % ', '.join(sorted(unknown)))
+
+    job = dict(JOB_DEFAULTS)
+    for name, value in raw_job.items():
+        if value in (None, ''):
+            continue
+        if name in ('qdc_folder_path', 'output_path'):
+            job[name] = os.path.normpath(os.path.join(base_path, os.path.expanduser(value)))
+        elif name == 'layer':
+            job[name] = int(value)
+        elif name.endswith('_correction') or name == 'contour_interval':
+            job[name] = float(value)
+        elif name == 'csv_delimiter':
+            job[name] = str(value)
+        else:
+            job[name] = parse_bool(value)
+
+    if job['layer'] not in range(6):
+        raise ValueError(_('Layer must be in range [0, 5], got %s') % job['layer'])
+
+    return job
+
+
+def load_manifest(manifest_path):
+    """Load batch manifest.
+
+    Manifest is either a JSON list of objects (or an object with a `jobs` list)
+    or a CSV table with a header, fields are named after `run_cli` arguments:
+    `qdc_folder_path`, `output_path`, `layer` and optional `validity_codes`,
+    `x_correction`, `y_correction`, `z_correction`, `csv_delimiter`,
+    `csv_skip_headers`, `csv_yxz`, `contour_interval`, `resume`, `fixed_width`.
+    Relative paths are resolved against manifest's folder.
+
+    Args:
+        manifest_path (str): Path to *.json or *.csv manifest.
+
+    Returns:
+        List of jobs.
+    """
+    base_path = os.path.dirname(os.path.abspath(manifest_path))
+    manifest_ext = os.path.splitext(manifest_path)[-1].lower()
+
+    if manifest_ext == '.json':
+        with open(manifest_path, 'r', encoding='utf-8') as f_manifest:
+            raw_jobs = json.load(f_manifest)
+        if isinstance(raw_jobs, dict):
+            raw_jobs = raw_jobs.get('jobs', [])
+    elif manifest_ext == '.csv':
+        with open(manifest_path, 'r', encoding='utf-8', newline='') as f_manifest:
+            raw_jobs = list(csv.DictReader(f_manifest))
+    else:
+        raise ValueError(_('Manifest file extension must be *.json or *.csv'))
+
+    jobs = []
+    for n, raw_job in enumerate(raw_jobs, start=1):
+        try:
+            jobs.append(normalize_job(raw_job, base_path))
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError(_('Manifest entry #%d is invalid: %s') % (n, e))
+
+    if not jobs:
+        raise ValueError(_('Manifest has no jobs!'))
+
+    return jobs
+
+
+def init_worker(message_queue):
+    """Set up worker process of the batch."""
+    worker_state['message_queue'] = message_queue
+
+    # Progress of the job is shown by the batch progress bar,
+    # errors and warnings of the worker go to stderr as usual.
+    mute_tqdm(tqdm)
+
+
+def run_job(job_id, job):
+    """Pool worker, converts a single job.
+
+    Returns:
+        Tuple of elapsed time and size of the result file.
+    """
+    message_queue = JobMessageQueue(worker_state['message_queue'], job_id)
+    time_start = time.perf_counter()
+    # Errors are printed and sent to the message queue by the converter
+    run_cli(quite=False, multithreaded=False, message_queue=message_queue, **job)
+    return time.perf_counter() - time_start, os.path.getsize(job['output_path'])
+
+
+def receive_progress(worker_queue, jobs, jobs_progress, message_queue=None):
+    """Receive progress of the jobs sent by the workers.
+
+    Args:
+        worker_queue (multiprocessing.Queue): Message queue of the workers.
+        jobs (list): Jobs of the batch.
+        jobs_progress (dict): Latest progress by job id, updated in place.
+        message_queue (multiprocessing.Queue): Message queue progress and errors are forwarded to.
+    """
+    while True:
+        try:
+            job_id, (key, value) = worker_queue.get_nowait()
+        except queue.Empty:
+            return
+        if key == '#Progress':
+            jobs_progress[job_id] = value
+            value = dict(value, output_path=jobs[job_id]['output_path'])
+        if message_queue:
+            message_queue.put((key, value))
+
+
+def format_jobs_progress(jobs_progress):
+    """Format progress of the running jobs as `#<job number> <percent>%` items."""
+    items = []
+    for job_id, progress in sorted(jobs_progress.items()):
+        percent = f'{progress["n"] / progress["total"]:.0%}' if progress['total'] else progress['n']
+        items.append(f'#{job_id + 1} {percent}')
+    return ' '.join(items)
+
+
+def run_batch(manifest_path, workers=None, quite=False, message_queue=None):
+    """Convert all jobs from the manifest using one shared worker pool.
+
+    A failed job doesn't stop the rest, its error is printed by the worker.
+    Progress of the running jobs is shown by the batch progress bar and forwarded
+    to `message_queue` tagged with the job `output_path`.
+
+    Args:
+        manifest_path (str): Path to manifest.
+        workers (int): Number of worker processes (defaults to CPU count).
+        quite (bool): Quite mode.
+        message_queue (multiprocessing.Queue): Message queue.
+
+    Returns:
+        List of `(job, error)` tuples for failed jobs.
+    """
+    try:
+        jobs = load_manifest(manifest_path)
+    except Exception as e:
+        print_error(f'{_("Error")}: {e}', message_queue)
+        raise
+
+    workers = min(workers or get_cpu_count(), len(jobs))
+    failed = []
+    total_job_time, total_output_size = 0.0, 0
+    worker_queue = mp.Queue()
+    jobs_progress = {}
+
+    time_start = time.perf_counter()
+    with ProcessPool(max_workers=workers, initializer=init_worker, initargs=(worker_queue,)) as pool:
+        futures = {pool.schedule(run_job, args=(job_id, job)): job_id for job_id, job in enumerate(jobs)}
+
+        with tqdm(total=len(jobs), desc=_('Converting jobs'), disable=quite) as progress_bar:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=1 / PROGRESS_FREQUENCY, return_when=FIRST_COMPLETED)
+                receive_progress(worker_queue, jobs, jobs_progress, message_queue)
+
+                for future in done:
+                    job_id = futures[future]
+                    job = jobs[job_id]
+                    jobs_progress.pop(job_id, None)
+                    try:
+                        job_time, output_size = future.result()
+                    except Exception as e:
+                        failed.append((job, e))
+                        if isinstance(e, ProcessExpired):
+                            # Worker has died without reporting the error
+                            print_error(f'{_("Error")}: {job["qdc_folder_path"]}: {e}', message_queue)
+                        elif not quite:
+                            tqdm.write(f'{job["output_path"]}: {_("failed")}')
+                    else:
+                        total_job_time += job_time
+                        total_output_size += output_size
+                        if not quite:
+                            tqdm.write(f'{job["output_path"]}: {job_time:.1f} s, {output_size / 2 ** 20:.1f} MiB')
+                    progress_bar.update()
+
+                postfix = {'failed': len(failed)}
+                if jobs_progress:
+                    postfix['jobs'] = format_jobs_progress(jobs_progress)
+                progress_bar.set_postfix(postfix)
+    elapsed = max(time.perf_counter() - time_start, 1e-9)
+    # Progress sent right before the last jobs have finished
+    receive_progress(worker_queue, jobs, {}, message_queue)
+
+    if not quite:
+        succeeded = len(jobs) - len(failed)
+        tqdm.write(_('Jobs: %d succeeded, %d failed, %d workers.') % (succeeded, len(failed), workers))
+        tqdm.write(_('Elapsed: %.1f s (%.1f s of job time), throughput: %.2f jobs/min, %.2f MiB/s.') % (
+            elapsed, total_job_time, succeeded * 60 / elapsed, total_output_size / 2 ** 20 / elapsed))
+
+    return failed
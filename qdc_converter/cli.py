@@ -1,104 +1,211 @@
 import csv
+import io
 import os
 import struct
+import sys
 from types import SimpleNamespace
 
 import numpy as np
 from tqdm import tqdm
 
-from .utils import get_files_recursively, patch_tqdm, print_error
-
-
-LAYER_PARAMETERS = {
-    0: {
-        'a_step': 90 / 2 ** 22,
-        'n_sectors': 7,
-        'f_size1': 372736,
-        'f_offset1': 4097,
-        'f_size2': 352256,
-        'f_offset2': 4097,
-        'f_size3': -1,
-        'f_offset3': 0,
-        'f_size4': -1,
-        'f_offset4': 0,
-        'l_size': 256,
-        'l_size2': 256,
-    },
-    1: {
-        'a_step': 90 / 2 ** 21,
-        'n_sectors': 3,
-        'f_size1': 372736,
-        'f_offset1': 266241,
-        'f_size2': 352256,
-        'f_offset2': 266241,
-        'f_size3': 110592,
-        'f_offset3': 4097,
-        'f_size4': 90112,
-        'f_offset4': 4097,
-        'l_size': 128,
-        'l_size2': 128,
-    },
-    2: {
-        'a_step': 90 / 2 ** 20,
-        'n_sectors': 1,
-        'f_size1': 372736,
-        'f_offset1': 331777,
-        'f_size2': 352256,
-        'f_offset2': 331777,
-        'f_size3': 110592,
-        'f_offset3': 69633,
-        'f_size4': 90112,
-        'f_offset4': 69633,
-        'l_size': 64,
-        'l_size2': 64,
-    },
-    3: {
-        'a_step': 90 / 2 ** 19,
-        'n_sectors': 0,
-        'f_size1': 372736,
-        'f_offset1': 348161,
-        'f_size2': 352256,
-        'f_offset2': 348161,
-        'f_size3': 110592,
-        'f_offset3': 86017,
-        'f_size4': 90112,
-        'f_offset4': 86017,
-        'l_size': 32,
-        'l_size2': 32,
-    },
-    4: {
-        'a_step': 90 / 2 ** 18,
-        'n_sectors': 1,
-        'f_size1': 372736,
-        'f_offset1': 352257,
-        'f_size2': -1,
-        'f_offset2': 0,
-        'f_size3': 110592,
-        'f_offset3': 90113,
-        'f_size4': -1,
-        'f_offset4': 0,
-        'l_size': 64,
-        'l_size2': 16,
-    },
-    5: {
-        'a_step': 90 / 2 ** 17,
-        'n_sectors': 0,
-        'f_size1': 372736,
-        'f_offset1': 368641,
-        'f_size2': -1,
-        'f_offset2': 0,
-        'f_size3': 110592,
-        'f_offset3': 106497,
-        'f_size4': -1,
-        'f_offset4': 0,
-        'l_size': 32,
-        'l_size2': 8,
-    },
-}
+from .contours import DEFAULT_CONTOUR_INTERVAL, save_contours
+from .fixed_width import get_fixed_width_layout
+from .las import save_las
+from .resume import Checkpoint
+from .tiles import (LAYER_PARAMETERS, deduplicate_tiles, fill_depth_array,
+                    get_tiles_bounds, get_z_values, iter_tiles)
+from .utils import patch_tqdm, print_error
+
+# Supported extensions of the result file
+OUTPUT_EXTENSIONS = ('.csv', '.grd', '.geojson', '.las')
+
+# Result path meaning the result is streamed to stdout
+STDOUT_PATH = '-'
+
+# Formats of the result which could be streamed to stdout
+STDOUT_FORMATS = ('csv', 'grd')
+
+# Size of chunks of the result written to stdout at once
+STDOUT_BUFFER_SIZE = 2 ** 20
+
+
+def check_output_path(output_path, validity_codes=False, output_format=None, fixed_width=False):
+    """Validate the result file path.
+
+    Args:
+        output_path (str): Path to the result file, `-` for stdout.
+        validity_codes (bool): Validity codes are written instead of depth.
+        output_format (str): Format of the result, required for stdout.
+        fixed_width (bool): Values are written in fixed-width format.
+
+    Returns:
+        Lowercase extension of the result file.
+    """
+    if output_path == STDOUT_PATH:
+        if output_format not in STDOUT_FORMATS:
+            raise ValueError(_('Format of the result streamed to stdout must be set to csv or grd (--format)'))
+        return '.' + output_format
+
+    output_path_ext = os.path.splitext(output_path)[-1].lower()
+    if output_format and output_path_ext != '.' + output_format:
+        raise ValueError(_('Output file extension does not match format %s') % output_format)
+    if output_path_ext not in OUTPUT_EXTENSIONS:
+        raise ValueError(_('Output file extension must be *.csv (CSV table), *.grd (ESRI ASCII grid), '
+                           '*.geojson (depth contours) or *.las (point cloud)'))
+    if output_path_ext == '.geojson' and validity_codes:
+        raise ValueError(_('Depth contours could not be built from validity codes'))
+    if output_path_ext in ('.geojson', '.las') and fixed_width:
+        raise ValueError(_('Fixed-width values could be written only to *.csv or *.grd'))
+    return output_path_ext
+
+
+def report_skipped_tiles(duplicates, quite):
+    """Print number and size of skipped QDC files."""
+    if not quite and duplicates:
+        # Along with progress bars to stderr, stdout could be taken by the result
+        tqdm.write(_('Skipped %d duplicate QDC files (%.1f MiB).') % (
+            len(duplicates), sum(tile.size for tile in duplicates) / 2 ** 20), file=sys.stderr)
+
+
+def scan_layer_tiles(qdc_folder_path, layer_parameters, quite, tiles=None):
+    """Find QDC files of the layer and read their headers in a single pass.
+
+    Copies of the same tiles are skipped, different versions of the same
+    tile are placed from the oldest to the newest.
+
+    Args:
+        qdc_folder_path (str): Path to folder with QDC files.
+        layer_parameters (SimpleNamespace): Layer parameters.
+        quite (bool): Quite mode.
+        tiles (list): Tiles of the layer already found in the folder, it isn't scanned again.
+
+    Returns:
+        List of tiles.
+    """
+    if tiles is None:
+        tiles = list(tqdm(iter_tiles(qdc_folder_path, layer_parameters), desc=_('Scanning QDC files'),
+                          unit=' files', disable=quite))
+    tiles, duplicates = deduplicate_tiles(tiles, layer_parameters)
+    report_skipped_tiles(duplicates, quite)
+    return tiles
+
+
+def calculate_depth_array(tiles, x_min, y_min, x_size, y_size, layer_parameters, validity_codes, quite,
+                          tile_cache=None, arr_code=None):
+    """Read QDC files cell by cell into the north-up depth array.
+
+    Tiles are decoded as whole blocks when `tile_cache` is passed.
+
+    Args:
+        tiles (list): Tiles of the layer.
+        x_min (int): Minimal X tile coordinate.
+        y_min (int): Minimal Y tile coordinate.
+        x_size (int): Number of columns of the depth array.
+        y_size (int): Number of rows of the depth array.
+        layer_parameters (SimpleNamespace): Layer parameters.
+        validity_codes (bool): Write validity codes instead of depth.
+        quite (bool): Quite mode.
+        tile_cache (LRUCache): Cache of decoded tiles kept between conversions.
+        arr_code (np.ndarray): Validity codes array of the same shape filled in the same pass.
+
+    Returns:
+        Depth array indexed as `[row, column]`.
+    """
+    arr_depth = np.zeros((y_size, x_size), dtype=np.int16)
+
+    if tile_cache is not None:
+        fill_depth_array(arr_depth, tqdm(tiles, desc=_('Calculating depth map'), disable=quite),
+                         x_min, y_min, layer_parameters, validity_codes, tile_cache, arr_code)
+        return arr_depth
+
+    # Calculate depth array
+    progress_bar = tqdm(tiles, desc=_('Calculating depth map'), disable=quite)
+    progress_bar.nbytes = 0
+    for tile in progress_bar:
+        progress_bar.nbytes += tile.size
+        with open(tile.path, 'rb') as f_qdc:
+            # Tile coordinates and offset are already known from the scan
+            x_orig = (tile.x - x_min) * layer_parameters.l_size2
+            y_orig = (tile.y - y_min) * layer_parameters.l_size2
+            i = tile.offset
+
+            for yy in range(layer_parameters.n_sectors + 1):
+                for xx in range(layer_parameters.n_sectors + 1):
+                    for y in range(32):
+                        for x in range(32):
+                            x_abs = xx * 32 + x + x_orig
+                            y_abs = yy * 32 + y + y_orig
+                            row_abs = y_size - 1 - y_abs  # North-up
+                            f_qdc.seek(i + 1)
+                            val_code = struct.unpack('<h', f_qdc.read(2))[0]  # Read validity code
+                            if arr_code is not None:
+                                arr_code[row_abs, x_abs] = val_code
+
+                            if validity_codes:  # Write validity codes to array instead of depth
+                                arr_depth[row_abs, x_abs] = val_code
+                            else:
+                                if val_code != 0:
+                                    f_qdc.seek(i - 1)
+                                    val_depth = struct.unpack('<h', f_qdc.read(2))[0]  # Read depth in cm
+                                    arr_depth[row_abs, x_abs] = val_depth
+                            i += 4
+
+    return arr_depth
+
+
+def prepare_depth_array(qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction,
+                        z_correction, csv_delimiter, csv_skip_headers, csv_yxz, contour_interval, resume, tile_cache,
+                        output_format, fixed_width, tiles):
+    """Validate arguments and decode tiles into the depth array, shared by both converters.
+
+    With `resume` the array is taken from the checkpoint of the interrupted conversion if it's there.
+
+    Returns:
+        Tuple of north-up depth array, validity codes array written to user data of LAS points
+        (or `None`), `x_min`, `y_min` and checkpoint (or `None`).
+    """
+    # Some arguments validation
+    output_path_ext = check_output_path(output_path, validity_codes, output_format, fixed_width)
+    check_resume(output_path, resume)
+
+    layer_parameters = SimpleNamespace(**LAYER_PARAMETERS[layer])
+    tiles = scan_layer_tiles(qdc_folder_path, layer_parameters, quite, tiles)
+
+    x_min, y_min, x_max, y_max = get_tiles_bounds(tiles)
+    x_size = (x_max - x_min + 1) * layer_parameters.l_size
+    y_size = (y_max - y_min + 1) * layer_parameters.l_size
+
+    # Decoded depth array of the interrupted conversion could be reused
+    checkpoint = None
+    if resume:
+        checkpoint = Checkpoint(output_path, [tile.path for tile in tiles], dict(
+            qdc_folder_path=qdc_folder_path, layer=layer, validity_codes=validity_codes,
+            x_correction=x_correction, y_correction=y_correction, z_correction=z_correction,
+            csv_delimiter=csv_delimiter, csv_skip_headers=csv_skip_headers, csv_yxz=csv_yxz,
+            contour_interval=contour_interval, fixed_width=fixed_width,
+        ))
+    arr_depth = checkpoint.load_grid() if checkpoint else None
+
+    # Validity codes are written to user data of LAS points, they're decoded along with depth
+    with_codes = output_path_ext == '.las' and not validity_codes
+    arr_code = checkpoint.load_grid('codes') if checkpoint and with_codes else None
+
+    if arr_depth is None or (with_codes and arr_code is None):
+        arr_code = np.zeros((y_size, x_size), dtype=np.int16) if with_codes else None
+        arr_depth = calculate_depth_array(tiles, x_min, y_min, x_size, y_size,
+                                          layer_parameters, validity_codes, quite, tile_cache, arr_code)
+        if checkpoint:
+            if with_codes:
+                checkpoint.save_grid(arr_code, 'codes')
+            checkpoint.save_grid(arr_depth)
+
+    return arr_depth, arr_code, x_min, y_min, checkpoint
 
 
 def run_cli(qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction, z_correction,
-            csv_delimiter, csv_skip_headers, csv_yxz, multithreaded, message_queue=None):
+            csv_delimiter, csv_skip_headers, csv_yxz, multithreaded, message_queue=None,
+            contour_interval=DEFAULT_CONTOUR_INTERVAL, resume=False, tile_cache=None, workers=None,
+            output_format=None, fixed_width=False, tiles=None):
     # Patch tqdm to duplicate messages up to the passed message queue.
     if message_queue:
         patch_tqdm(tqdm, message_queue)
@@ -109,156 +216,266 @@ def run_cli(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
         return run_cli(
             qdc_folder_path, output_path, layer, validity_codes, quite,
             x_correction, y_correction, z_correction,
-            csv_delimiter, csv_skip_headers, csv_yxz, multithreaded, message_queue
+            csv_delimiter, csv_skip_headers, csv_yxz, multithreaded, message_queue,
+            contour_interval=contour_interval, resume=resume, tile_cache=tile_cache, workers=workers,
+            output_format=output_format, fixed_width=fixed_width, tiles=tiles
         )
 
     try:
-        # Some arguments validation
-        output_path_ext = os.path.splitext(output_path)[-1]
-        if output_path_ext.lower() not in ('.csv', '.grd'):
-            raise ValueError(_('Output file extension must be *.csv (CSV table) or *.grd (ESRI ASCII grid)'))
-
-        layer_parameters = SimpleNamespace(**LAYER_PARAMETERS[layer])
-        qdc_files = get_files_recursively(qdc_folder_path, '.qdc')
-
-        # Calculate boundaries
-        x_min, y_min = 32000, 32000
-        x_max, y_max = -32000, -32000
-        for qdc_file in qdc_files:
-            qdc_file_size = os.path.getsize(qdc_file)
-            if qdc_file_size in (layer_parameters.f_size1, layer_parameters.f_size2,
-                                 layer_parameters.f_size3, layer_parameters.f_size4):
-                with open(qdc_file, 'rb') as f_qdc:
-                    f_qdc.seek(164)
-                    val = struct.unpack('<h', f_qdc.read(2))[0]
-                    x_min = min(val, x_min)
-                    x_max = max(val, x_max)
-
-                    f_qdc.seek(160)
-                    val = struct.unpack('<h', f_qdc.read(2))[0]
-                    y_min = min(val, y_min)
-                    y_max = max(val, y_max)
-
-        if x_min == 32000 or y_min == 32000 \
-           or x_max == -32000 or y_max == -32000:
-            raise RuntimeError(_('No valid QDC files found!'))
-
-        x_size = (x_max - x_min + 1) * layer_parameters.l_size
-        y_size = (y_max - y_min + 1) * layer_parameters.l_size
-        arr_depth = np.zeros((x_size, y_size), dtype=np.int16)
-
-        # Calculate depth array
-        for qdc_file in tqdm(qdc_files, desc=_('Calculating depth map'), disable=quite):
-            qdc_file_size = os.path.getsize(qdc_file)
-            if qdc_file_size in (layer_parameters.f_size1, layer_parameters.f_size2,
-                                 layer_parameters.f_size3, layer_parameters.f_size4):
-                with open(qdc_file, 'rb') as f_qdc:
-                    f_qdc.seek(164)
-                    val = struct.unpack('<h', f_qdc.read(2))[0]
-                    x_orig = (val - x_min) * layer_parameters.l_size2
-
-                    f_qdc.seek(160)
-                    val = struct.unpack('<h', f_qdc.read(2))[0]
-                    y_orig = (val - y_min) * layer_parameters.l_size2
-
-                    if qdc_file_size == layer_parameters.f_size1:
-                        i = layer_parameters.f_offset1
-                    elif qdc_file_size == layer_parameters.f_size2:
-                        i = layer_parameters.f_offset2
-                    elif qdc_file_size == layer_parameters.f_size3:
-                        i = layer_parameters.f_offset3
-                    elif qdc_file_size == layer_parameters.f_size4:
-                        i = layer_parameters.f_offset4
-
-                    for yy in range(layer_parameters.n_sectors + 1):
-                        for xx in range(layer_parameters.n_sectors + 1):
-                            for y in range(32):
-                                for x in range(32):
-                                    x_abs = xx * 32 + x + x_orig
-                                    y_abs = yy * 32 + y + y_orig
-                                    f_qdc.seek(i + 1)
-                                    val_code = struct.unpack('<h', f_qdc.read(2))[0]  # Read validity code
-
-                                    if validity_codes:  # Write validity codes to array instead of depth
-                                        arr_depth[x_abs, y_abs] = val_code
-                                    else:
-                                        if val_code != 0:
-                                            f_qdc.seek(i - 1)
-                                            val_depth = struct.unpack('<h', f_qdc.read(2))[0]  # Read depth in cm
-                                            arr_depth[x_abs, y_abs] = val_depth
-                                    i += 4
-
-        x_orig = x_min * 90 / 2 ** 14
-        y_orig = y_min * 90 / 2 ** 14
-
-        f_fix = lambda x: np.sign(x) * np.int16(np.abs(x))
-
-        # Save depth array to *.csv or *.grd
-        if output_path_ext.lower() == '.grd':
-            # ESRI ASCII grid
-            with open(output_path, 'w') as f_grd:
-                f_grd.write(f'NCOLS {x_size}\n')
-                f_grd.write(f'NROWS {y_size}\n')
-                f_grd.write(f'XLLCORNER {x_orig}\n')
-                f_grd.write(f'YLLCORNER {y_orig}\n')
-                f_grd.write(f'CELLSIZE {layer_parameters.a_step}\n')
-                f_grd.write('NODATA_VALUE 0\n')
-
-                for j in tqdm(range(y_size - 1, -1, -1), desc=_('Saving Esri ASCII raster')):
-                    row_values = []
-                    for i in range(x_size):
-                        if validity_codes:
-                            t_val = f_fix(arr_depth[i, j] / 4096)
-                            z = t_val * 10 + (arr_depth[i, j] - t_val * 4096) / 256
-                        else:
-                            z = arr_depth[i, j] / 100
-                        row_values.append(z + z_correction)
-                    f_grd.write(' '.join(str(x) for x in row_values) + '\n')
-
-            # Write projection file
-            output_path_prj = output_path[:-4] + '.prj'
-            with open(output_path_prj, 'w') as f_prj:
-                f_prj.write('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",'
-                            'SPHEROID["WGS_1984",6378137.0,298.257223563]],'
-                            'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
-
-        elif output_path_ext.lower() == '.csv':
-            # CSV table
-            with open(output_path, 'w', newline='') as f_csv:
-                writer = csv.writer(f_csv, delimiter=csv_delimiter)
-
-                # Write header
-                if not csv_skip_headers:
-                    if csv_yxz:
-                        if validity_codes:
-                            writer.writerow(['Y', 'X', 'ValCode'])
-                        else:
-                            writer.writerow(['Y', 'X', 'Depth(m)'])
-                    else:
-                        if validity_codes:
-                            writer.writerow(['X', 'Y', 'ValCode'])
-                        else:
-                            writer.writerow(['X', 'Y', 'Depth(m)'])
-
-                # Write data
-                for j in tqdm(range(y_size - 1, -1, -1), desc=_('Saving CSV table'), disable=quite):
-                    for i in range(x_size):
-                        if arr_depth[i, j] > 0:  # Skip all 0 values
-                            if validity_codes:
-                                t_val = f_fix(arr_depth[i, j] / 4096)
-                                z = t_val * 10 + (arr_depth[i, j] - t_val * 4096) / 256
-                            else:
-                                z = arr_depth[i, j] / 100
+        arr_depth, arr_code, x_min, y_min, checkpoint = prepare_depth_array(
+            qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction, z_correction,
+            csv_delimiter, csv_skip_headers, csv_yxz, contour_interval, resume, tile_cache, output_format,
+            fixed_width, tiles)
 
-                            # Adding a_step / 2 to move point to the middle of the cell extent
-                            x = x_orig + layer_parameters.a_step / 2 + i * layer_parameters.a_step
-                            y = y_orig + layer_parameters.a_step / 2 + j * layer_parameters.a_step
+        save_depth_array(arr_depth, output_path, x_min, y_min, layer, validity_codes, quite,
+                         x_correction, y_correction, z_correction, csv_delimiter, csv_skip_headers, csv_yxz,
+                         contour_interval, checkpoint, output_format, fixed_width, arr_code)
 
-                            if csv_yxz:
-                                writer.writerow([y + y_correction, x + x_correction, z + z_correction])
-                            else:
-                                writer.writerow([x + x_correction, y + y_correction, z + z_correction])
+        if checkpoint:
+            checkpoint.finish()
 
     except Exception as e:
         print_error(f'{_("Error")}: {e}', message_queue)
         raise
+
+
+def check_resume(output_path, resume):
+    """Validate the result streamed to stdout is not resumed."""
+    if resume and output_path == STDOUT_PATH:
+        raise ValueError(_('Conversion streamed to stdout could not be resumed'))
+
+
+class StdoutWriter:
+    """Text writer of the result streamed to stdout.
+
+    Text is collected into large chunks written to binary stdout as is,
+    so newlines are not translated. Stdout stays open on `close`.
+
+    Args:
+        buffer_size (int): Number of characters collected before writing.
+    """
+    def __init__(self, buffer_size=STDOUT_BUFFER_SIZE):
+        self.stream = getattr(sys.stdout, 'buffer', None)
+        self.text_stream = sys.stdout if self.stream is None else None
+        self.buffer_size = buffer_size
+        self.chunks, self.size = [], 0
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.chunks:
+            text = ''.join(self.chunks)
+            self.chunks, self.size = [], 0
+            if self.stream is not None:
+                self.stream.write(text.encode())
+            else:
+                self.text_stream.write(text)
+        (self.stream or self.text_stream).flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_output(output_path, checkpoint=None, newline=None):
+    """Open the result file or continue partial one of the checkpoint.
+
+    Args:
+        output_path (str): Path to the result file, `-` for stdout.
+        checkpoint (Checkpoint): Checkpoint of resumable conversion.
+        newline (str): Same as for `open`.
+
+    Returns:
+        Tuple of file object and number of already written rows.
+    """
+    if checkpoint:
+        return checkpoint.open_output(newline=newline)
+    if output_path == STDOUT_PATH:
+        return StdoutWriter(), 0
+    return open(output_path, 'w', newline=newline), 0
+
+
+def write_prj_file(output_path):
+    """Write projection file next to the grid, there is none for stdout."""
+    if output_path == STDOUT_PATH:
+        return
+    output_path_prj = output_path[:-4] + '.prj'
+    with open(output_path_prj, 'w') as f_prj:
+        f_prj.write('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",'
+                    'SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+                    'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+
+
+def format_grd_header(x_size, y_size, x_orig, y_orig, cell_size, nodata=0):
+    """Format header of ESRI ASCII grid."""
+    return (f'NCOLS {x_size}\n'
+            f'NROWS {y_size}\n'
+            f'XLLCORNER {x_orig}\n'
+            f'YLLCORNER {y_orig}\n'
+            f'CELLSIZE {cell_size}\n'
+            f'NODATA_VALUE {nodata}\n')
+
+
+def format_csv_header(validity_codes, csv_skip_headers, csv_yxz, csv_delimiter):
+    """Format header of CSV table, empty if it's skipped."""
+    if csv_skip_headers:
+        return ''
+    header = ['X', 'Y', 'ValCode' if validity_codes else 'Depth(m)']
+    if csv_yxz:
+        header[:2] = header[1::-1]
+    result = io.StringIO()
+    csv.writer(result, delimiter=csv_delimiter).writerow(header)
+    return result.getvalue()
+
+
+def get_output_layout(arr_depth, output_path_ext, x_min, y_min, layer_parameters, validity_codes,
+                      x_correction, y_correction, z_correction, csv_delimiter, fixed_width):
+    """Get layout of fixed-width result, `None` for regular one."""
+    if not fixed_width:
+        return None
+    return get_fixed_width_layout(arr_depth, output_path_ext, x_min * 90 / 2 ** 14, y_min * 90 / 2 ** 14,
+                                  layer_parameters.a_step, validity_codes, x_correction, y_correction,
+                                  z_correction, csv_delimiter)
+
+
+def save_depth_array(arr_depth, output_path, x_min, y_min, layer, validity_codes, quite,
+                     x_correction, y_correction, z_correction, csv_delimiter, csv_skip_headers, csv_yxz,
+                     contour_interval=DEFAULT_CONTOUR_INTERVAL, checkpoint=None, output_format=None,
+                     fixed_width=False, arr_code=None):
+    """Save depth array to *.csv, *.grd, *.geojson or *.las.
+
+    Args:
+        arr_depth (np.ndarray): North-up depth (or validity codes) array indexed as `[row, column]`.
+        output_path (str): Path to the result file, `-` for stdout.
+        x_min (int): Minimal X tile coordinate.
+        y_min (int): Minimal Y tile coordinate.
+        layer (int): Data layer.
+        checkpoint (Checkpoint): Checkpoint of resumable conversion,
+            result is written to its partial file.
+        output_format (str): Format of the result, required for stdout.
+        fixed_width (bool): Write fixed-width values, so all GRD lines and CSV records have the same length.
+        arr_code (np.ndarray): Validity codes array written to user data of LAS points.
+    """
+    layer_parameters = SimpleNamespace(**LAYER_PARAMETERS[layer])
+    y_size, x_size = arr_depth.shape
+    output_path_ext = check_output_path(output_path, validity_codes, output_format, fixed_width)
+
+    x_orig = x_min * 90 / 2 ** 14
+    y_orig = y_min * 90 / 2 ** 14
+    layout = get_output_layout(arr_depth, output_path_ext, x_min, y_min, layer_parameters, validity_codes,
+                               x_correction, y_correction, z_correction, csv_delimiter, fixed_width)
+
+    # Save depth array to *.csv, *.grd, *.geojson or *.las
+    if output_path_ext == '.grd':
+        # ESRI ASCII grid, fixed-width lines are not translated to keep their length
+        f_grd, row_start = open_output(output_path, checkpoint, newline='' if layout else None)
+        with f_grd:
+            if not row_start:
+                f_grd.write(format_grd_header(x_size, y_size, x_orig, y_orig, layer_parameters.a_step))
+
+            for row_index in tqdm(range(row_start, y_size), desc=_('Saving Esri ASCII raster'), disable=quite):
+                f_grd.write(format_grd_rows(arr_depth[row_index:row_index + 1], validity_codes, z_correction,
+                                            layout))
+                if checkpoint:
+                    checkpoint.commit(f_grd, row_index + 1)
+
+        # Write projection file
+        write_prj_file(output_path)
+
+    elif output_path_ext == '.geojson':
+        # GeoJSON depth contours
+        save_contours(arr_depth, checkpoint.part_path if checkpoint else output_path, x_min, y_min, layer, quite,
+                      x_correction, y_correction, z_correction, contour_interval)
+
+    elif output_path_ext == '.las':
+        # LAS point cloud
+        save_las(arr_depth, checkpoint.part_path if checkpoint else output_path, x_min, y_min, layer, validity_codes,
+                 quite, x_correction, y_correction, z_correction, arr_code)
+
+    elif output_path_ext == '.csv':
+        # CSV table
+        f_csv, row_start = open_output(output_path, checkpoint, newline='')
+        with f_csv:
+            writer = csv.writer(f_csv, delimiter=csv_delimiter)
+
+            # Write header
+            if not row_start:
+                f_csv.write(format_csv_header(validity_codes, csv_skip_headers, csv_yxz, csv_delimiter))
+
+            # Write data
+            for row_index in tqdm(range(row_start, y_size), desc=_('Saving CSV table'), disable=quite):
+                write_csv_rows(writer, arr_depth[row_index:row_index + 1], row_index, y_size, x_orig, y_orig,
+                               layer_parameters, validity_codes, x_correction, y_correction, z_correction, csv_yxz,
+                               layout)
+                if checkpoint:
+                    checkpoint.commit(f_csv, row_index + 1)
+
+
+def format_grd_rows(rows, validity_codes, z_correction, layout=None):
+    """Format rows of the depth array as ESRI ASCII grid lines.
+
+    Args:
+        rows (np.ndarray): Rows of the north-up depth array.
+        validity_codes (bool): Array contains validity codes.
+        z_correction (float): Correction of Z.
+        layout (SimpleNamespace): Layout of fixed-width values.
+
+    Returns:
+        Text of the grid lines.
+    """
+    lines = []
+    for row in rows:
+        row_values = get_z_values(row, validity_codes) + z_correction
+        if layout:
+            z_format = layout.z
+            lines.append(' '.join([z_format % x for x in row_values.tolist()]) + '\n')
+        else:
+            lines.append(' '.join(str(x) for x in row_values.tolist()) + '\n')
+    return ''.join(lines)
+
+
+def write_csv_rows(writer, rows, row_start, y_size, x_orig, y_orig, layer_parameters, validity_codes,
+                   x_correction, y_correction, z_correction, csv_yxz, layout=None):
+    """Write non-zero cells of the depth array rows as CSV records.
+
+    Args:
+        writer (csv.writer): CSV writer.
+        rows (np.ndarray): Rows of the north-up depth array.
+        row_start (int): Index of the first row in the depth array.
+        y_size (int): Number of rows of the depth array.
+        x_orig (float): Longitude of the depth array origin.
+        y_orig (float): Latitude of the depth array origin.
+        layer_parameters (SimpleNamespace): Layer parameters.
+        layout (SimpleNamespace): Layout of fixed-width values.
+    """
+    a_step = layer_parameters.a_step
+    for row_index, row in enumerate(rows, start=row_start):
+        i = np.flatnonzero(row > 0)  # Skip all 0 values
+        j = y_size - 1 - row_index
+        z = get_z_values(row[i], validity_codes)
+
+        # Adding a_step / 2 to move point to the middle of the cell extent
+        x = x_orig + a_step / 2 + i * a_step
+        y = y_orig + a_step / 2 + j * a_step
+
+        x, z = (x + x_correction).tolist(), (z + z_correction).tolist()
+        y = [y + y_correction] * len(x)
+        if layout:
+            # Fixed-width values are written as formatted strings
+            x_format, z_format = layout.x, layout.z
+            y = [layout.y % y[0]] * len(y) if y else []
+            x, z = [x_format % v for v in x], [z_format % v for v in z]
+        if csv_yxz:
+            writer.writerows(zip(y, x, z))
+        else:
+            writer.writerows(zip(x, y, z))
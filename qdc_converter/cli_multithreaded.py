@@ -1,95 +1,143 @@
 import csv
+import io
 import multiprocessing as mp
-import os
-import struct
+import time
 from types import SimpleNamespace
 
 import numpy as np
 from pebble import concurrent
 from tqdm import tqdm
 
-from .cli import LAYER_PARAMETERS
-from .utils import (chunks, get_files_recursively, patch_tqdm, print_error,
-                    window)
+from .cli import (STDOUT_PATH, check_output_path, format_csv_header,
+                  format_grd_header, format_grd_rows, get_output_layout,
+                  open_output, prepare_depth_array, write_csv_rows,
+                  write_prj_file)
+from .contours import DEFAULT_CONTOUR_INTERVAL, save_contours
+from .fixed_width import (get_row_offsets, open_fixed_width_output,
+                          write_rows_at)
+from .las import save_las
+from .tiles import LAYER_PARAMETERS
+from .utils import get_cpu_count, patch_tqdm, print_error, window
 
-MULTIPROCESSING_BATCH = 64
+# Number of cells in the first chunk of rows passed to a worker
+CHUNK_CELLS = 2 ** 16
 
+# Desired processing time of a chunk in seconds, chunks are resized to reach it
+CHUNK_TIME = 0.25
 
-def shared_array_as_np(shared_array, x_size, y_size):
+# Maximal change of the chunk size after a single measurement
+CHUNK_GROWTH = 4
+
+
+def shared_array_as_np(shared_array, y_size, x_size):
     '''
     Returns shared mp array as np.
     '''
     np_array = np.frombuffer(shared_array.get_obj(),
                              dtype=np.dtype(shared_array.get_obj()._type_))
-    np_array = np_array.reshape((x_size, y_size))
+    np_array = np_array.reshape((y_size, x_size))
     return np_array
 
 
 @concurrent.process
-def calculate_grd_rows(j_array, shared_array, validity_codes, x_size, y_size, z_correction):
+def calculate_grd_rows(row_indices, shared_array, validity_codes, y_size, x_size, z_correction, layout=None,
+                       output_path=None, shared_offsets=None):
     '''
     Multiprocessing GRD worker.
-    '''
-    result = []
-    for j in j_array:
-        row_values = []
-        arr_depth = shared_array_as_np(shared_array, x_size, y_size)
-        f_fix = lambda x: np.sign(x) * np.int16(np.abs(x))
-
-        for i in range(x_size):
-            if validity_codes:
-                t_val = f_fix(arr_depth[i, j] / 4096)
-                z = t_val * 10 + (arr_depth[i, j] - t_val * 4096) / 256
-            else:
-                z = arr_depth[i, j] / 100
-            row_values.append(z + z_correction)
-        result.append(row_values)
 
-    return result
+    Formatted rows are returned or written at their offsets if `output_path` is passed.
+    '''
+    time_start = time.perf_counter()
+    arr_depth = shared_array_as_np(shared_array, y_size, x_size)
+    result = format_grd_rows(arr_depth[row_indices.start:row_indices.stop], validity_codes, z_correction, layout)
+    if output_path:
+        write_rows_at(output_path, result, np.frombuffer(shared_offsets.get_obj(), dtype=np.int64), row_indices)
+        result = None
+    return result, time.perf_counter() - time_start
 
 
 @concurrent.process
-def calculate_csv_rows(j_array, shared_array, validity_codes, x_size, y_size, x_orig, y_orig, layer):
+def calculate_csv_rows(row_indices, shared_array, validity_codes, y_size, x_size, x_orig, y_orig, layer,
+                       x_correction, y_correction, z_correction, csv_delimiter, csv_yxz, layout=None,
+                       output_path=None, shared_offsets=None):
     '''
     Multiprocessing CSV worker.
-    '''
-    result = []
-    for j in j_array:
-        arr_depth = shared_array_as_np(shared_array, x_size, y_size)
-        f_fix = lambda x: np.sign(x) * np.int16(np.abs(x))
-        layer_parameters = SimpleNamespace(**LAYER_PARAMETERS[layer])
-
-        for i in range(x_size):
-            if arr_depth[i, j] > 0:  # Skip all 0 values
-                if validity_codes:
-                    t_val = f_fix(arr_depth[i, j] / 4096)
-                    z = t_val * 10 + (arr_depth[i, j] - t_val * 4096) / 256
-                else:
-                    z = arr_depth[i, j] / 100
 
-                # Adding a_step / 2 to move point to the middle of the cell extent
-                x = x_orig + layer_parameters.a_step / 2 + i * layer_parameters.a_step
-                y = y_orig + layer_parameters.a_step / 2 + j * layer_parameters.a_step
+    Formatted rows are returned or written at their offsets if `output_path` is passed.
+    '''
+    time_start = time.perf_counter()
+    arr_depth = shared_array_as_np(shared_array, y_size, x_size)
+    layer_parameters = SimpleNamespace(**LAYER_PARAMETERS[layer])
+
+    result = io.StringIO()
+    writer = csv.writer(result, delimiter=csv_delimiter)
+    write_csv_rows(writer, arr_depth[row_indices.start:row_indices.stop], row_indices.start, y_size,
+                   x_orig, y_orig, layer_parameters, validity_codes, x_correction, y_correction,
+                   z_correction, csv_yxz, layout)
+    result = result.getvalue()
+    if output_path:
+        write_rows_at(output_path, result, np.frombuffer(shared_offsets.get_obj(), dtype=np.int64), row_indices)
+        result = None
+    return result, time.perf_counter() - time_start
+
+
+class ChunkSizer:
+    """Number of rows in a chunk tuned by measured processing time.
+
+    The first chunk is sized by number of cells, so narrow and wide grids
+    get chunks of similar amount of work, next chunks are resized
+    to be processed in `CHUNK_TIME` seconds.
+
+    Args:
+        row_size (int): Number of cells in a row.
+    """
+    def __init__(self, row_size):
+        self.rows = max(1, CHUNK_CELLS // max(1, row_size))
 
-                result.append((x, y, z))
+    def update(self, rows, elapsed):
+        """Resize chunks by processing time of a chunk.
 
-    return result
+        Args:
+            rows (int): Number of rows in the processed chunk.
+            elapsed (float): Processing time of the chunk in seconds.
+        """
+        if elapsed <= 0:
+            rows_goal = self.rows * CHUNK_GROWTH
+        else:
+            rows_goal = int(rows * CHUNK_TIME / elapsed)
+        self.rows = max(1, self.rows // CHUNK_GROWTH, min(rows_goal, self.rows * CHUNK_GROWTH))
 
 
-def calculates_generator(workers, target, args_chunks, **kwargs):
+def calculates_generator(workers, target, row_start, y_size, x_size, **kwargs):
     """
     Multiprocess execution generator.
+
+    Rows are split into chunks sized by `ChunkSizer` while they're processed.
+
+    Yields:
+        Tuple of rows range and its result in order of rows.
     """
+    if row_start >= y_size:
+        return
+    sizer = ChunkSizer(x_size)
+
     def futures_generator():
-        for args in args_chunks:
-            yield target(args, **kwargs)
+        row = row_start
+        while row < y_size:
+            row_indices = range(row, min(row + sizer.rows, y_size))
+            row = row_indices.stop
+            yield row_indices, target(row_indices, y_size=y_size, x_size=x_size, **kwargs)
 
-    for future, *_ in window(futures_generator(), workers):
-        yield future.result()
+    for (row_indices, future), *_ in window(futures_generator(), workers):
+        result, elapsed = future.result()
+        sizer.update(len(row_indices), elapsed)
+        yield row_indices, result
 
 
 def run_cli(qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction, z_correction,
-            csv_delimiter, csv_skip_headers, csv_yxz, multithreaded, message_queue=None):
+            csv_delimiter, csv_skip_headers, csv_yxz, multithreaded, message_queue=None,
+            contour_interval=DEFAULT_CONTOUR_INTERVAL, resume=False, tile_cache=None, workers=None,
+            output_format=None, fixed_width=False, tiles=None):
     # Patch tqdm to duplicate messages up to the passed message queue.
     if message_queue:
         patch_tqdm(tqdm, message_queue)
@@ -97,157 +145,140 @@ def run_cli(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
     assert multithreaded
 
     try:
-        # Some arguments validation
-        output_path_ext = os.path.splitext(output_path)[-1]
-        if output_path_ext.lower() not in ('.csv', '.grd'):
-            raise ValueError(_('Output file extension must be *.csv (CSV table) or *.grd (ESRI ASCII grid)'))
-
-        layer_parameters = SimpleNamespace(**LAYER_PARAMETERS[layer])
-        qdc_files = get_files_recursively(qdc_folder_path, '.qdc')
-
-        # Calculate boundaries
-        x_min, y_min = 32000, 32000
-        x_max, y_max = -32000, -32000
-        for qdc_file in qdc_files:
-            qdc_file_size = os.path.getsize(qdc_file)
-            if qdc_file_size in (layer_parameters.f_size1, layer_parameters.f_size2,
-                                 layer_parameters.f_size3, layer_parameters.f_size4):
-                with open(qdc_file, 'rb') as f_qdc:
-                    f_qdc.seek(164)
-                    val = struct.unpack('<h', f_qdc.read(2))[0]
-                    x_min = min(val, x_min)
-                    x_max = max(val, x_max)
-
-                    f_qdc.seek(160)
-                    val = struct.unpack('<h', f_qdc.read(2))[0]
-                    y_min = min(val, y_min)
-                    y_max = max(val, y_max)
-
-        if x_min == 32000 or y_min == 32000 \
-           or x_max == -32000 or y_max == -32000:
-            raise RuntimeError(_('No valid QDC files found!'))
-
-        x_size = (x_max - x_min + 1) * layer_parameters.l_size
-        y_size = (y_max - y_min + 1) * layer_parameters.l_size
-        arr_depth = np.zeros((x_size, y_size), dtype=np.int16)
-
-        # Calculate depth array
-        for qdc_file in tqdm(qdc_files, desc=_('Calculating depth map'), disable=quite):
-            qdc_file_size = os.path.getsize(qdc_file)
-            if qdc_file_size in (layer_parameters.f_size1, layer_parameters.f_size2,
-                                 layer_parameters.f_size3, layer_parameters.f_size4):
-                with open(qdc_file, 'rb') as f_qdc:
-                    f_qdc.seek(164)
-                    val = struct.unpack('<h', f_qdc.read(2))[0]
-                    x_orig = (val - x_min) * layer_parameters.l_size2
-
-                    f_qdc.seek(160)
-                    val = struct.unpack('<h', f_qdc.read(2))[0]
-                    y_orig = (val - y_min) * layer_parameters.l_size2
-
-                    if qdc_file_size == layer_parameters.f_size1:
-                        i = layer_parameters.f_offset1
-                    elif qdc_file_size == layer_parameters.f_size2:
-                        i = layer_parameters.f_offset2
-                    elif qdc_file_size == layer_parameters.f_size3:
-                        i = layer_parameters.f_offset3
-                    elif qdc_file_size == layer_parameters.f_size4:
-                        i = layer_parameters.f_offset4
-
-                    for yy in range(layer_parameters.n_sectors + 1):
-                        for xx in range(layer_parameters.n_sectors + 1):
-                            for y in range(32):
-                                for x in range(32):
-                                    x_abs = xx * 32 + x + x_orig
-                                    y_abs = yy * 32 + y + y_orig
-                                    f_qdc.seek(i + 1)
-                                    val_code = struct.unpack('<h', f_qdc.read(2))[0]  # Read validity code
-
-                                    if validity_codes:  # Write validity codes to array instead of depth
-                                        arr_depth[x_abs, y_abs] = val_code
-                                    else:
-                                        if val_code != 0:
-                                            f_qdc.seek(i - 1)
-                                            val_depth = struct.unpack('<h', f_qdc.read(2))[0]  # Read depth in cm
-                                            arr_depth[x_abs, y_abs] = val_depth
-                                    i += 4
-
-        x_orig = x_min * 90 / 2 ** 14
-        y_orig = y_min * 90 / 2 ** 14
-
-        # Create shared memory array that could be accessed from other
-        # processes instead of pickling and passing it on each fork.
-        mp_array_typecode = np.ctypeslib.as_ctypes(arr_depth.dtype.type())._type_
-        shared_array = mp.Array(typecode_or_type=mp_array_typecode,
-                                size_or_initializer=arr_depth.size)
-
-        np_shared_depth_array = shared_array_as_np(shared_array, x_size, y_size)
-        np.copyto(np_shared_depth_array, arr_depth)
-
-        # Save depth array to *.csv or *.grd
-        if output_path_ext.lower() == '.grd':
-            # ESRI ASCII grid
-            with open(output_path, 'w') as f_grd:
-                f_grd.write(f'NCOLS {x_size}\n')
-                f_grd.write(f'NROWS {y_size}\n')
-                f_grd.write(f'XLLCORNER {x_orig}\n')
-                f_grd.write(f'YLLCORNER {y_orig}\n')
-                f_grd.write(f'CELLSIZE {layer_parameters.a_step}\n')
-                f_grd.write('NODATA_VALUE 0\n')
-
-                args_chunks = list(chunks(range(y_size - 1, -1, -1), MULTIPROCESSING_BATCH))
-                kwargs = dict(
-                    shared_array=shared_array, validity_codes=validity_codes,
-                    x_size=x_size, y_size=y_size, z_correction=z_correction
-                )
-
-                for rows_set in tqdm(desc=_('Saving Esri ASCII raster'), disable=quite, total=len(args_chunks),
-                                     iterable=calculates_generator(workers=mp.cpu_count(), args_chunks=args_chunks,
-                                                                   target=calculate_grd_rows, **kwargs)):
-                    for rows in rows_set:
-                        f_grd.write(' '.join(str(x) for x in rows) + '\n')
-
-            # Write projection file
-            output_path_prj = output_path[:-4] + '.prj'
-            with open(output_path_prj, 'w') as f_prj:
-                f_prj.write('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",'
-                            'SPHEROID["WGS_1984",6378137.0,298.257223563]],'
-                            'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
-
-        elif output_path_ext.lower() == '.csv':
-            # CSV table
-            with open(output_path, 'w', newline='') as f_csv:
-                writer = csv.writer(f_csv, delimiter=csv_delimiter)
-
-                # Write header
-                if not csv_skip_headers:
-                    if csv_yxz:
-                        if validity_codes:
-                            writer.writerow(['Y', 'X', 'ValCode'])
-                        else:
-                            writer.writerow(['Y', 'X', 'Depth(m)'])
-                    else:
-                        if validity_codes:
-                            writer.writerow(['X', 'Y', 'ValCode'])
-                        else:
-                            writer.writerow(['X', 'Y', 'Depth(m)'])
-
-                # Write data
-                args_chunks = list(chunks(range(y_size - 1, -1, -1), MULTIPROCESSING_BATCH))
-                kwargs = dict(
-                    shared_array=shared_array, validity_codes=validity_codes,
-                    x_size=x_size, y_size=y_size, x_orig=x_orig, y_orig=y_orig, layer=layer
-                )
-
-                for rows in tqdm(desc=_('Saving CSV table'), disable=quite, total=len(args_chunks),
-                                 iterable=calculates_generator(workers=mp.cpu_count(), args_chunks=args_chunks,
-                                                               target=calculate_csv_rows, **kwargs)):
-                    for x, y, z in rows:
-                        if csv_yxz:
-                            writer.writerow([y + y_correction, x + x_correction, z + z_correction])
-                        else:
-                            writer.writerow([x + x_correction, y + y_correction, z + z_correction])
+        arr_depth, arr_code, x_min, y_min, checkpoint = prepare_depth_array(
+            qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction, z_correction,
+            csv_delimiter, csv_skip_headers, csv_yxz, contour_interval, resume, tile_cache, output_format,
+            fixed_width, tiles)
+
+        save_depth_array(arr_depth, output_path, x_min, y_min, layer, validity_codes, quite,
+                         x_correction, y_correction, z_correction, csv_delimiter, csv_skip_headers, csv_yxz,
+                         contour_interval, checkpoint, workers, output_format, fixed_width, arr_code)
+
+        if checkpoint:
+            checkpoint.finish()
 
     except Exception as e:
         print_error(f'{_("Error")}: {e}', message_queue)
         raise
+
+
+def save_rows(f_output, checkpoint, desc, quite, workers, target, row_start, y_size, x_size, **kwargs):
+    """Save rows processed by workers in order of rows.
+
+    Args:
+        f_output (file): Result file, rows written by workers are not passed to it.
+        checkpoint (Checkpoint): Checkpoint of resumable conversion.
+        desc (str): Description of the progress bar.
+    """
+    with tqdm(desc=desc, disable=quite, total=y_size, initial=row_start, unit=' rows') as progress_bar:
+        for row_indices, rows in calculates_generator(workers, target, row_start, y_size, x_size, **kwargs):
+            if rows is not None:
+                f_output.write(rows)
+            if checkpoint:
+                checkpoint.commit(f_output, row_indices.stop)
+            progress_bar.update(len(row_indices))
+
+
+def open_rows_output(output_path, checkpoint, header, arr_depth, layout, kwargs, newline=None):
+    """Open the result and write its header.
+
+    Fixed-width result of a regular file is created with its final size,
+    so workers write rows at their offsets themselves, otherwise
+    rows are written by the parent process in order.
+
+    Args:
+        kwargs (dict): Arguments of workers, extended with positioned write ones.
+
+    Returns:
+        Tuple of file object and number of already written rows.
+    """
+    if layout and not checkpoint and output_path != STDOUT_PATH:
+        row_offsets = get_row_offsets(arr_depth, layout, len(header.encode()))
+        shared_offsets = mp.Array(typecode_or_type='q', size_or_initializer=row_offsets.size)
+        np.copyto(np.frombuffer(shared_offsets.get_obj(), dtype=np.int64), row_offsets)
+        kwargs.update(output_path=output_path, shared_offsets=shared_offsets)
+        return open_fixed_width_output(output_path, header, int(row_offsets[-1])), 0
+
+    f_output, row_start = open_output(output_path, checkpoint, newline='' if layout else newline)
+    if not row_start:
+        f_output.write(header)
+    return f_output, row_start
+
+
+def save_depth_array(arr_depth, output_path, x_min, y_min, layer, validity_codes, quite,
+                     x_correction, y_correction, z_correction, csv_delimiter, csv_skip_headers, csv_yxz,
+                     contour_interval=DEFAULT_CONTOUR_INTERVAL, checkpoint=None, workers=None,
+                     output_format=None, fixed_width=False, arr_code=None):
+    """Save depth array to *.csv, *.grd, *.geojson or *.las using worker processes.
+
+    Args:
+        arr_depth (np.ndarray): North-up depth (or validity codes) array indexed as `[row, column]`.
+        output_path (str): Path to the result file, `-` for stdout.
+        x_min (int): Minimal X tile coordinate.
+        y_min (int): Minimal Y tile coordinate.
+        layer (int): Data layer.
+        checkpoint (Checkpoint): Checkpoint of resumable conversion,
+            result is written to its partial file.
+        workers (int): Number of worker processes (defaults to available CPU count).
+        output_format (str): Format of the result, required for stdout.
+        fixed_width (bool): Write fixed-width values, workers write them
+            directly to the result file at precomputed offsets.
+        arr_code (np.ndarray): Validity codes array written to user data of LAS points.
+    """
+    workers = workers or get_cpu_count()
+    layer_parameters = SimpleNamespace(**LAYER_PARAMETERS[layer])
+    y_size, x_size = arr_depth.shape
+    output_path_ext = check_output_path(output_path, validity_codes, output_format, fixed_width)
+
+    if output_path_ext == '.geojson':
+        # GeoJSON depth contours
+        return save_contours(arr_depth, checkpoint.part_path if checkpoint else output_path, x_min, y_min, layer, quite,
+                             x_correction, y_correction, z_correction, contour_interval, workers=workers)
+
+    if output_path_ext == '.las':
+        # LAS point cloud, records are built in bulk by the parent process
+        return save_las(arr_depth, checkpoint.part_path if checkpoint else output_path, x_min, y_min, layer,
+                        validity_codes, quite, x_correction, y_correction, z_correction, arr_code)
+
+    x_orig = x_min * 90 / 2 ** 14
+    y_orig = y_min * 90 / 2 ** 14
+    layout = get_output_layout(arr_depth, output_path_ext, x_min, y_min, layer_parameters, validity_codes,
+                               x_correction, y_correction, z_correction, csv_delimiter, fixed_width)
+
+    # Create shared memory array that could be accessed from other
+    # processes instead of pickling and passing it on each fork.
+    mp_array_typecode = np.ctypeslib.as_ctypes(arr_depth.dtype.type())._type_
+    shared_array = mp.Array(typecode_or_type=mp_array_typecode,
+                            size_or_initializer=arr_depth.size)
+
+    np_shared_depth_array = shared_array_as_np(shared_array, y_size, x_size)
+    np.copyto(np_shared_depth_array, arr_depth)
+
+    # Save depth array to *.csv or *.grd
+    if output_path_ext == '.grd':
+        # ESRI ASCII grid
+        kwargs = dict(
+            shared_array=shared_array, validity_codes=validity_codes, z_correction=z_correction, layout=layout
+        )
+        header = format_grd_header(x_size, y_size, x_orig, y_orig, layer_parameters.a_step)
+        f_grd, row_start = open_rows_output(output_path, checkpoint, header, arr_depth, layout, kwargs)
+        with f_grd:
+            save_rows(f_grd, checkpoint, _('Saving Esri ASCII raster'), quite, workers, calculate_grd_rows,
+                      row_start, y_size, x_size, **kwargs)
+
+        # Write projection file
+        write_prj_file(output_path)
+
+    elif output_path_ext == '.csv':
+        # CSV table
+        kwargs = dict(
+            shared_array=shared_array, validity_codes=validity_codes,
+            x_orig=x_orig, y_orig=y_orig, layer=layer,
+            x_correction=x_correction, y_correction=y_correction, z_correction=z_correction,
+            csv_delimiter=csv_delimiter, csv_yxz=csv_yxz, layout=layout
+        )
+        header = format_csv_header(validity_codes, csv_skip_headers, csv_yxz, csv_delimiter)
+        f_csv, row_start = open_rows_output(output_path, checkpoint, header, arr_depth, layout, kwargs, newline='')
+        with f_csv:
+            save_rows(f_csv, checkpoint, _('Saving CSV table'), quite, workers, calculate_csv_rows,
+                      row_start, y_size, x_size, **kwargs)
@@ -0,0 +1,232 @@
+import json
+import math
+
+import numpy as np
+from pebble import ProcessPool
+from tqdm import tqdm
+
+from .tiles import LAYER_PARAMETERS, TILE_STEP, get_z_values
+
+# Default depth interval of contours in meters
+DEFAULT_CONTOUR_INTERVAL = 1.0
+
+# Number of grid rows processed at once
+CONTOURS_BAND_SIZE = 256
+
+# Cases of marching squares (corners above the level give bits
+# TL - 8, TR - 4, BR - 2, BL - 1) producing a segment between two cell
+# edges, saddle cases 5 and 10 are resolved by the cell center value.
+SEGMENT_CASES = (
+    # (edge_a, edge_b), plain cases, saddle case with high center, saddle case with low center
+    (('top', 'left'), (7, 8), 5, 10),
+    (('top', 'right'), (4, 11), 10, 5),
+    (('bottom', 'right'), (2, 13), 5, 10),
+    (('left', 'bottom'), (1, 14), 10, 5),
+    (('top', 'bottom'), (6, 9), None, None),
+    (('left', 'right'), (3, 12), None, None),
+)
+
+
+def get_contour_levels(arr_z, valid, interval):
+    """Get contour levels covering all valid values.
+
+    Args:
+        arr_z (np.ndarray): Depth array in meters.
+        valid (np.ndarray): Mask of valid cells.
+        interval (float): Depth interval in meters.
+
+    Returns:
+        Array of levels.
+    """
+    if interval <= 0:
+        raise ValueError(_('Contour interval must be positive'))
+    if not valid.any():
+        return np.empty(0)
+    z_min, z_max = arr_z[valid].min(), arr_z[valid].max()
+    return np.arange(math.ceil(z_min / interval), math.floor(z_max / interval) + 1) * interval
+
+
+def calculate_band_segments(band_z, band_valid, row_start, levels):
+    """Vectorized marching squares over a band of grid rows.
+
+    Edges of the grid are identified globally, so segments of
+    neighbouring bands could be joined afterwards: horizontal edge
+    between cells `(r, c)` and `(r, c + 1)` has id `2 * (r * x_size + c)`,
+    vertical edge between `(r, c)` and `(r + 1, c)` has id
+    `2 * (r * x_size + c) + 1`.
+
+    Args:
+        band_z (np.ndarray): Rows of the north-up depth array in meters,
+            including the first row of the next band.
+        band_valid (np.ndarray): Mask of valid cells of the band.
+        row_start (int): Index of the first band row in the depth array.
+        levels (np.ndarray): Contour levels.
+
+    Returns:
+        List of `(edge_ids, points)` per level, where `edge_ids` is an array
+        of shape (n, 2) and `points` is an array of shape (n, 2, 2) holding
+        `(column, row)` coordinates of segments ends.
+    """
+    x_size = band_z.shape[1]
+    z_tl, z_tr = band_z[:-1, :-1], band_z[:-1, 1:]
+    z_bl, z_br = band_z[1:, :-1], band_z[1:, 1:]
+    cells_valid = band_valid[:-1, :-1] & band_valid[:-1, 1:] & band_valid[1:, :-1] & band_valid[1:, 1:]
+    rows, cols = np.nonzero(cells_valid)
+    z_tl, z_tr, z_bl, z_br = z_tl[rows, cols], z_tr[rows, cols], z_bl[rows, cols], z_br[rows, cols]
+    z_center = (z_tl + z_tr + z_bl + z_br) / 4
+    rows = rows + row_start
+
+    # Edges of the cells as (id, z of the first end, z of the second end, first end (column, row), direction)
+    edges = {
+        'top': (2 * (rows * x_size + cols), z_tl, z_tr, (cols, rows), (1, 0)),
+        'bottom': (2 * ((rows + 1) * x_size + cols), z_bl, z_br, (cols, rows + 1), (1, 0)),
+        'left': (2 * (rows * x_size + cols) + 1, z_tl, z_bl, (cols, rows), (0, 1)),
+        'right': (2 * (rows * x_size + cols + 1) + 1, z_tr, z_br, (cols + 1, rows), (0, 1)),
+    }
+
+    result = []
+    for level in levels:
+        case = ((z_tl >= level) * 8 + (z_tr >= level) * 4 + (z_br >= level) * 2 + (z_bl >= level)).astype(np.int8)
+        high_center = z_center >= level
+
+        edge_ids, points = [], []
+        for (edge_a, edge_b), plain_cases, high_saddle, low_saddle in SEGMENT_CASES:
+            mask = np.isin(case, plain_cases)
+            if high_saddle is not None:
+                mask |= ((case == high_saddle) & high_center) | ((case == low_saddle) & ~high_center)
+            if not mask.any():
+                continue
+
+            segment_ids, segment_points = [], []
+            for edge in (edge_a, edge_b):
+                ids, z_1, z_2, (col, row), (d_col, d_row) = edges[edge]
+                z_1, z_2 = z_1[mask], z_2[mask]
+                t = (level - z_1) / (z_2 - z_1)
+                segment_ids.append(ids[mask])
+                segment_points.append(np.stack((col[mask] + t * d_col, row[mask] + t * d_row), axis=-1))
+            edge_ids.append(np.stack(segment_ids, axis=-1))
+            points.append(np.stack(segment_points, axis=1))
+
+        if edge_ids:
+            result.append((np.concatenate(edge_ids), np.concatenate(points)))
+        else:
+            result.append((np.empty((0, 2), dtype=np.int64), np.empty((0, 2, 2))))
+
+    return result
+
+
+def calculate_band_segments_worker(args):
+    """Multiprocessing contours worker."""
+    return calculate_band_segments(*args)
+
+
+def join_segments(edge_ids, points):
+    """Join segments sharing the same edges into lines.
+
+    Args:
+        edge_ids (np.ndarray): Edge ids of segments ends.
+        points (np.ndarray): Coordinates of segments ends.
+
+    Returns:
+        List of lines as arrays of `(column, row)` points.
+    """
+    # Every edge is shared by two cells at most
+    segment_ends = edge_ids.tolist()
+    edge_segments = {}
+    for n, (id_a, id_b) in enumerate(segment_ends):
+        edge_segments.setdefault(id_a, []).append(n)
+        edge_segments.setdefault(id_b, []).append(n)
+
+    edge_points = dict(zip(edge_ids.ravel().tolist(), points.reshape(-1, 2).tolist()))
+    used = [False] * len(segment_ends)
+
+    def walk(edge_id, n):
+        # Go along the chain of segments starting from segment `n` through edge `edge_id`
+        chain = []
+        while True:
+            used[n] = True
+            id_a, id_b = segment_ends[n]
+            edge_id = id_b if edge_id == id_a else id_a
+            chain.append(edge_id)
+            next_segments = [m for m in edge_segments[edge_id] if not used[m]]
+            if not next_segments:
+                return chain
+            n = next_segments[0]
+
+    lines = []
+    for n, (id_a, id_b) in enumerate(segment_ends):
+        if used[n]:
+            continue
+        forward = walk(id_a, n)
+        backward = [m for m in edge_segments[id_a] if not used[m]]
+        backward = walk(id_a, backward[0])[::-1] if backward else []
+        chain = backward + [id_a] + forward
+        lines.append(np.array([edge_points[edge_id] for edge_id in chain]))
+
+    return lines
+
+
+def save_contours(arr_depth, output_path, x_min, y_min, layer, quite, x_correction, y_correction, z_correction,
+                  contour_interval=DEFAULT_CONTOUR_INTERVAL, workers=1):
+    """Build depth contours and save them as GeoJSON LineStrings.
+
+    Args:
+        arr_depth (np.ndarray): North-up depth array indexed as `[row, column]`.
+        output_path (str): Path to the result *.geojson file.
+        x_min (int): Minimal X tile coordinate.
+        y_min (int): Minimal Y tile coordinate.
+        layer (int): Data layer.
+        quite (bool): Quite mode.
+        contour_interval (float): Depth interval of contours in meters.
+        workers (int): Number of worker processes.
+    """
+    a_step = LAYER_PARAMETERS[layer]['a_step']
+    y_size = arr_depth.shape[0]
+    x_orig = x_min * TILE_STEP
+    y_orig = y_min * TILE_STEP
+
+    valid = arr_depth != 0  # Same as NODATA_VALUE of the grid
+    arr_z = get_z_values(arr_depth, validity_codes=False) + z_correction
+    levels = get_contour_levels(arr_z, valid, contour_interval)
+
+    # Bands overlap by one row to get cells between them
+    bands = [(arr_z[row_start:row_start + CONTOURS_BAND_SIZE + 1],
+              valid[row_start:row_start + CONTOURS_BAND_SIZE + 1], row_start, levels)
+             for row_start in range(0, max(y_size - 1, 1), CONTOURS_BAND_SIZE)]
+
+    level_segments = [[] for level in levels]
+    with tqdm(total=len(bands), desc=_('Building depth contours'), disable=quite) as progress_bar:
+        if workers > 1:
+            with ProcessPool(max_workers=workers) as pool:
+                bands_segments = pool.map(calculate_band_segments_worker, bands).result()
+                for band_segments in bands_segments:
+                    for segments, band_level_segments in zip(level_segments, band_segments):
+                        segments.append(band_level_segments)
+                    progress_bar.update()
+        else:
+            for band in bands:
+                for segments, band_level_segments in zip(level_segments, calculate_band_segments(*band)):
+                    segments.append(band_level_segments)
+                progress_bar.update()
+
+    with open(output_path, 'w') as f_geojson:
+        f_geojson.write('{"type": "FeatureCollection", "features": [\n')
+        first_feature = True
+        for level, segments in tqdm(zip(levels.tolist(), level_segments), total=len(levels),
+                                    desc=_('Saving depth contours'), disable=quite):
+            edge_ids = np.concatenate([band_edge_ids for band_edge_ids, band_points in segments])
+            points = np.concatenate([band_points for band_edge_ids, band_points in segments])
+            for line in join_segments(edge_ids, points):
+                # Same cells coordinates as in CSV table
+                x = x_orig + a_step / 2 + line[:, 0] * a_step + x_correction
+                y = y_orig + a_step / 2 + (y_size - 1 - line[:, 1]) * a_step + y_correction
+                feature = {
+                    'type': 'Feature',
+                    'properties': {'depth': level},
+                    'geometry': {'type': 'LineString', 'coordinates': np.stack((x, y), axis=-1).tolist()},
+                }
+                if not first_feature:
+                    f_geojson.write(',\n')
+                f_geojson.write(json.dumps(feature))
+                first_feature = False
+        f_geojson.write('\n]}\n')
@@ -0,0 +1,286 @@
+import csv
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from .cli import format_grd_header, scan_layer_tiles, write_prj_file
+from .stats import get_values_summary
+from .tiles import (SECTOR_SIZE, TILE_STEP, decode_tile, get_grid_size,
+                    get_layer_parameters, get_tile_fingerprint,
+                    get_tile_slices, get_tiles_bounds)
+from .utils import patch_tqdm, print_error
+
+# Supported extensions of the diff result:
+#   *.csv - changed cells with old depth, new depth and delta,
+#   *.grd - ESRI ASCII grid of depth deltas,
+#   *.npy - north-up float32 raster of depth deltas, NaN where there is no delta.
+DIFF_EXTENSIONS = ('.csv', '.grd', '.npy')
+
+# No data value of GRD delta raster, zero is a valid delta
+DIFF_NODATA_VALUE = -9999
+
+# Statuses of matched tiles
+TILE_UNCHANGED, TILE_CHANGED, TILE_ADDED, TILE_REMOVED = 'unchanged', 'changed', 'added', 'removed'
+
+
+def is_same_tile(old_tile, new_tile, layer_parameters):
+    """Check if tiles have the same cells without decoding them."""
+    if old_tile is None or new_tile is None or old_tile.size != new_tile.size:
+        return False
+    return get_tile_fingerprint(old_tile, layer_parameters) == get_tile_fingerprint(new_tile, layer_parameters)
+
+
+def match_tiles(old_tiles, new_tiles, layer_parameters):
+    """Match tiles of two snapshots by tile coordinates.
+
+    Tiles with the same cells are compared by size and hash
+    of the cells region, they're never decoded. Tile with several
+    versions is unchanged only if all its versions are the same.
+
+    Args:
+        old_tiles (list): Tiles of the old snapshot.
+        new_tiles (list): Tiles of the new snapshot.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Returns:
+        List of `(status, old_tile, new_tile)` with the newest versions of tiles, missing tile is `None`.
+        Changed tiles follow the order of the new snapshot, removed ones go last.
+    """
+    old_versions, new_versions = {}, {}
+    for versions, tiles in ((old_versions, old_tiles), (new_versions, new_tiles)):
+        for tile in tiles:
+            versions.setdefault((tile.x, tile.y), []).append(tile)
+
+    matches = []
+    for key, new_tiles in new_versions.items():
+        old_tiles = old_versions.get(key)
+        if old_tiles is None:
+            matches.append((TILE_ADDED, None, new_tiles[-1]))
+        elif len(old_tiles) == len(new_tiles) and all(is_same_tile(old_tile, new_tile, layer_parameters)
+                                                      for old_tile, new_tile in zip(old_tiles, new_tiles)):
+            matches.append((TILE_UNCHANGED, old_tiles[-1], new_tiles[-1]))
+        else:
+            matches.append((TILE_CHANGED, old_tiles[-1], new_tiles[-1]))
+    matches.extend((TILE_REMOVED, old_tiles[-1], None) for key, old_tiles in old_versions.items()
+                   if key not in new_versions)
+    return matches
+
+
+def count_changes(old_depth, old_valid, new_depth, new_valid):
+    """Count changed cells of depth arrays.
+
+    Returns:
+        Tuple of summary dict and mask of changed cells.
+    """
+    both = old_valid & new_valid
+    changed = both & (old_depth != new_depth)
+    gained, lost = new_valid & ~old_valid, old_valid & ~new_valid
+    delta = (new_depth[changed].astype(np.int32) - old_depth[changed]) / 100
+    summary = {
+        'changed_cells': int(changed.sum()),
+        'gained_cells': int(gained.sum()),
+        'lost_cells': int(lost.sum()),
+        'delta': get_values_summary(delta),
+    }
+    return summary, changed | gained | lost
+
+
+class SnapshotDiff:
+    """Depth changes between two snapshots of QDC folder.
+
+    Only changed tiles and tiles overlapping them are decoded, cells of both
+    snapshots are placed into north-up arrays covering them and compared
+    within the changed tiles. A changed tile with the same cells after
+    overlaps are resolved is reported as unchanged.
+
+    Args:
+        old_folder_path (str): Path to folder with QDC files of the old snapshot.
+        new_folder_path (str): Path to folder with QDC files of the new snapshot.
+        layer (int): Data layer.
+        quite (bool): Quite mode.
+    """
+    def __init__(self, old_folder_path, new_folder_path, layer, quite=False):
+        self.layer = layer
+        self.layer_parameters = get_layer_parameters(layer)
+        old_tiles = scan_layer_tiles(old_folder_path, self.layer_parameters, quite)
+        new_tiles = scan_layer_tiles(new_folder_path, self.layer_parameters, quite)
+        if not old_tiles and not new_tiles:
+            raise RuntimeError(_('No valid QDC files found!'))
+
+        self.matches = match_tiles(old_tiles, new_tiles, self.layer_parameters)
+        self.tile_changes = []
+        self.shape = (0, 0)
+        self.x_min = self.y_min = None
+
+        changed = [(status, old_tile, new_tile) for status, old_tile, new_tile in self.matches
+                   if status != TILE_UNCHANGED]
+        if not changed:
+            return
+
+        # Tiles of layers 4 and 5 overlap, cells of changed tiles are compared after
+        # overlaps are resolved, so all tiles covering them are placed the same way as on export.
+        lp = self.layer_parameters
+        overlap = -(-(lp.n_sectors + 1) * SECTOR_SIZE // lp.l_size2)
+        changed_keys = {((new_tile or old_tile).x, (new_tile or old_tile).y) for _status, old_tile, new_tile in changed}
+        snapshots = {
+            name: [tile for tile in tiles if any((tile.x + dx, tile.y + dy) in changed_keys
+                                                 for dx in range(1 - overlap, overlap)
+                                                 for dy in range(1 - overlap, overlap))]
+            for name, tiles in (('old', old_tiles), ('new', new_tiles))
+        }
+
+        bounds = get_tiles_bounds(snapshots['old'] + snapshots['new'])
+        self.x_min, self.y_min = bounds[:2]
+        self.shape = get_grid_size(bounds, lp)
+        self.old_depth = np.zeros(self.shape, dtype=np.int16)
+        self.new_depth = np.zeros(self.shape, dtype=np.int16)
+        self.old_valid = np.zeros(self.shape, dtype=bool)
+        self.new_valid = np.zeros(self.shape, dtype=bool)
+
+        progress_bar = tqdm(total=len(snapshots['old']) + len(snapshots['new']), desc=_('Comparing tiles'),
+                            disable=quite)
+        progress_bar.nbytes = 0
+        for name, tiles in snapshots.items():
+            for tile in tiles:
+                block = get_tile_slices(tile, self.x_min, self.y_min, self.shape[0], lp)
+                tile_depth, tile_code = decode_tile(tile, lp)
+                # Overlapped cells are taken from the latest tile the same way as on export
+                np.copyto(getattr(self, f'{name}_depth')[block], tile_depth, where=tile_code != 0)
+                getattr(self, f'{name}_valid')[block] |= tile_code != 0
+                progress_bar.nbytes += tile.size
+                progress_bar.update()
+        progress_bar.close()
+
+        # Only cells of changed tiles are compared, the rest could be covered by tiles which aren't decoded
+        area = np.zeros(self.shape, dtype=bool)
+        blocks = {}
+        for match in changed:
+            tile = match[2] or match[1]
+            blocks[tile.x, tile.y] = get_tile_slices(tile, self.x_min, self.y_min, self.shape[0], lp)
+            area[blocks[tile.x, tile.y]] = True
+        self.old_valid &= area
+        self.new_valid &= area
+
+        for n, (status, old_tile, new_tile) in enumerate(self.matches):
+            if status == TILE_UNCHANGED:
+                continue
+            tile = new_tile or old_tile
+            block = blocks[tile.x, tile.y]
+            summary = count_changes(self.old_depth[block], self.old_valid[block],
+                                    self.new_depth[block], self.new_valid[block])[0]
+            if not (summary['changed_cells'] or summary['gained_cells'] or summary['lost_cells']):
+                # Cells of the tile are the same once overlaps are resolved, e.g. they've moved to another tile
+                self.matches[n] = (TILE_UNCHANGED, old_tile, new_tile)
+                continue
+            self.tile_changes.append(dict({
+                'x': tile.x, 'y': tile.y, 'status': status,
+                'old_path': old_tile.path if old_tile else None,
+                'new_path': new_tile.path if new_tile else None,
+            }, **summary))
+
+        if not self.tile_changes:
+            self.shape = (0, 0)
+            self.x_min = self.y_min = None
+
+    def get_delta(self):
+        """Get north-up raster of depth deltas in meters, NaN where either snapshot has no depth."""
+        if not self.tile_changes:
+            return np.empty(self.shape, dtype=np.float32)
+        delta = (self.new_depth.astype(np.int32) - self.old_depth) / 100
+        delta[~(self.old_valid & self.new_valid)] = np.nan
+        return delta
+
+    def get_summary(self):
+        """Get JSON serializable summary of changes."""
+        counts = {status: 0 for status in (TILE_UNCHANGED, TILE_CHANGED, TILE_ADDED, TILE_REMOVED)}
+        for status, old_tile, new_tile in self.matches:
+            counts[status] += 1
+
+        summary = {'layer': self.layer, 'tiles': counts}
+        if self.tile_changes:
+            summary.update(count_changes(self.old_depth, self.old_valid, self.new_depth, self.new_valid)[0])
+            summary['tile_bounds'] = {'x_min': self.x_min, 'y_min': self.y_min}
+            summary['grid'] = {'rows': self.shape[0], 'cols': self.shape[1]}
+        else:
+            summary.update({'changed_cells': 0, 'gained_cells': 0, 'lost_cells': 0, 'delta': None})
+        summary['tile_changes'] = self.tile_changes
+        return summary
+
+    def save(self, output_path, quite=False):
+        """Save changes to *.csv (changed cells), *.grd or *.npy (delta raster)."""
+        output_path_ext = os.path.splitext(output_path)[-1].lower()
+        y_size, x_size = self.shape
+        a_step = self.layer_parameters.a_step
+        x_orig = (self.x_min or 0) * TILE_STEP
+        y_orig = (self.y_min or 0) * TILE_STEP
+
+        if output_path_ext == '.npy':
+            np.save(output_path, self.get_delta().astype(np.float32))
+
+        elif output_path_ext == '.grd':
+            delta = self.get_delta()
+            with open(output_path, 'w') as f_grd:
+                f_grd.write(format_grd_header(x_size, y_size, x_orig, y_orig, a_step, DIFF_NODATA_VALUE))
+                for row in tqdm(delta, desc=_('Saving Esri ASCII raster'), disable=quite):
+                    row = np.where(np.isnan(row), DIFF_NODATA_VALUE, row)
+                    f_grd.write(' '.join(str(x) for x in row.tolist()) + '\n')
+            write_prj_file(output_path)
+
+        elif output_path_ext == '.csv':
+            with open(output_path, 'w', newline='') as f_csv:
+                writer = csv.writer(f_csv)
+                writer.writerow(['X', 'Y', 'Old(m)', 'New(m)', 'Delta(m)'])
+                if not self.tile_changes:
+                    return
+                mask = count_changes(self.old_depth, self.old_valid, self.new_depth, self.new_valid)[1]
+                for row_index in tqdm(range(y_size), desc=_('Saving CSV table'), disable=quite):
+                    i = np.flatnonzero(mask[row_index])
+                    j = y_size - 1 - row_index
+
+                    # Adding a_step / 2 to move point to the middle of the cell extent
+                    x = (x_orig + a_step / 2 + i * a_step).tolist()
+                    y = [y_orig + a_step / 2 + j * a_step] * len(x)
+                    old_depth, new_depth = self.old_depth[row_index, i], self.new_depth[row_index, i]
+                    old_valid, new_valid = self.old_valid[row_index, i], self.new_valid[row_index, i]
+                    old = np.where(old_valid, old_depth / 100, np.nan)
+                    new = np.where(new_valid, new_depth / 100, np.nan)
+                    delta = np.where(old_valid & new_valid, (new_depth.astype(np.int32) - old_depth) / 100, np.nan)
+                    values = [[None if v != v else v for v in values.tolist()] for values in (old, new, delta)]
+                    writer.writerows(zip(x, y, *values))
+
+
+def run_diff(old_folder_path, new_folder_path, layer, output_path=None, quite=False, message_queue=None):
+    """Compare two snapshots of QDC folder and save depth changes.
+
+    Args:
+        old_folder_path (str): Path to folder with QDC files of the old snapshot.
+        new_folder_path (str): Path to folder with QDC files of the new snapshot.
+        layer (int): Data layer.
+        output_path (str): Path to the result (*.csv, *.grd or *.npy), only summary is made without it.
+        quite (bool): Quite mode.
+        message_queue (multiprocessing.Queue): Message queue.
+
+    Returns:
+        JSON serializable summary of changes.
+    """
+    # Patch tqdm to duplicate messages up to the passed message queue.
+    if message_queue:
+        patch_tqdm(tqdm, message_queue)
+
+    try:
+        if output_path and os.path.splitext(output_path)[-1].lower() not in DIFF_EXTENSIONS:
+            raise ValueError(_('Diff result file extension must be *.csv (changed cells), '
+                               '*.grd (ESRI ASCII grid of deltas) or *.npy (raster of deltas)'))
+
+        snapshot_diff = SnapshotDiff(old_folder_path, new_folder_path, layer, quite)
+        if output_path:
+            snapshot_diff.save(output_path, quite)
+
+        summary = {'old_folder_path': old_folder_path, 'new_folder_path': new_folder_path}
+        summary.update(snapshot_diff.get_summary())
+        return summary
+
+    except Exception as e:
+        print_error(f'{_("Error")}: {e}', message_queue)
+        raise
@@ -0,0 +1,146 @@
+import csv
+import io
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from .tiles import get_z_values
+
+# Decimal places of fixed-width values
+FIXED_WIDTH_COORDINATE_DECIMALS = 10
+FIXED_WIDTH_DEPTH_DECIMALS = 2
+FIXED_WIDTH_CODE_DECIMALS = 8  # Fractional part of validity code is a multiple of 1/256
+
+# Characters of CSV delimiter which could get fixed-width values quoted
+FIXED_WIDTH_BAD_DELIMITER_CHARS = '0123456789.-"'
+
+
+def get_value_format(extreme_values, decimals):
+    """Get zero padded format of values with fixed number of decimal places.
+
+    Args:
+        extreme_values (iterable): Values of maximal absolute value, e.g. minimal and maximal ones.
+        decimals (int): Number of decimal places.
+
+    Returns:
+        Printf-style format, all values formatted with it have the same width.
+    """
+    width = max(len('%.*f' % (decimals, value)) for value in extreme_values)
+    return f'%0{width}.{decimals}f'
+
+
+def get_fixed_width_layout(arr_depth, output_path_ext, x_orig, y_orig, a_step, validity_codes,
+                           x_correction, y_correction, z_correction, csv_delimiter):
+    """Get formats of fixed-width values and size of the result rows.
+
+    Every GRD line and every CSV record gets the same length,
+    so byte offsets of the result rows could be computed up front.
+
+    Args:
+        arr_depth (np.ndarray): North-up depth (or validity codes) array.
+        output_path_ext (str): Extension of the result, `.csv` or `.grd`.
+        x_orig (float): Longitude of the depth array origin.
+        y_orig (float): Latitude of the depth array origin.
+        a_step (float): Size of a cell in degrees.
+
+    Returns:
+        SimpleNamespace with `x`, `y`, `z` value formats, `row_size` (size of a GRD line)
+        and `record_size` (size of a CSV record).
+    """
+    y_size, x_size = arr_depth.shape
+    if output_path_ext == '.csv' and any(char in FIXED_WIDTH_BAD_DELIMITER_CHARS for char in csv_delimiter):
+        raise ValueError(_('CSV delimiter "%s" could not be used with fixed-width values') % csv_delimiter)
+
+    raw_min, raw_max = (int(arr_depth.min()), int(arr_depth.max())) if arr_depth.size else (0, 0)
+    if validity_codes:
+        # Decoded validity codes are not monotonic, try all of them
+        z = get_z_values(np.arange(raw_min, raw_max + 1), validity_codes) + z_correction
+        z_format = get_value_format((z.min(), z.max()), FIXED_WIDTH_CODE_DECIMALS)
+    else:
+        z = get_z_values(np.array([raw_min, raw_max]), validity_codes) + z_correction
+        z_format = get_value_format(z.tolist(), FIXED_WIDTH_DEPTH_DECIMALS)
+
+    # Same arithmetic as `write_csv_rows` for the first and the last cells
+    x = x_orig + a_step / 2 + np.array([0, max(0, x_size - 1)]) * a_step + x_correction
+    y = y_orig + a_step / 2 + np.array([0, max(0, y_size - 1)]) * a_step + y_correction
+
+    layout = SimpleNamespace(
+        ext=output_path_ext,
+        x=get_value_format(x.tolist(), FIXED_WIDTH_COORDINATE_DECIMALS),
+        y=get_value_format(y.tolist(), FIXED_WIDTH_COORDINATE_DECIMALS),
+        z=z_format,
+    )
+    layout.row_size = x_size * (len(layout.z % 0) + 1)
+    record = io.StringIO()
+    csv.writer(record, delimiter=csv_delimiter).writerow([layout.x % 0, layout.y % 0, layout.z % 0])
+    layout.record_size = len(record.getvalue())
+    return layout
+
+
+def get_row_offsets(arr_depth, layout, header_size):
+    """Get byte offsets of the result rows.
+
+    Args:
+        arr_depth (np.ndarray): North-up depth (or validity codes) array.
+        layout (SimpleNamespace): Layout of the result.
+        header_size (int): Size of the result header.
+
+    Returns:
+        Array of `y_size + 1` offsets, the last one is size of the result.
+    """
+    y_size, x_size = arr_depth.shape
+    if layout.ext == '.grd':
+        row_sizes = np.full(y_size, layout.row_size, dtype=np.int64)
+    else:
+        # Only positive cells get CSV records
+        row_sizes = np.count_nonzero(arr_depth > 0, axis=1).astype(np.int64) * layout.record_size
+    return np.concatenate(([header_size], header_size + np.cumsum(row_sizes)))
+
+
+def open_fixed_width_output(output_path, header, size):
+    """Create the result file of the final size with header written.
+
+    Returns:
+        Binary file object of the result.
+    """
+    f_output = open(output_path, 'wb')
+    f_output.write(header.encode())
+    f_output.truncate(size)
+    f_output.flush()
+    return f_output
+
+
+def write_at(fd, data, offset):
+    """Write all data at the offset of the file without moving its position."""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            # Each worker has its own descriptor, so seeking is safe
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def write_rows_at(output_path, text, row_offsets, row_indices):
+    """Write formatted rows at their offsets of the pre-sized result file.
+
+    Args:
+        output_path (str): Path to the result file.
+        text (str): Formatted rows.
+        row_offsets (np.ndarray): Byte offsets of the result rows.
+        row_indices (range): Indices of the rows.
+    """
+    data = text.encode()
+    offset = int(row_offsets[row_indices.start])
+    if len(data) != row_offsets[row_indices.stop] - offset:
+        raise RuntimeError(_('Fixed-width rows %d-%d have unexpected size')
+                           % (row_indices.start, row_indices.stop - 1))
+    fd = os.open(output_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        write_at(fd, data, offset)
+    finally:
+        os.close(fd)
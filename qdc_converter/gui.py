@@ -5,13 +5,41 @@ import threading
 
 import PySimpleGUI as sg
 
-from .cli import run_cli
-from .utils import get_files_recursively, image_path
+from .cli import check_output_path, run_cli
+from .contours import DEFAULT_CONTOUR_INTERVAL
+from .stats import get_layer_summary, scan_layers_tiles
+from .tiles import LAYER_PARAMETERS, get_layer_parameters
+from .utils import image_path, iter_files_recursively
 from .version import version
 
 
+def format_progress(progress):
+    """Format progress message of `ProgressChannel` as status line."""
+    status = progress['stage'] or ''
+    if progress['eta'] is not None and progress['n'] < progress['total']:
+        minutes, seconds = divmod(int(progress['eta']), 60)
+        status += f' ({progress["n"]}/{progress["total"]}, ETA {minutes}:{seconds:02d})'
+    return status
+
+
+def format_catalog(files_count, layers_tiles, layer, complete):
+    """Format found QDC files, tiles by layer and extent of the chosen layer as status line."""
+    status = _('QDC files: %d') % files_count
+    layers_counts = [f'{tiles_layer}: {len(tiles)}' for tiles_layer, tiles in layers_tiles.items() if tiles]
+    if layers_counts:
+        status += ', ' + _('tiles by layer: %s') % ', '.join(layers_counts)
+    tiles = layers_tiles.get(layer)
+    if tiles:
+        west, south, east, north = get_layer_summary(tiles, get_layer_parameters(layer))['bbox']
+        status += ', ' + _('extent: %.4f..%.4f E, %.4f..%.4f N') % (west, east, south, north)
+    if not complete:
+        status += '...'
+    return status
+
+
 def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correction,
-            y_correction, z_correction, csv_delimiter, csv_skip_headers, csv_yxz, multithreaded):
+            y_correction, z_correction, csv_delimiter, csv_skip_headers, csv_yxz, multithreaded,
+            contour_interval=DEFAULT_CONTOUR_INTERVAL, resume=False, workers=None, fixed_width=False):
     """Run GUI with same passed arguments as CLI."""
     sg.theme('SandyBeach')
 
@@ -32,6 +60,7 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
     layer_title = t(_('Data layer (0 - Raw user data, 1 - Recommended).'), tail=':')
     validity_codes_title = t(_('Write validity code instead of depth.'))
     multithreaded_title = t(_('Enable multithreading.'))
+    resume_title = t(_('Resume interrupted conversion.'))
     csv_skip_headers_title = t(_('Do not write header.'))
     csv_yxz_title = t(_('Change column order from X,Y,Z to Y,X,Z.'),)
     window_description = t(window_description)
@@ -48,9 +77,12 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
                     sg.Text(input_dir_title),
                 ],
                 [
-                    sg.Input(qdc_folder_path, key='@qdc_folder_path', expand_x=True),
+                    sg.Input(qdc_folder_path, key='@qdc_folder_path', expand_x=True, enable_events=True),
                     sg.FolderBrowse(_('Browse')),
                 ],
+                [
+                    sg.Text(key='-Catalog-', font='Any 10'),
+                ],
             ])
         ],
         [
@@ -60,7 +92,9 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
                 ],
                 [
                     sg.Input(output_path, key='@output_path', expand_x=True),
-                    sg.FileSaveAs(_('Browse'), file_types=(('CSV Table', '*.csv'), ('ESRI ASCII grid', '*.grd')))
+                    sg.FileSaveAs(_('Browse'), file_types=(('CSV Table', '*.csv'), ('ESRI ASCII grid', '*.grd'),
+                                                           ('GeoJSON contours', '*.geojson'),
+                                                           ('LAS point cloud', '*.las')))
                 ],
             ]),
         ],
@@ -69,7 +103,7 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
                 [
                     sg.Text(layer_title),
                     sg.Combo(key='@layer', default_value=1 if layer is None else layer,
-                             size=(3, 1), values=(0, 1, 2, 3, 4, 5), readonly=True),
+                             size=(3, 1), values=(0, 1, 2, 3, 4, 5), readonly=True, enable_events=True),
                 ],
                 [
                     sg.Checkbox(validity_codes_title, key='@validity_codes', default=validity_codes),
@@ -77,6 +111,9 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
                 [
                     sg.Checkbox(multithreaded_title, key='@multithreaded', default=multithreaded),
                 ],
+                [
+                    sg.Checkbox(resume_title, key='@resume', default=resume),
+                ],
             ]),
         ],
         [
@@ -104,7 +141,8 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
 
     # Main window
     window = sg.Window(window_title, layout, auto_size_text=True, auto_size_buttons=False,
-                       default_element_size=(20, 1), text_justification='right', font='Any 12')
+                       default_element_size=(20, 1), text_justification='right', font='Any 12',
+                       finalize=True)
 
     # Process
     converter_process = None
@@ -115,6 +153,7 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
     convert_button = window['-Convert-']
     progress_bar = window['-ProgressBar-']
     progress_bar_title = window['-ProgressBarTitle-']
+    catalog_title = window['-Catalog-']
 
     # IPC message queue
     message_queue = mp.Queue()
@@ -122,7 +161,8 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
     # Create bridge between MP message queue and SG message queue
     def message_queue_bridge():
         # Perform message resend from subprocess
-        # message queue to parent GUI message queue.
+        # message queue to parent GUI message queue,
+        # progress messages are already coalesced by sender.
         while True:
             key, value = message_queue.get()
             window.write_event_value(key, value)
@@ -133,6 +173,36 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
     # Add message queue to args
     args['message_queue'] = message_queue
 
+    # Catalog of the input folder scanned in background, so the window isn't
+    # blocked by big folders and the converter doesn't walk the folder again.
+    catalog = {'path': None, 'stop_event': threading.Event(), 'files_count': 0, 'layers_tiles': {},
+               'complete': False}
+
+    def scan_catalog(path, stop_event):
+        def send_update(files_count, layers_tiles, complete=False):
+            if not complete:
+                # Snapshot of partial result, lists are still growing in this thread
+                layers_tiles = {layer: list(tiles) for layer, tiles in layers_tiles.items()}
+            window.write_event_value('-CatalogUpdate-', (path, files_count, layers_tiles, complete))
+
+        files_count, layers_tiles = scan_layers_tiles(path, list(LAYER_PARAMETERS), send_update, stop_event)
+        if not stop_event.is_set():
+            send_update(files_count, layers_tiles, complete=True)
+
+    def start_catalog(path):
+        catalog['stop_event'].set()
+        catalog.update(path=path, stop_event=threading.Event(), files_count=0, layers_tiles={}, complete=False)
+        catalog_title.update(value='')
+        if path and os.path.isdir(path):
+            threading.Thread(target=scan_catalog, args=(path, catalog['stop_event']), daemon=True).start()
+
+    def update_catalog_title(layer):
+        if catalog['path'] and os.path.isdir(catalog['path']):
+            catalog_title.update(value=format_catalog(catalog['files_count'], catalog['layers_tiles'], layer,
+                                                      catalog['complete']))
+
+    start_catalog(qdc_folder_path)
+
     def swap_buttons(state):
         if state:
             cancel_button.update(visible=True)
@@ -154,13 +224,23 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
         elif event == '#Error':
             sg.PopupError(values['#Error'], title=_('Error'), font='Any 12')
 
-        elif event == '#UpdateProgressBar':
-            current_value, max_value = values['#UpdateProgressBar']
-            progress_bar.update(current_count=current_value, max=max_value)
+        elif event == '#Progress':
+            progress = values['#Progress']
+            if progress['total']:
+                progress_bar.update(current_count=progress['n'], max=progress['total'])
+            progress_bar_title.update(value=format_progress(progress))
+
+        elif event == '@qdc_folder_path':
+            start_catalog(values['@qdc_folder_path'])
+
+        elif event == '@layer':
+            update_catalog_title(values['@layer'])
 
-        elif event == '#UpdateProgressBarTitle':
-            new_title = values['#UpdateProgressBarTitle']
-            progress_bar_title.update(value=new_title)
+        elif event == '-CatalogUpdate-':
+            path, files_count, layers_tiles, complete = values['-CatalogUpdate-']
+            if path == catalog['path']:  # Skip updates of the replaced scan
+                catalog.update(files_count=files_count, layers_tiles=layers_tiles, complete=complete)
+                update_catalog_title(values['@layer'])
 
         elif event == '-Cancel-':
             if converter_process_running():
@@ -177,24 +257,30 @@ def run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correc
                 sg.PopupError(_('Input path is not a folder!'), title=_('Error'), font='Any 12')
                 continue
 
-            # Validate input path contains *.qdc files
-            qdc_files = get_files_recursively(args['qdc_folder_path'], '.qdc')
-            if not qdc_files:
+            # Validate input path contains *.qdc files, the first one is enough
+            # unless the whole folder has been scanned already.
+            catalog_ready = catalog['complete'] and catalog['path'] == args['qdc_folder_path']
+            if catalog_ready:
+                qdc_files_found = catalog['files_count'] > 0
+            else:
+                qdc_files_found = next(iter_files_recursively(args['qdc_folder_path'], '.qdc'), None) is not None
+            if not qdc_files_found:
                 sg.PopupError(_('No *.qdc files found inside input path!'), title=_('Error'), font='Any 12')
                 continue
 
             # Validate output path
-            output_ext = os.path.splitext(args['output_path'])[1].lower()
-            if not any(output_ext == ext for ext in ('.csv', '.grd')):
-                sg.PopupError(_('Output file extension must be *.csv (CSV table) or *.grd (ESRI ASCII grid)'),
-                              title=_('Error'), font='Any 12')
+            try:
+                check_output_path(args['output_path'], args['validity_codes'])
+            except ValueError as e:
+                sg.PopupError(str(e), title=_('Error'), font='Any 12')
                 continue
 
             # Swap Conver/Cancel buttons
             swap_buttons(True)
 
-            # Run converter process
-            converter_process = mp.Process(target=run_cli, kwargs=args, daemon=False)
+            # Run converter process, tiles of the scanned folder are passed to it
+            tiles = catalog['layers_tiles'][args['layer']] if catalog_ready else None
+            converter_process = mp.Process(target=run_cli, kwargs=dict(args, tiles=tiles), daemon=False)
             converter_process.start()
 
             # Restore state on process finished
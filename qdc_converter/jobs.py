@@ -0,0 +1,299 @@
+import collections
+import itertools
+import json
+import multiprocessing as mp
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+
+from pebble import ProcessPool
+from tqdm import tqdm
+
+from .batch import JobMessageQueue, normalize_job
+from .cli import run_cli
+from .utils import LRUCache, get_cpu_count, mute_tqdm, print_error
+
+# Default number of decoded QDC tiles kept by each worker
+DEFAULT_JOBS_TILE_CACHE_SIZE = 1024
+
+# Default number of finished jobs kept by the service, the oldest ones are forgotten
+DEFAULT_JOBS_HISTORY_SIZE = 1000
+
+# Job states
+JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+# State of a worker process, set up by `init_worker`
+worker_state = {}
+
+
+def init_worker(message_queue, tile_cache_size):
+    """Set up long-living worker process."""
+    worker_state['message_queue'] = message_queue
+    worker_state['tile_cache'] = LRUCache(tile_cache_size)
+
+    # Progress is reported through the message queue, so progress bars are kept off the service output.
+    # Errors and warnings of the worker go to stderr as usual.
+    mute_tqdm(tqdm)
+
+
+def run_service_job(job_id, job):
+    """Pool worker, converts a single job using the worker's tile cache.
+
+    Returns:
+        Tuple of conversion time and size of the result file.
+    """
+    message_queue = JobMessageQueue(worker_state['message_queue'], job_id)
+    message_queue.put(('#Started', time.time()))
+    time_start = time.perf_counter()
+    run_cli(quite=False, multithreaded=False, message_queue=message_queue,
+            tile_cache=worker_state['tile_cache'], **job)
+    return time.perf_counter() - time_start, os.path.getsize(job['output_path'])
+
+
+class JobService:
+    """Queue of conversion jobs executed by a warm pool of worker processes.
+
+    Args:
+        concurrency (int): Number of jobs converted at once.
+        tile_cache_size (int): Number of decoded QDC tiles kept by each worker.
+        history_size (int): Number of finished jobs kept, the oldest ones are forgotten.
+    """
+    def __init__(self, concurrency=None, tile_cache_size=DEFAULT_JOBS_TILE_CACHE_SIZE,
+                 history_size=DEFAULT_JOBS_HISTORY_SIZE):
+        self.concurrency = concurrency or get_cpu_count()
+        self.history_size = history_size
+        self.message_queue = mp.Queue()
+        self.pool = ProcessPool(max_workers=self.concurrency, initializer=init_worker,
+                                initargs=(self.message_queue, tile_cache_size))
+        self.jobs = {}
+        self.futures = {}
+        self.finished_job_ids = collections.deque()
+        self.job_ids = itertools.count(1)
+        self.condition = threading.Condition()
+
+        self.listener = threading.Thread(target=self.listen, daemon=True)
+        self.listener.start()
+
+    def listen(self):
+        """Receive messages of the workers."""
+        while True:
+            message = self.message_queue.get()
+            if message is None:
+                break
+            job_id, (key, value) = message
+            with self.condition:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    continue  # Late message of a forgotten job
+                if key == '#Started':
+                    if job['status'] == JOB_QUEUED:
+                        job['status'] = JOB_RUNNING
+                    # Message could come after the job has finished, the real start time replaces the guess
+                    job['timings']['started'] = value
+                    job['timings']['wait'] = value - job['timings']['queued']
+                elif key == '#Progress':
+                    job['progress'] = value
+                elif key == '#Error':
+                    job['error'] = value
+                self.condition.notify_all()
+
+    def submit(self, raw_job):
+        """Validate and queue the job.
+
+        Args:
+            raw_job (dict): Parameters of `run_cli`, relative paths are resolved
+                against the service working folder.
+
+        Returns:
+            State of the job.
+        """
+        job = normalize_job(raw_job, os.getcwd())
+        with self.condition:
+            job_id = str(next(self.job_ids))
+            self.jobs[job_id] = {
+                'id': job_id, 'status': JOB_QUEUED, 'job': job, 'progress': None, 'error': None,
+                'output_size': None, 'timings': {'queued': time.time()},
+            }
+            future = self.futures[job_id] = self.pool.schedule(run_service_job, args=(job_id, job))
+        future.add_done_callback(lambda future: self.finish(job_id, future))
+        return self.get(job_id)
+
+    def finish(self, job_id, future):
+        """Update state of the finished job."""
+        with self.condition:
+            job = self.jobs[job_id]
+            timings = job['timings']
+            timings['finished'] = time.time()
+            # Cancelled job might have never started and start message of a quick one might be late
+            timings.setdefault('started', timings['finished'])
+            timings.setdefault('wait', timings['started'] - timings['queued'])
+            if future.cancelled():
+                job['status'] = JOB_CANCELLED
+            else:
+                try:
+                    job['timings']['run'], job['output_size'] = future.result()
+                    job['status'] = JOB_DONE
+                except Exception as e:
+                    job['status'] = JOB_FAILED
+                    job['error'] = job['error'] or f'{_("Error")}: {e}'
+            del self.futures[job_id]
+
+            self.finished_job_ids.append(job_id)
+            while len(self.finished_job_ids) > self.history_size:
+                del self.jobs[self.finished_job_ids.popleft()]
+            self.condition.notify_all()
+
+    def get(self, job_id, wait=None):
+        """Get state of the job.
+
+        Args:
+            job_id (str): Job id.
+            wait (float): Seconds to wait for the job to finish.
+
+        Returns:
+            Copy of the job state or `None` if there is no such job.
+        """
+        with self.condition:
+            if job_id not in self.jobs:
+                return None
+            if wait:
+                self.condition.wait_for(lambda: job_id not in self.futures, timeout=wait)
+            # Job could be forgotten while waiting
+            return json.loads(json.dumps(self.jobs[job_id])) if job_id in self.jobs else None
+
+    def list(self):
+        """Get states of all jobs."""
+        with self.condition:
+            return json.loads(json.dumps(list(self.jobs.values())))
+
+    def cancel(self, job_id):
+        """Cancel queued or running job.
+
+        Returns:
+            `True` if the job is going to be cancelled.
+        """
+        with self.condition:
+            future = self.futures.get(job_id)
+        return bool(future and future.cancel())
+
+    def close(self):
+        """Stop workers, running jobs are cancelled."""
+        self.pool.stop()
+        self.pool.join()
+        self.message_queue.put(None)
+        self.listener.join()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of the job service.
+
+    `POST /jobs` queues a job, `GET /jobs` lists jobs, `GET /jobs/<id>[?wait=<seconds>]`
+    gets a job state and `DELETE /jobs/<id>` cancels a job.
+    """
+    def do_GET(self):
+        service = self.server.service
+        path, _sep, query = self.path.partition('?')
+        parts = path.strip('/').split('/')
+
+        if parts == ['jobs']:
+            return self.send_json(200, service.list())
+        if len(parts) == 2 and parts[0] == 'jobs':
+            try:
+                wait = float(parse_qs(query).get('wait', [0])[0])
+            except ValueError:
+                return self.send_json(400, {'error': _('Wait must be a number of seconds')})
+            job = service.get(parts[1], wait)
+            if job:
+                return self.send_json(200, job)
+        self.send_json(404, {'error': _('Not found')})
+
+    def do_POST(self):
+        if self.path.strip('/') != 'jobs':
+            return self.send_json(404, {'error': _('Not found')})
+        try:
+            raw_job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'null')
+            if not isinstance(raw_job, dict):
+                raise ValueError(_('Job must be a JSON object'))
+            job = self.server.service.submit(raw_job)
+        except (ValueError, TypeError, AttributeError) as e:
+            return self.send_json(400, {'error': str(e)})
+        self.send_json(202, job)
+
+    def do_DELETE(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'jobs' and self.server.service.cancel(parts[1]):
+            return self.send_json(202, self.server.service.get(parts[1]))
+        self.send_json(404, {'error': _('Not found')})
+
+    def send_json(self, code, content):
+        content = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if not self.server.quite:
+            super().log_message(format, *args)
+
+
+class JobHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """Job service over TCP."""
+    daemon_threads = True
+
+    def __init__(self, server_address, service, quite=False):
+        super().__init__(server_address, JobRequestHandler)
+        self.service = service
+        self.quite = quite
+
+
+class JobUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Job service over a Unix socket."""
+    daemon_threads = True
+
+    def __init__(self, socket_path, service, quite=False):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # Left after previous run
+        super().__init__(socket_path, JobRequestHandler)
+        self.service = service
+        self.quite = quite
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def run_serve_jobs(host, port, socket_path=None, concurrency=None, tile_cache_size=DEFAULT_JOBS_TILE_CACHE_SIZE,
+                   quite=False, history_size=DEFAULT_JOBS_HISTORY_SIZE):
+    """Serve conversion jobs over HTTP or a Unix socket until interrupted."""
+    service = JobService(concurrency, tile_cache_size, history_size)
+    try:
+        if socket_path:
+            server = JobUnixServer(socket_path, service, quite)
+            address = socket_path
+        else:
+            server = JobHTTPServer((host, port), service, quite)
+            address = 'http://%s:%d/' % server.server_address[:2]
+    except Exception as e:
+        service.close()
+        print_error(f'{_("Error")}: {e}')
+        raise
+
+    if not quite:
+        print(_('Accepting jobs on %s with %d workers (press Ctrl+C to stop)') % (address, service.concurrency))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,149 @@
+import datetime
+import struct
+
+import numpy as np
+from tqdm import tqdm
+
+from .tiles import LAYER_PARAMETERS, TILE_STEP, get_z_values
+from .version import version
+
+# Number of grid rows converted into point records at once
+LAS_BAND_SIZE = 256
+
+# LAS 1.2 point data format 0 record
+LAS_POINT_DTYPE = np.dtype([
+    ('x', '<i4'), ('y', '<i4'), ('z', '<i4'),
+    ('intensity', '<u2'),
+    ('flags', 'u1'),  # Return number, number of returns, scan direction and edge of flight line
+    ('classification', 'u1'),
+    ('scan_angle_rank', 'i1'),
+    ('user_data', 'u1'),  # Integral part of validity code
+    ('point_source_id', '<u2'),
+])
+
+# Single return: return number 1 of 1
+LAS_SINGLE_RETURN_FLAGS = 1 | 1 << 3
+
+# Public header block of LAS 1.2
+LAS_HEADER_FORMAT = '<4sHH16sBB32s32sHHHIIBHI5I3d3d6d'
+LAS_HEADER_SIZE = struct.calcsize(LAS_HEADER_FORMAT)
+
+# Scales of Z, depth is stored in cm and fractional part of validity code is a multiple of 1/256
+LAS_DEPTH_SCALE = 0.01
+LAS_CODE_SCALE = 1 / 256
+
+
+def format_las_header(points_count, scales, offsets, mins, maxs):
+    """Format public header block of LAS 1.2 file without variable length records.
+
+    Args:
+        points_count (int): Number of point records.
+        scales (tuple): Scales of X, Y and Z.
+        offsets (tuple): Offsets of X, Y and Z.
+        mins (tuple): Minimal X, Y and Z.
+        maxs (tuple): Maximal X, Y and Z.
+
+    Returns:
+        Header bytes.
+    """
+    today = datetime.date.today()
+    return struct.pack(
+        LAS_HEADER_FORMAT,
+        b'LASF', 0, 0, b'\0' * 16, 1, 2,
+        b'OTHER', f'QDC Converter {version}'.encode()[:32],
+        today.timetuple().tm_yday, today.year,
+        LAS_HEADER_SIZE, LAS_HEADER_SIZE, 0,
+        0, LAS_POINT_DTYPE.itemsize, points_count,
+        points_count, 0, 0, 0, 0,
+        *scales, *offsets,
+        maxs[0], mins[0], maxs[1], mins[1], maxs[2], mins[2],
+    )
+
+
+def get_las_z(values, validity_codes):
+    """Get Z of values in units of `LAS_DEPTH_SCALE` or `LAS_CODE_SCALE`.
+
+    Both are exact, so Z values are the same as in CSV table.
+    """
+    if validity_codes:
+        return np.rint(get_z_values(values, validity_codes) / LAS_CODE_SCALE).astype(np.int32)
+    return values.astype(np.int32)
+
+
+def calculate_las_points(rows, codes, row_start, y_size, validity_codes):
+    """Convert positive cells of the depth array rows into LAS point records.
+
+    X and Y are doubled column and row indices plus one, so cells centers
+    are exact with half of the cell size scale.
+
+    Args:
+        rows (np.ndarray): Rows of the north-up depth array.
+        codes (np.ndarray): Validity codes of the rows or `None`.
+        row_start (int): Index of the first row in the depth array.
+        y_size (int): Number of rows of the depth array.
+        validity_codes (bool): Array contains validity codes.
+
+    Returns:
+        Structured array of point records.
+    """
+    row_indices, col_indices = np.nonzero(rows > 0)  # Skip all 0 values, same as CSV table
+    points = np.zeros(row_indices.size, dtype=LAS_POINT_DTYPE)
+    points['x'] = col_indices * 2 + 1
+    points['y'] = (y_size - 1 - row_start - row_indices) * 2 + 1
+    points['z'] = get_las_z(rows[row_indices, col_indices], validity_codes)
+    points['flags'] = LAS_SINGLE_RETURN_FLAGS
+    if codes is not None:
+        code_values = get_z_values(codes[row_indices, col_indices], validity_codes=True)
+        points['user_data'] = np.clip(np.floor(code_values), 0, 255)
+    return points
+
+
+def save_las(arr_depth, output_path, x_min, y_min, layer, validity_codes, quite, x_correction, y_correction,
+             z_correction, arr_code=None):
+    """Save positive cells of the depth array as LAS 1.2 point cloud.
+
+    Records are built as structured arrays by bands of rows and written in bulk.
+
+    Args:
+        arr_depth (np.ndarray): North-up depth (or validity codes) array indexed as `[row, column]`.
+        output_path (str): Path to the result *.las file.
+        x_min (int): Minimal X tile coordinate.
+        y_min (int): Minimal Y tile coordinate.
+        layer (int): Data layer.
+        validity_codes (bool): Array contains validity codes.
+        quite (bool): Quite mode.
+        arr_code (np.ndarray): Validity codes array written to user data of the points.
+    """
+    a_step = LAYER_PARAMETERS[layer]['a_step']
+    y_size = len(arr_depth)
+    if validity_codes:
+        arr_code = arr_depth
+
+    # Cells centers are x_orig + a_step / 2 + i * a_step, i.e. odd multiples of a half of a cell
+    z_scale = LAS_CODE_SCALE if validity_codes else LAS_DEPTH_SCALE
+    scales = (a_step / 2, a_step / 2, z_scale)
+    offsets = (x_min * TILE_STEP + x_correction, y_min * TILE_STEP + y_correction, z_correction)
+
+    points_count = 0
+    mins = np.full(3, np.iinfo(np.int32).max, dtype=np.int64)
+    maxs = np.full(3, np.iinfo(np.int32).min, dtype=np.int64)
+    with open(output_path, 'wb') as f_las:
+        # Header is written again when counts and bounds of the points are known
+        f_las.write(b'\0' * LAS_HEADER_SIZE)
+        for row_start in tqdm(range(0, y_size, LAS_BAND_SIZE), desc=_('Saving LAS point cloud'), disable=quite):
+            codes = arr_code[row_start:row_start + LAS_BAND_SIZE] if arr_code is not None else None
+            points = calculate_las_points(arr_depth[row_start:row_start + LAS_BAND_SIZE], codes, row_start, y_size,
+                                          validity_codes)
+            if not points.size:
+                continue
+            f_las.write(points.tobytes())
+            points_count += points.size
+            mins = np.minimum(mins, [points[axis].min() for axis in 'xyz'])
+            maxs = np.maximum(maxs, [points[axis].max() for axis in 'xyz'])
+
+        if not points_count:
+            mins = maxs = np.zeros(3, dtype=np.int64)
+        mins = [offset + value * scale for offset, value, scale in zip(offsets, mins.tolist(), scales)]
+        maxs = [offset + value * scale for offset, value, scale in zip(offsets, maxs.tolist(), scales)]
+        f_las.seek(0)
+        f_las.write(format_las_header(points_count, scales, offsets, mins, maxs))
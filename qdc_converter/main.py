@@ -1,3 +1,4 @@
+import json
 import multiprocessing as mp
 import os
 from contextlib import suppress
@@ -5,7 +6,18 @@ from contextlib import suppress
 import click
 from click_option_group import optgroup
 
-from .cli import run_cli
+from .batch import run_batch
+from .cli import STDOUT_FORMATS, run_cli
+from .contours import DEFAULT_CONTOUR_INTERVAL
+from .diff import run_diff
+from .jobs import (DEFAULT_JOBS_HISTORY_SIZE, DEFAULT_JOBS_TILE_CACHE_SIZE,
+                   run_serve_jobs)
+from .mosaic import MOSAIC_POLICIES, run_mosaic
+from .query import DEFAULT_QUERY_TILE_CACHE_SIZE, run_query
+from .server import (DEFAULT_DEPTH_RANGE, DEFAULT_PNG_CACHE_SIZE,
+                     DEFAULT_TILE_CACHE_SIZE, run_serve)
+from .shards import run_merge, run_shard
+from .stats import DEFAULT_HISTOGRAM_BINS, inspect_qdc
 from .utils import GUI_ENABLED, install_i18n
 from .version import version
 
@@ -22,18 +34,192 @@ if os.name == 'nt':
         mp.freeze_support()
 
 
+def output_options(func):
+    """Add correction, CSV and other options of the converter to the command."""
+    options = (
+        optgroup.group(_('Correction parameters'), help=_('Corrections')),
+        optgroup.option('--x-correction', '-dx', type=click.FLOAT, default=0.0, help=_('Correction of X.')),
+        optgroup.option('--y-correction', '-dy', type=click.FLOAT, default=0.0, help=_('Correction of Y.')),
+        optgroup.option('--z-correction', '-dz', type=click.FLOAT, default=0.0, help=_('Correction of Z.')),
+        optgroup.group(_('CSV parameters'), help=_('Parameters related to CSV')),
+        optgroup.option('--csv-delimiter', '-csvd', type=click.STRING, default=',',
+                        help=_('CSV delimiter (default ",").')),
+        optgroup.option('--csv-skip-headers', '-csvs', is_flag=True, help=_('Do not write header.')),
+        optgroup.option('--csv-yxz', '-csvy', is_flag=True, help=_('Change column order from X,Y,Z to Y,X,Z.')),
+        optgroup.group(_('Contours parameters'), help=_('Parameters related to GeoJSON depth contours')),
+        optgroup.option('--contour-interval', '-ci', type=click.FLOAT, default=DEFAULT_CONTOUR_INTERVAL,
+                        help=_('Depth interval of contours in meters (default 1.0).')),
+        optgroup.group(_('Other parameters'), help=_('Other converter parameters')),
+        optgroup.option('--singlethreaded', '-st', is_flag=True, help=_('Run converter in a single thread.')),
+        optgroup.option('--workers', '-w', type=click.IntRange(1), default=None,
+                        help=_('Number of worker processes (default is CPU count available to the process, '
+                               'including container quota).')),
+        optgroup.option('--validity-codes', '-vc', is_flag=True, help=_('Write validity code instead of depth.')),
+        optgroup.option('--fixed-width', '-fw', is_flag=True,
+                        help=_('Write zero padded values with fixed number of decimals, so worker processes '
+                               'write rows directly to the result file.')),
+        optgroup.option('--quite', '-q', is_flag=True, help=_('"Quite mode"')),
+    )
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
 @click.version_option(version=version)
-@click.command(help=_('QDC Converter.\n\nConverter of Garmin\'s QDC files into CSV or GRD.'))
+@click.group(invoke_without_command=True,
+             help=_('QDC Converter.\n\nConverter of Garmin\'s QDC files into CSV, GRD, GeoJSON depth contours '
+                    'or LAS point cloud, shards could also be merged into NPY raster.'))
 @optgroup.group(_('Main parameters'), help=_('Key parameters of the converter'))
-@optgroup.option('--qdc-folder-path', '-i', required=not GUI_ENABLED,
+@optgroup.option('--qdc-folder-path', '-i',
                  type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True),
                  help=_('Path to folder with QuickDraw Contours (QDC) inside.'))
-@optgroup.option('--output-path', '-o', required=not GUI_ENABLED,
+@optgroup.option('--output-path', '-o',
+                 type=click.Path(exists=False, resolve_path=True, file_okay=True, dir_okay=False, allow_dash=True),
+                 help=_('Path to the result file (*.csv, *.grd, *.geojson or *.las), '
+                        '"-" to stream the result to stdout.'))
+@optgroup.option('--format', '-f', 'output_format', type=click.Choice(STDOUT_FORMATS), default=None,
+                 help=_('Format of the result, required to stream the result to stdout.'))
+@optgroup.option('--layer', '-l',
+                 type=click.IntRange(0, 5), metavar='[0,1,2,3,4,5]',
+                 help=_('Data layer (0 - Raw user data, 1 - Recommended).'))
+@output_options
+@click.option('--resume', '-r', is_flag=True,
+              help=_('Resume interrupted conversion (progress is kept in "<output path>.resume" folder).'))
+@click.pass_context
+def main(ctx, qdc_folder_path, output_path, output_format, layer, validity_codes, quite, x_correction, y_correction,
+         z_correction, csv_delimiter, csv_skip_headers, csv_yxz, contour_interval, singlethreaded, workers, fixed_width,
+         resume):
+    if ctx.invoked_subcommand is not None:
+        # Subcommand takes care of its own arguments
+        return
+
+    multithreaded = not singlethreaded
+    if qdc_folder_path is None or output_path is None or layer is None:
+        if not GUI_ENABLED:
+            missing = [name for name, value in (('--qdc-folder-path', qdc_folder_path),
+                                                ('--output-path', output_path),
+                                                ('--layer', layer)) if value is None]
+            raise click.UsageError(_('Missing option(s): %s.') % ', '.join(missing))
+        return run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction,
+                       z_correction, csv_delimiter, csv_skip_headers, csv_yxz, multithreaded, contour_interval,
+                       resume, workers, fixed_width)
+    else:
+        return run_cli(qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction,
+                       z_correction, csv_delimiter, csv_skip_headers, csv_yxz, multithreaded,
+                       contour_interval=contour_interval, resume=resume, workers=workers,
+                       output_format=output_format, fixed_width=fixed_width)
+
+
+@main.command(help=_('Convert many QDC folders listed in a manifest (*.json or *.csv) using one worker pool.'))
+@click.argument('manifest_path', type=click.Path(exists=True, resolve_path=True, file_okay=True, dir_okay=False))
+@click.option('--workers', '-w', type=click.IntRange(1), default=None,
+              help=_('Number of worker processes (default is CPU count).'))
+@click.option('--quite', '-q', is_flag=True, help=_('"Quite mode"'))
+@click.pass_context
+def batch(ctx, manifest_path, workers, quite):
+    failed = run_batch(manifest_path, workers, quite)
+    if failed:
+        ctx.exit(1)
+
+
+@main.command(help=_('Merge several overlapping QDC folders into one CSV, GRD, GeoJSON contours or LAS point cloud.'))
+@optgroup.group(_('Main parameters'), help=_('Key parameters of the converter'))
+@optgroup.option('--qdc-folder-path', '-i', 'qdc_folder_paths', required=True, multiple=True,
+                 type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True),
+                 help=_('Path to folder with QuickDraw Contours (QDC) inside, could be passed several times.'))
+@optgroup.option('--output-path', '-o', required=True,
                  type=click.Path(exists=False, resolve_path=True, file_okay=True, dir_okay=False),
-                 help=_('Path to the result file (*.csv or *.grd).'))
-@optgroup.option('--layer', '-l', required=not GUI_ENABLED,
+                 help=_('Path to the result file (*.csv, *.grd, *.geojson or *.las).'))
+@optgroup.option('--layer', '-l', required=True,
                  type=click.IntRange(0, 5), metavar='[0,1,2,3,4,5]',
                  help=_('Data layer (0 - Raw user data, 1 - Recommended).'))
+@optgroup.option('--policy', '-p', type=click.Choice(MOSAIC_POLICIES), default='newest', show_default=True,
+                 help=_('Resolution of overlapped cells: newest file, minimal depth, mean depth '
+                        'or highest validity code.'))
+@output_options
+def mosaic(qdc_folder_paths, output_path, layer, policy, validity_codes, quite, x_correction, y_correction,
+           z_correction, csv_delimiter, csv_skip_headers, csv_yxz, contour_interval, singlethreaded, workers,
+           fixed_width):
+    multithreaded = not singlethreaded
+    return run_mosaic(qdc_folder_paths, output_path, layer, policy, validity_codes, quite, x_correction,
+                      y_correction, z_correction, csv_delimiter, csv_skip_headers, csv_yxz, multithreaded,
+                      contour_interval=contour_interval, workers=workers, fixed_width=fixed_width)
+
+
+@main.command(help=_('Report extent, tile counts and grid size of QDC layers as JSON without conversion.'))
+@click.option('--qdc-folder-path', '-i', required=True,
+              type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True),
+              help=_('Path to folder with QuickDraw Contours (QDC) inside.'))
+@click.option('--layer', '-l', 'layers', multiple=True,
+              type=click.IntRange(0, 5), metavar='[0,1,2,3,4,5]',
+              help=_('Data layer, could be passed several times (default is all layers).'))
+@click.option('--stats', '-s', is_flag=True,
+              help=_('Decode tiles and add coverage, depth range, percentiles and histograms.'))
+@click.option('--bins', '-b', type=click.IntRange(1), default=DEFAULT_HISTOGRAM_BINS, show_default=True,
+              help=_('Number of depth histogram bins.'))
+@click.option('--tiles', '-t', 'per_tile', is_flag=True, help=_('Add summary of every tile.'))
+@click.option('--output-path', '-o', type=click.Path(resolve_path=True, file_okay=True, dir_okay=False),
+              help=_('Path to the result *.json file (default is stdout).'))
+@click.option('--quite', '-q', is_flag=True, help=_('"Quite mode"'))
+def inspect(qdc_folder_path, layers, stats, bins, per_tile, output_path, quite):
+    report = inspect_qdc(qdc_folder_path, layers or None, stats, bins, per_tile, quite)
+    if output_path:
+        with open(output_path, 'w') as f_report:
+            json.dump(report, f_report, indent=2)
+    else:
+        click.echo(json.dumps(report, indent=2))
+
+
+@main.command(help=_('Compare two snapshots of QDC folder tile by tile, only changed tiles are decoded. '
+                     'Summary of changes is reported as JSON.'))
+@click.argument('old_folder_path', type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True))
+@click.argument('new_folder_path', type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True))
+@click.option('--layer', '-l', required=True,
+              type=click.IntRange(0, 5), metavar='[0,1,2,3,4,5]',
+              help=_('Data layer (0 - Raw user data, 1 - Recommended).'))
+@click.option('--output-path', '-o', type=click.Path(resolve_path=True, file_okay=True, dir_okay=False),
+              help=_('Path to changed cells (*.csv) or raster of depth deltas (*.grd or *.npy).'))
+@click.option('--summary-path', '-s', type=click.Path(resolve_path=True, file_okay=True, dir_okay=False),
+              help=_('Path to the summary *.json file (default is stdout).'))
+@click.option('--quite', '-q', is_flag=True, help=_('"Quite mode"'))
+def diff(old_folder_path, new_folder_path, layer, output_path, summary_path, quite):
+    summary = run_diff(old_folder_path, new_folder_path, layer, output_path, quite)
+    if summary_path:
+        with open(summary_path, 'w') as f_summary:
+            json.dump(summary, f_summary, indent=2)
+    else:
+        click.echo(json.dumps(summary, indent=2))
+
+
+@main.command(help=_('Convert a part of QDC folder limited by tile coordinates into a shard '
+                     '(partial raster *.npy and metadata *.json) to be merged later.'))
+@click.option('--qdc-folder-path', '-i', required=True,
+              type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True),
+              help=_('Path to folder with QuickDraw Contours (QDC) inside.'))
+@click.option('--output-path', '-o', required=True,
+              type=click.Path(exists=False, resolve_path=True, file_okay=True, dir_okay=False),
+              help=_('Path to the shard, *.npy and *.json files are written next to it.'))
+@click.option('--layer', '-l', required=True,
+              type=click.IntRange(0, 5), metavar='[0,1,2,3,4,5]',
+              help=_('Data layer (0 - Raw user data, 1 - Recommended).'))
+@click.option('--shard', '-s', metavar='K/N',
+              help=_('Shard number K of N, tile rows are split between shards evenly.'))
+@click.option('--x-range', '-x', metavar='START:END', help=_('Inclusive range of X tile coordinates.'))
+@click.option('--y-range', '-y', metavar='START:END', help=_('Inclusive range of Y tile coordinates.'))
+@click.option('--validity-codes', '-vc', is_flag=True, help=_('Write validity code instead of depth.'))
+@click.option('--quite', '-q', is_flag=True, help=_('"Quite mode"'))
+def shard(qdc_folder_path, output_path, layer, shard, x_range, y_range, validity_codes, quite):
+    if shard and y_range:
+        raise click.UsageError(_('Options --shard and --y-range are mutually exclusive.'))
+    return run_shard(qdc_folder_path, output_path, layer, validity_codes, quite, x_range, y_range, shard)
+
+
+@main.command(help=_('Merge shards into CSV, GRD or NPY without loading the whole grid.'))
+@click.argument('shard_paths', nargs=-1, required=True,
+                type=click.Path(exists=True, resolve_path=True, file_okay=True, dir_okay=True))
+@click.option('--output-path', '-o', required=True,
+              type=click.Path(exists=False, resolve_path=True, file_okay=True, dir_okay=False),
+              help=_('Path to the result file (*.csv, *.grd or *.npy).'))
 @optgroup.group(_('Correction parameters'), help=_('Corrections'))
 @optgroup.option('--x-correction', '-dx', type=click.FLOAT, default=0.0, help=_('Correction of X.'))
 @optgroup.option('--y-correction', '-dy', type=click.FLOAT, default=0.0, help=_('Correction of Y.'))
@@ -42,17 +228,77 @@ if os.name == 'nt':
 @optgroup.option('--csv-delimiter', '-csvd', type=click.STRING, default=',', help=_('CSV delimiter (default ",").'))
 @optgroup.option('--csv-skip-headers', '-csvs', is_flag=True, help=_('Do not write header.'))
 @optgroup.option('--csv-yxz', '-csvy', is_flag=True, help=_('Change column order from X,Y,Z to Y,X,Z.'))
-@optgroup.group(_('Other parameters'), help=_('Other converter parameters'))
-@optgroup.option('--singlethreaded', '-st', is_flag=True, help=_('Run converter in a single thread.'))
-@optgroup.option('--validity-codes', '-vc', is_flag=True, help=_('Write validity code instead of depth.'))
-@optgroup.option('--quite', '-q', is_flag=True, help=_('"Quite mode"'))
-def main(qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction, z_correction,
-         csv_delimiter, csv_skip_headers, csv_yxz, singlethreaded):
-    multithreaded = not singlethreaded
-    if qdc_folder_path is None or output_path is None or layer is None:
-        assert GUI_ENABLED
-        return run_gui(qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction,
-                       z_correction, csv_delimiter, csv_skip_headers, csv_yxz, multithreaded)
-    else:
-        return run_cli(qdc_folder_path, output_path, layer, validity_codes, quite, x_correction, y_correction,
-                       z_correction, csv_delimiter, csv_skip_headers, csv_yxz, multithreaded)
+@click.option('--quite', '-q', is_flag=True, help=_('"Quite mode"'))
+def merge(shard_paths, output_path, x_correction, y_correction, z_correction, csv_delimiter, csv_skip_headers,
+          csv_yxz, quite):
+    return run_merge(shard_paths, output_path, quite, x_correction, y_correction, z_correction, csv_delimiter,
+                     csv_skip_headers, csv_yxz)
+
+
+@main.command(help=_('Get depth and validity code of points listed in CSV file (X,Y per line) '
+                     'straight from QDC files, only tiles hit by the points are decoded.'))
+@click.argument('points_path', type=click.Path(exists=True, file_okay=True, dir_okay=False, allow_dash=True))
+@click.option('--qdc-folder-path', '-i', required=True,
+              type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True),
+              help=_('Path to folder with QuickDraw Contours (QDC) inside.'))
+@click.option('--layer', '-l', required=True,
+              type=click.IntRange(0, 5), metavar='[0,1,2,3,4,5]',
+              help=_('Data layer (0 - Raw user data, 1 - Recommended).'))
+@click.option('--output-path', '-o', type=click.Path(resolve_path=True, file_okay=True, dir_okay=False),
+              help=_('Path to the result *.csv file (default is stdout).'))
+@optgroup.group(_('Correction parameters'), help=_('Corrections'))
+@optgroup.option('--x-correction', '-dx', type=click.FLOAT, default=0.0, help=_('Correction of X.'))
+@optgroup.option('--y-correction', '-dy', type=click.FLOAT, default=0.0, help=_('Correction of Y.'))
+@optgroup.option('--z-correction', '-dz', type=click.FLOAT, default=0.0, help=_('Correction of Z.'))
+@optgroup.group(_('CSV parameters'), help=_('Parameters related to CSV'))
+@optgroup.option('--csv-delimiter', '-csvd', type=click.STRING, default=',', help=_('CSV delimiter (default ",").'))
+@optgroup.option('--csv-skip-headers', '-csvs', is_flag=True, help=_('Do not write header.'))
+@optgroup.option('--csv-yxz', '-csvy', is_flag=True, help=_('Points and result columns are in Y,X order.'))
+@click.option('--tile-cache', type=click.IntRange(1), default=DEFAULT_QUERY_TILE_CACHE_SIZE, show_default=True,
+              help=_('Number of decoded QDC tiles kept in memory.'))
+@click.option('--quite', '-q', is_flag=True, help=_('"Quite mode"'))
+def query(points_path, qdc_folder_path, layer, output_path, x_correction, y_correction, z_correction, csv_delimiter,
+          csv_skip_headers, csv_yxz, tile_cache, quite):
+    return run_query(qdc_folder_path, points_path, output_path, layer, quite, x_correction, y_correction,
+                     z_correction, csv_delimiter, csv_skip_headers, csv_yxz, tile_cache)
+
+
+@main.command(help=_('Serve web mercator PNG tiles (/{z}/{x}/{y}.png) rendered on demand from QDC files.'))
+@click.option('--qdc-folder-path', '-i', required=True,
+              type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True),
+              help=_('Path to folder with QuickDraw Contours (QDC) inside.'))
+@click.option('--layer', '-l', required=True,
+              type=click.IntRange(0, 5), metavar='[0,1,2,3,4,5]',
+              help=_('Data layer (0 - Raw user data, 1 - Recommended).'))
+@click.option('--host', default='127.0.0.1', show_default=True, help=_('Host to listen on.'))
+@click.option('--port', '-p', type=click.IntRange(0, 65535), default=8000, show_default=True,
+              help=_('Port to listen on.'))
+@click.option('--workers', '-w', type=click.IntRange(1), default=8, show_default=True,
+              help=_('Number of request handling threads.'))
+@click.option('--depth-range', '-d', type=click.FLOAT, nargs=2, default=DEFAULT_DEPTH_RANGE, show_default=True,
+              help=_('Depth in meters of the first and the last colour of the ramp.'))
+@click.option('--tile-cache', type=click.IntRange(1), default=DEFAULT_TILE_CACHE_SIZE, show_default=True,
+              help=_('Number of decoded QDC tiles kept in memory.'))
+@click.option('--png-cache', type=click.IntRange(1), default=DEFAULT_PNG_CACHE_SIZE, show_default=True,
+              help=_('Number of rendered PNG tiles kept in memory.'))
+@click.option('--quite', '-q', is_flag=True, help=_('"Quite mode"'))
+def serve(qdc_folder_path, layer, host, port, workers, depth_range, tile_cache, png_cache, quite):
+    return run_serve(qdc_folder_path, layer, host, port, workers, depth_range, tile_cache, png_cache, quite)
+
+
+@main.command('serve-jobs', help=_('Accept conversion jobs (JSON with the same parameters as batch manifest '
+                                   'entries) over HTTP or a Unix socket and run them in a warm worker pool.'))
+@click.option('--host', default='127.0.0.1', show_default=True, help=_('Host to listen on.'))
+@click.option('--port', '-p', type=click.IntRange(0, 65535), default=8001, show_default=True,
+              help=_('Port to listen on.'))
+@click.option('--socket', '-s', 'socket_path', type=click.Path(resolve_path=True, dir_okay=False),
+              help=_('Path to Unix socket to listen on instead of HTTP port.'))
+@click.option('--concurrency', '-c', type=click.IntRange(1), default=None,
+              help=_('Number of jobs converted at once (default is CPU count).'))
+@click.option('--tile-cache', type=click.IntRange(1), default=DEFAULT_JOBS_TILE_CACHE_SIZE, show_default=True,
+              help=_('Number of decoded QDC tiles kept in memory by each worker.'))
+@click.option('--history', type=click.IntRange(1), default=DEFAULT_JOBS_HISTORY_SIZE, show_default=True,
+              help=_('Number of finished jobs kept, the oldest ones are forgotten.'))
+@click.option('--quite', '-q', is_flag=True, help=_('"Quite mode"'))
+def serve_jobs(host, port, socket_path, concurrency, tile_cache, history, quite):
+    return run_serve_jobs(host, port, socket_path, concurrency, tile_cache, quite, history)
@@ -0,0 +1,127 @@
+import numpy as np
+from tqdm import tqdm
+
+from .cli import check_output_path, report_skipped_tiles
+from .contours import DEFAULT_CONTOUR_INTERVAL
+from .tiles import (decode_tile, deduplicate_tiles, get_grid_size,
+                    get_layer_parameters, get_tile_slices, get_tiles_bounds,
+                    scan_tiles)
+from .utils import patch_tqdm, print_error
+
+# Policies of overlapped cells resolution:
+#   newest   - cell of the most recently modified file wins,
+#   min      - minimal depth wins,
+#   mean     - mean of all valid cells,
+#   max-code - cell with the highest validity code wins.
+MOSAIC_POLICIES = ('newest', 'min', 'mean', 'max-code')
+
+
+def build_mosaic(qdc_folder_paths, layer, policy, validity_codes, quite):
+    """Merge tiles of several QDC folders into one depth array.
+
+    Each tile is decoded once and merged into the array as a whole block,
+    only cells with non-zero validity code take part in the merge.
+
+    Args:
+        qdc_folder_paths (list): Paths to folders with QDC files.
+        layer (int): Data layer.
+        policy (str): One of `MOSAIC_POLICIES`.
+        validity_codes (bool): Merge validity codes instead of depth.
+        quite (bool): Quite mode.
+
+    Returns:
+        Tuple of north-up depth array indexed as `[row, column]`, `x_min` and `y_min`.
+    """
+    if policy not in MOSAIC_POLICIES:
+        raise ValueError(_('Unknown mosaic policy: %s') % policy)
+
+    layer_parameters = get_layer_parameters(layer)
+    tiles = [tile for qdc_folder_path in qdc_folder_paths
+             for tile in scan_tiles(qdc_folder_path, layer_parameters)]
+
+    # Identical copies would only skew the merge, other versions are resolved by the policy
+    tiles, duplicates = deduplicate_tiles(tiles, layer_parameters)
+    report_skipped_tiles(duplicates, quite)
+
+    # Older tiles go first, so newer ones overwrite them
+    tiles.sort(key=lambda tile: (tile.mtime, tile.path))
+
+    bounds = get_tiles_bounds(tiles)
+    x_min, y_min = bounds[:2]
+    grid_size = get_grid_size(bounds, layer_parameters)
+    y_size = grid_size[0]
+
+    arr_depth = np.zeros(grid_size, dtype=np.int16)
+    if policy == 'mean':
+        arr_sum = np.zeros(grid_size, dtype=np.int64)
+        arr_count = np.zeros(grid_size, dtype=np.uint16)
+    elif policy == 'max-code':
+        arr_code = np.zeros(grid_size, dtype=np.int16)
+    if policy in ('min', 'max-code'):
+        arr_filled = np.zeros(grid_size, dtype=bool)
+
+    progress_bar = tqdm(tiles, desc=_('Calculating depth map'), disable=quite)
+    progress_bar.nbytes = 0
+    for tile in progress_bar:
+        progress_bar.nbytes += tile.size
+        tile_depth, tile_code = decode_tile(tile, layer_parameters)
+        tile_value = tile_code if validity_codes else tile_depth
+        tile_valid = tile_code != 0
+
+        block = get_tile_slices(tile, x_min, y_min, y_size, layer_parameters)
+        block_depth = arr_depth[block]
+
+        if policy == 'newest':
+            np.copyto(block_depth, tile_value, where=tile_valid)
+
+        elif policy == 'min':
+            block_filled = arr_filled[block]
+            replace = tile_valid & (~block_filled | (tile_value < block_depth))
+            np.copyto(block_depth, tile_value, where=replace)
+            block_filled |= tile_valid
+
+        elif policy == 'mean':
+            arr_sum[block] += np.where(tile_valid, tile_value, 0)
+            arr_count[block] += tile_valid
+
+        elif policy == 'max-code':
+            block_filled, block_code = arr_filled[block], arr_code[block]
+            replace = tile_valid & (~block_filled | (tile_code > block_code))
+            np.copyto(block_depth, tile_value, where=replace)
+            np.copyto(block_code, tile_code, where=replace)
+            block_filled |= tile_valid
+
+    if policy == 'mean':
+        covered = arr_count > 0
+        arr_depth[covered] = np.rint(arr_sum[covered] / arr_count[covered]).astype(np.int16)
+
+    return arr_depth, x_min, y_min
+
+
+def run_mosaic(qdc_folder_paths, output_path, layer, policy, validity_codes, quite, x_correction, y_correction,
+               z_correction, csv_delimiter, csv_skip_headers, csv_yxz, multithreaded, message_queue=None,
+               contour_interval=DEFAULT_CONTOUR_INTERVAL, workers=None, fixed_width=False):
+    """Merge several QDC folders and save result to *.csv, *.grd, *.geojson or *.las."""
+    # Patch tqdm to duplicate messages up to the passed message queue.
+    if message_queue:
+        patch_tqdm(tqdm, message_queue)
+
+    try:
+        # Some arguments validation
+        check_output_path(output_path, validity_codes, fixed_width=fixed_width)
+
+        arr_depth, x_min, y_min = build_mosaic(qdc_folder_paths, layer, policy, validity_codes, quite)
+
+        args = (arr_depth, output_path, x_min, y_min, layer, validity_codes, quite,
+                x_correction, y_correction, z_correction, csv_delimiter, csv_skip_headers, csv_yxz,
+                contour_interval)
+        if multithreaded:
+            from .cli_multithreaded import save_depth_array
+            save_depth_array(*args, workers=workers, fixed_width=fixed_width)
+        else:
+            from .cli import save_depth_array
+            save_depth_array(*args, fixed_width=fixed_width)
+
+    except Exception as e:
+        print_error(f'{_("Error")}: {e}', message_queue)
+        raise
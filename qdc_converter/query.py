@@ -0,0 +1,223 @@
+import csv
+import io
+import sys
+
+import numpy as np
+
+from .cli import STDOUT_PATH, scan_layer_tiles
+from .tiles import SECTOR_SIZE, decode_tile, get_layer_parameters, get_z_values
+from .utils import LRUCache, print_error
+
+# Default number of decoded QDC tiles kept in memory
+DEFAULT_QUERY_TILE_CACHE_SIZE = 256
+
+
+class DepthQuery:
+    """Depth lookup of many points straight from QDC tiles.
+
+    Points are mapped to tiles and cells the same way as cells
+    are placed by the converter, only tiles hit by the points are decoded.
+
+    Args:
+        qdc_folder_path (str): Path to folder with QDC files.
+        layer (int): Data layer.
+        tile_cache_size (int): Number of decoded QDC tiles kept in memory.
+        quite (bool): Quite mode.
+        tiles (list): Tiles of the layer already found in the folder, it isn't scanned again.
+    """
+    def __init__(self, qdc_folder_path, layer, tile_cache_size=DEFAULT_QUERY_TILE_CACHE_SIZE, quite=False,
+                 tiles=None):
+        self.layer_parameters = get_layer_parameters(layer)
+        # Versions of the same tile go from the oldest to the newest
+        self.tiles = scan_layer_tiles(qdc_folder_path, self.layer_parameters, quite, tiles)
+        if not self.tiles:
+            raise RuntimeError(_('No valid QDC files found!'))
+
+        # Tiles are placed in the order they were found, so later tiles win where they overlap
+        self.tiles_orders = {}
+        for n, tile in enumerate(self.tiles):
+            self.tiles_orders.setdefault((tile.x, tile.y), []).append(n)
+        self.versions_count = max(len(orders) for orders in self.tiles_orders.values())
+        self.tile_cache = LRUCache(tile_cache_size)
+
+    def get_cells(self, tile):
+        """Get decoded cells of QDC tile using cache.
+
+        Returns:
+            Tuple of north-up depth (in cm) and validity code arrays.
+        """
+        cells = self.tile_cache.get(tile)
+        if cells is None:
+            cells = decode_tile(tile, self.layer_parameters)
+            # Tile holds size and mtime, so changed files aren't taken from cache
+            self.tile_cache.put(tile, cells)
+        return cells
+
+    def get_hits(self, cols, rows):
+        """Find tiles covering cells of the points.
+
+        Args:
+            cols (np.ndarray): Global column indices of the points cells.
+            rows (np.ndarray): Global row indices of the points cells (from south to north).
+
+        Returns:
+            Tuple of points indices and keys of tiles covering them,
+            sorted by the order of the tiles.
+        """
+        lp = self.layer_parameters
+        size = (lp.n_sectors + 1) * SECTOR_SIZE
+        tile_xs, tile_ys = cols // lp.l_size2, rows // lp.l_size2
+
+        # Tiles of layers 4 and 5 overlap and a tile could have several versions,
+        # so a cell could belong to several tiles
+        overlap = -(-size // lp.l_size2)
+        points, orders = [], []
+        for dx in range(overlap):
+            for dy in range(overlap):
+                keys = np.stack((tile_xs - dx, tile_ys - dy), axis=1)
+                unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+                keys_orders = [self.tiles_orders.get(key, []) for key in map(tuple, unique_keys.tolist())]
+                for version in range(self.versions_count):
+                    key_orders = np.array([key_orders[version] if version < len(key_orders) else -1
+                                           for key_orders in keys_orders], dtype=np.int64)
+                    point_orders = key_orders[inverse.ravel()]
+                    hit = np.flatnonzero(point_orders >= 0)
+                    points.append(hit)
+                    orders.append(point_orders[hit])
+
+        points, orders = np.concatenate(points), np.concatenate(orders)
+        sorting = np.argsort(orders, kind='stable')
+        return points[sorting], orders[sorting]
+
+    def query(self, xs, ys, x_correction=0.0, y_correction=0.0, z_correction=0.0):
+        """Get depth and validity code of the points.
+
+        Coordinates and Z values follow corrections of the converter, so points
+        of a converted CSV with the same corrections give the same Z values back.
+
+        Args:
+            xs (array_like): Longitudes of the points.
+            ys (array_like): Latitudes of the points.
+            x_correction (float): Correction of X.
+            y_correction (float): Correction of Y.
+            z_correction (float): Correction of Z, added to depth.
+
+        Returns:
+            Tuple of depth in meters (`nan` where there is no depth) and
+            decoded validity codes (0 where there is no data).
+        """
+        lp = self.layer_parameters
+        size = (lp.n_sectors + 1) * SECTOR_SIZE
+        xs = np.asarray(xs, dtype=np.float64) - x_correction
+        ys = np.asarray(ys, dtype=np.float64) - y_correction
+        cols = np.floor(xs / lp.a_step).astype(np.int64)
+        rows = np.floor(ys / lp.a_step).astype(np.int64)
+
+        raw_depth = np.zeros(xs.shape, dtype=np.int16)
+        raw_code = np.zeros(xs.shape, dtype=np.int16)
+        has_depth = np.zeros(xs.shape, dtype=bool)
+
+        points, orders = self.get_hits(cols.ravel(), rows.ravel())
+        boundaries = np.flatnonzero(np.diff(orders)) + 1
+        tile_orders = orders[np.r_[0, boundaries]].tolist() if orders.size else []
+        for tile_points, order in zip(np.split(points, boundaries), tile_orders):
+            tile = self.tiles[order]
+            local_cols = cols.flat[tile_points] - tile.x * lp.l_size2
+            local_rows = rows.flat[tile_points] - tile.y * lp.l_size2
+            inside = (local_cols >= 0) & (local_cols < size) & (local_rows >= 0) & (local_rows < size)
+            if not inside.any():
+                continue
+
+            tile_points = tile_points[inside]
+            tile_depth, tile_code = self.get_cells(tile)
+            # Decoded tiles are north-up
+            cells = size - 1 - local_rows[inside], local_cols[inside]
+            code = tile_code[cells]
+            valid = code != 0
+
+            # Same as export: codes are written as is, depth only where code isn't zero
+            raw_code.flat[tile_points] = code
+            raw_depth.flat[tile_points[valid]] = tile_depth[cells][valid]
+            has_depth.flat[tile_points[valid]] = True
+
+        depth = np.where(has_depth, get_z_values(raw_depth, False) + z_correction, np.nan)
+        return depth, get_z_values(raw_code, True)
+
+
+def read_points(points_path, csv_delimiter=',', csv_yxz=False):
+    """Read points coordinates from CSV file, header is optional.
+
+    Args:
+        points_path (str): Path to CSV file of points, `-` for stdin.
+        csv_delimiter (str): CSV delimiter.
+        csv_yxz (bool): Columns are in Y,X order.
+
+    Returns:
+        Tuple of X and Y coordinates arrays.
+    """
+    if points_path == STDOUT_PATH:
+        rows = list(csv.reader(sys.stdin, delimiter=csv_delimiter))
+    else:
+        with open(points_path, 'r', newline='') as f_points:
+            rows = list(csv.reader(f_points, delimiter=csv_delimiter))
+
+    rows = [row for row in rows if row]
+    if rows:
+        try:
+            float(rows[0][0])
+        except ValueError:
+            rows = rows[1:]  # Header
+
+    try:
+        points = np.array([row[:2] for row in rows], dtype=np.float64).reshape(-1, 2)
+    except (ValueError, IndexError):
+        raise ValueError(_('Points must be pairs of coordinates separated by "%s"') % csv_delimiter)
+    if csv_yxz:
+        points = points[:, ::-1]
+    return points[:, 0], points[:, 1]
+
+
+def format_query_result(xs, ys, depth, code, csv_delimiter=',', csv_skip_headers=False, csv_yxz=False):
+    """Format points with their depth and validity code as CSV.
+
+    Returns:
+        CSV text, depth of points without data is empty.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=csv_delimiter, lineterminator='\n')
+    columns = ['y', 'x'] if csv_yxz else ['x', 'y']
+    if not csv_skip_headers:
+        writer.writerow(columns + ['z', 'code'])
+
+    coordinates = (ys, xs) if csv_yxz else (xs, ys)
+    for a, b, z, c in zip(*(values.tolist() for values in coordinates + (depth, code))):
+        writer.writerow([a, b, '' if z != z else z, c])
+    return output.getvalue()
+
+
+def run_query(qdc_folder_path, points_path, output_path, layer, quite, x_correction=0.0, y_correction=0.0,
+              z_correction=0.0, csv_delimiter=',', csv_skip_headers=False, csv_yxz=False,
+              tile_cache_size=DEFAULT_QUERY_TILE_CACHE_SIZE):
+    """Query depth of points from CSV file and write them with depth and validity code.
+
+    Args:
+        qdc_folder_path (str): Path to folder with QDC files.
+        points_path (str): Path to CSV file of points, `-` for stdin.
+        output_path (str): Path to the result CSV file, `None` or `-` for stdout.
+    """
+    try:
+        xs, ys = read_points(points_path, csv_delimiter, csv_yxz)
+        depth_query = DepthQuery(qdc_folder_path, layer, tile_cache_size, quite)
+        depth, code = depth_query.query(xs, ys, x_correction, y_correction, z_correction)
+        result = format_query_result(xs, ys, depth, code, csv_delimiter, csv_skip_headers, csv_yxz)
+
+        if output_path in (None, STDOUT_PATH):
+            sys.stdout.write(result)
+            sys.stdout.flush()
+        else:
+            with open(output_path, 'w', newline='') as f_output:
+                f_output.write(result)
+
+    except Exception as e:
+        print_error(f'{_("Error")}: {e}')
+        raise
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .version import version
+
+# Minimal interval between journal commits in seconds
+CHECKPOINT_INTERVAL = 5
+
+
+class Checkpoint:
+    """State of a resumable conversion.
+
+    Lives in `<output_path>.resume` folder next to the result file and keeps
+    decoded depth array, partially written result file and a journal of
+    committed rows (`<rows written> <bytes written>` per line). The result
+    file gets moved to `output_path` only when the conversion is finished.
+
+    Args:
+        output_path (str): Path to the result file.
+        qdc_files (list): Paths to QDC files.
+        parameters (dict): Conversion parameters affecting the result.
+    """
+    def __init__(self, output_path, qdc_files, parameters):
+        self.output_path = output_path
+        self.work_path = output_path + '.resume'
+        self.grid_path = os.path.join(self.work_path, 'grid.npy')
+        self.meta_path = os.path.join(self.work_path, 'meta.json')
+        self.journal_path = os.path.join(self.work_path, 'journal')
+        self.part_path = os.path.join(self.work_path, 'output' + os.path.splitext(output_path)[-1])
+        self.time_committed = time.monotonic()
+
+        files_hash = hashlib.sha1()
+        for qdc_file in sorted(qdc_files):
+            qdc_file_stat = os.stat(qdc_file)
+            files_hash.update(f'{qdc_file}\0{qdc_file_stat.st_size}\0{qdc_file_stat.st_mtime_ns}\n'.encode())
+        self.meta = {'version': version, 'parameters': parameters, 'files': files_hash.hexdigest()}
+
+        if self.read_meta() != self.meta:
+            # Nothing to resume, start over
+            shutil.rmtree(self.work_path, ignore_errors=True)
+            os.makedirs(self.work_path)
+            self.write_atomic(self.meta_path, lambda f: f.write(json.dumps(self.meta).encode()))
+
+    def read_meta(self):
+        """Read metadata of the saved state."""
+        try:
+            with open(self.meta_path, 'r') as f_meta:
+                return json.load(f_meta)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def write_atomic(path, write):
+        """Write file through temporary one, so it's never left truncated."""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def get_grid_path(self, name='grid'):
+        """Get path to the saved array, `grid` is the depth array."""
+        return self.grid_path if name == 'grid' else os.path.join(self.work_path, name + '.npy')
+
+    def load_grid(self, name='grid'):
+        """Load saved depth array or another array of the conversion.
+
+        Returns:
+            Read-only array or `None` if it hasn't been saved.
+        """
+        grid_path = self.get_grid_path(name)
+        if os.path.exists(grid_path):
+            return np.load(grid_path, mmap_mode='r')
+        return None
+
+    def save_grid(self, arr_depth, name='grid'):
+        """Save decoded depth array or another array of the conversion."""
+        self.write_atomic(self.get_grid_path(name), lambda f: np.save(f, arr_depth))
+
+    def get_position(self):
+        """Get last committed position of the result file.
+
+        Returns:
+            Tuple of number of written rows and bytes.
+        """
+        rows, offset = 0, 0
+        if os.path.exists(self.journal_path) and os.path.exists(self.part_path):
+            with open(self.journal_path, 'r') as f_journal:
+                for line in f_journal:
+                    if line.endswith('\n'):  # Skip partially written line
+                        rows, offset = map(int, line.split())
+        return rows, offset
+
+    def open_output(self, newline=None):
+        """Open partial result file at last committed position.
+
+        Args:
+            newline (str): Same as for `open`.
+
+        Returns:
+            Tuple of file object and number of written rows.
+        """
+        rows, offset = self.get_position()
+        if rows:
+            os.truncate(self.part_path, offset)
+            return open(self.part_path, 'a', newline=newline), rows
+
+        with open(self.journal_path, 'w'):
+            pass
+        return open(self.part_path, 'w', newline=newline), 0
+
+    def commit(self, f_output, rows, force=False):
+        """Commit written rows to the journal.
+
+        Commits are made not more often than `CHECKPOINT_INTERVAL` seconds
+        unless `force` is set.
+
+        Args:
+            f_output (file): Partial result file.
+            rows (int): Number of rows written.
+            force (bool): Commit regardless of time passed.
+        """
+        if not force and time.monotonic() - self.time_committed < CHECKPOINT_INTERVAL:
+            return
+
+        f_output.flush()
+        os.fsync(f_output.fileno())
+        with open(self.journal_path, 'a') as f_journal:
+            f_journal.write(f'{rows} {f_output.tell()}\n')
+            f_journal.flush()
+            os.fsync(f_journal.fileno())
+        self.time_committed = time.monotonic()
+
+    def finish(self):
+        """Move the result file into place and remove saved state."""
+        os.replace(self.part_path, self.output_path)
+        shutil.rmtree(self.work_path, ignore_errors=True)
@@ -0,0 +1,327 @@
+import json
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+
+from .cli import scan_layer_tiles
+from .tiles import decode_tile, get_layer_parameters
+from .utils import LRUCache, print_error
+
+# Size of a web map tile side in pixels
+MAP_TILE_SIZE = 256
+
+# Default depth range of the colour ramp in meters
+DEFAULT_DEPTH_RANGE = (0.0, 30.0)
+
+# Colour ramp stops from shallow to deep water as (position, R, G, B)
+COLOUR_RAMP = np.array([
+    (0.0, 222, 247, 255),
+    (0.25, 158, 216, 240),
+    (0.5, 84, 163, 214),
+    (0.75, 33, 102, 172),
+    (1.0, 8, 48, 107),
+])
+
+# Default sizes of the caches in items
+DEFAULT_TILE_CACHE_SIZE = 1024
+DEFAULT_PNG_CACHE_SIZE = 4096
+
+VIEWER_HTML = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>QDC Converter</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html, body, #map {{ height: 100%; margin: 0; }}</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var map = L.map('map').fitBounds([[{south}, {west}], [{north}, {east}]]);
+L.tileLayer('https://tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
+    attribution: '&copy; OpenStreetMap contributors', maxZoom: 22}}).addTo(map);
+L.tileLayer('/{{z}}/{{x}}/{{y}}.png', {{maxZoom: 22}}).addTo(map);
+</script>
+</body>
+</html>
+'''
+
+
+def encode_png(rgba):
+    """Encode RGBA image as PNG.
+
+    Args:
+        rgba (np.ndarray): Image of shape (height, width, 4) and `uint8` type.
+
+    Returns:
+        PNG file content.
+    """
+    height, width = rgba.shape[:2]
+
+    def chunk(chunk_type, data):
+        crc = zlib.crc32(chunk_type + data) & 0xffffffff
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', crc)
+
+    # Each scanline starts with filter type byte, 0 stands for no filter
+    scanlines = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rgba.reshape(height, width * 4)
+
+    return b''.join((
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 6)),
+        chunk(b'IEND', b''),
+    ))
+
+
+def colourize(depth, valid, depth_range):
+    """Apply colour ramp to depth values.
+
+    Args:
+        depth (np.ndarray): Depth in meters.
+        valid (np.ndarray): Mask of cells with data, others are transparent.
+        depth_range (tuple): Depth of the first and the last ramp colour.
+
+    Returns:
+        RGBA image.
+    """
+    depth_min, depth_max = depth_range
+    position = np.clip((depth - depth_min) / max(depth_max - depth_min, 1e-9), 0, 1)
+    rgba = np.zeros(depth.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(position, COLOUR_RAMP[:, 0], COLOUR_RAMP[:, channel + 1])
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def get_map_tile_coordinates(z, x, y):
+    """Get longitude and latitude of web mercator tile pixels centers.
+
+    Returns:
+        Tuple of longitudes of columns and latitudes of rows.
+    """
+    n = 2 ** z
+    pixels = (np.arange(MAP_TILE_SIZE) + 0.5) / MAP_TILE_SIZE
+    lon = (x + pixels) / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pixels) / n))))
+    return lon, lat
+
+
+class TileRenderer:
+    """Renderer of web mercator tiles straight from QDC tiles.
+
+    Args:
+        qdc_folder_path (str): Path to folder with QDC files.
+        layer (int): Data layer.
+        depth_range (tuple): Depth range of the colour ramp in meters.
+        tile_cache_size (int): Number of decoded QDC tiles kept in memory.
+        png_cache_size (int): Number of rendered PNG tiles kept in memory.
+        quite (bool): Quite mode.
+    """
+    def __init__(self, qdc_folder_path, layer, depth_range=DEFAULT_DEPTH_RANGE,
+                 tile_cache_size=DEFAULT_TILE_CACHE_SIZE, png_cache_size=DEFAULT_PNG_CACHE_SIZE, quite=False):
+        self.layer_parameters = get_layer_parameters(layer)
+        self.depth_range = depth_range
+        # Versions of the same tile go from the oldest to the newest
+        self.tiles = {}
+        for tile in scan_layer_tiles(qdc_folder_path, self.layer_parameters, quite):
+            self.tiles.setdefault((tile.x, tile.y), []).append(tile)
+        if not self.tiles:
+            raise RuntimeError(_('No valid QDC files found!'))
+
+        self.tiles_order = {key: n for n, key in enumerate(self.tiles)}
+        self.tile_cache = LRUCache(tile_cache_size)
+        self.png_cache = LRUCache(png_cache_size)
+
+    def get_bounds(self):
+        """Get west, south, east and north bounds of the data in degrees."""
+        lp = self.layer_parameters
+        size = (lp.n_sectors + 1) * 32
+        xs = [x for x, y in self.tiles]
+        ys = [y for x, y in self.tiles]
+        return (min(xs) * lp.l_size2 * lp.a_step, min(ys) * lp.l_size2 * lp.a_step,
+                (max(xs) * lp.l_size2 + size) * lp.a_step, (max(ys) * lp.l_size2 + size) * lp.a_step)
+
+    def get_cells(self, key):
+        """Get decoded cells of QDC tile using cache.
+
+        Versions of the tile are overlaid, newer valid cells win.
+
+        Returns:
+            Tuple of depth in meters and mask of valid cells, both are south-up.
+        """
+        cells = self.tile_cache.get(key)
+        if cells is None:
+            depth = valid = None
+            for tile in self.tiles[key]:
+                tile_depth, tile_code = decode_tile(tile, self.layer_parameters)
+                if depth is None:
+                    depth, valid = tile_depth.copy(), tile_code != 0
+                else:
+                    np.copyto(depth, tile_depth, where=tile_code != 0)
+                    valid |= tile_code != 0
+            cells = depth[::-1] / 100, valid[::-1]
+            self.tile_cache.put(key, cells)
+        return cells
+
+    def get_candidates(self, tile_xs, tile_ys):
+        """Get keys of QDC tiles which could contain cells of the tile columns and rows.
+
+        Args:
+            tile_xs (np.ndarray): X tile coordinates of the cells columns.
+            tile_ys (np.ndarray): Y tile coordinates of the cells rows.
+
+        Returns:
+            Keys of tiles in the order they were found.
+        """
+        lp = self.layer_parameters
+        size = (lp.n_sectors + 1) * 32
+
+        # Tiles of layers 4 and 5 overlap, so a cell could belong to several tiles
+        overlap = -(-size // lp.l_size2)
+        tile_xs = set((tile_xs[:, np.newaxis] - np.arange(overlap)).ravel().tolist())
+        tile_ys = set((tile_ys[:, np.newaxis] - np.arange(overlap)).ravel().tolist())
+
+        if len(tile_xs) * len(tile_ys) < len(self.tiles):
+            candidates = [(x, y) for x in tile_xs for y in tile_ys if (x, y) in self.tiles]
+        else:
+            candidates = [(x, y) for x, y in self.tiles if x in tile_xs and y in tile_ys]
+        return sorted(candidates, key=self.tiles_order.get)
+
+    def render(self, z, x, y):
+        """Render web mercator tile.
+
+        Returns:
+            RGBA image.
+        """
+        lp = self.layer_parameters
+        size = (lp.n_sectors + 1) * 32
+        lon, lat = get_map_tile_coordinates(z, x, y)
+
+        # Global cell indices of the pixels columns and rows
+        cols = np.floor(lon / lp.a_step).astype(np.int64)
+        rows = np.floor(lat / lp.a_step).astype(np.int64)
+
+        depth = np.zeros((MAP_TILE_SIZE, MAP_TILE_SIZE))
+        valid = np.zeros((MAP_TILE_SIZE, MAP_TILE_SIZE), dtype=bool)
+
+        for key in self.get_candidates(np.unique(cols // lp.l_size2), np.unique(rows // lp.l_size2)):
+            local_cols, local_rows = cols - key[0] * lp.l_size2, rows - key[1] * lp.l_size2
+            pixel_cols = np.flatnonzero((local_cols >= 0) & (local_cols < size))
+            pixel_rows = np.flatnonzero((local_rows >= 0) & (local_rows < size))
+            if not pixel_cols.size or not pixel_rows.size:
+                continue
+
+            tile_depth, tile_valid = self.get_cells(key)
+            cells = np.ix_(local_rows[pixel_rows], local_cols[pixel_cols])
+            pixels = np.ix_(pixel_rows, pixel_cols)
+            depth[pixels] = np.where(tile_valid[cells], tile_depth[cells], depth[pixels])
+            valid[pixels] |= tile_valid[cells]
+
+        return colourize(depth, valid, self.depth_range)
+
+    def get_png(self, z, x, y):
+        """Get rendered PNG tile using cache."""
+        png = self.png_cache.get((z, x, y))
+        if png is None:
+            png = encode_png(self.render(z, x, y))
+            self.png_cache.put((z, x, y), png)
+        return png
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """Handler of `/{z}/{x}/{y}.png`, `/tiles.json` (TileJSON) and `/` (viewer page)."""
+    def do_GET(self):
+        renderer = self.server.renderer
+        path = self.path.split('?')[0].strip('/')
+
+        try:
+            if path == '':
+                west, south, east, north = renderer.get_bounds()
+                return self.send(VIEWER_HTML.format(west=west, south=south, east=east, north=north).encode(),
+                                 'text/html; charset=utf-8')
+
+            if path == 'tiles.json':
+                host = self.headers.get('Host', '%s:%d' % self.server.server_address[:2])
+                return self.send(json.dumps({
+                    'tilejson': '2.2.0',
+                    'tiles': [f'http://{host}/{{z}}/{{x}}/{{y}}.png'],
+                    'bounds': list(renderer.get_bounds()),
+                }).encode(), 'application/json')
+
+            z, x, y = path[:-4].split('/') if path.endswith('.png') else (None, None, None)
+            z, x, y = int(z), int(x), int(y)
+        except (TypeError, ValueError):
+            return self.send_error(404)
+
+        if not (0 <= z <= 30 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return self.send_error(404)
+        self.send(renderer.get_png(z, x, y), 'image/png')
+
+    def send(self, content, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if not self.server.quite:
+            super().log_message(format, *args)
+
+
+class TileServer(HTTPServer):
+    """HTTP server handling requests in a thread pool.
+
+    Args:
+        server_address (tuple): Host and port.
+        renderer (TileRenderer): Tiles renderer.
+        workers (int): Number of threads.
+        quite (bool): Quite mode, requests aren't logged.
+    """
+    def __init__(self, server_address, renderer, workers=8, quite=False):
+        super().__init__(server_address, TileRequestHandler)
+        self.renderer = renderer
+        self.quite = quite
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        # Requests being handled are completed before the server is closed
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def run_serve(qdc_folder_path, layer, host, port, workers, depth_range=DEFAULT_DEPTH_RANGE,
+              tile_cache_size=DEFAULT_TILE_CACHE_SIZE, png_cache_size=DEFAULT_PNG_CACHE_SIZE, quite=False):
+    """Serve web mercator PNG tiles rendered from QDC files until interrupted."""
+    try:
+        renderer = TileRenderer(qdc_folder_path, layer, depth_range, tile_cache_size, png_cache_size, quite)
+        server = TileServer((host, port), renderer, workers, quite)
+    except Exception as e:
+        print_error(f'{_("Error")}: {e}')
+        raise
+
+    if not quite:
+        print(_('Serving tiles on http://%s:%d/ (press Ctrl+C to stop)') % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
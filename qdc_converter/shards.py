@@ -0,0 +1,255 @@
+import glob
+import json
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from .cli import check_output_path, save_depth_array, scan_layer_tiles
+from .resume import Checkpoint
+from .tiles import (fill_depth_array, get_grid_size, get_layer_parameters,
+                    get_tiles_bounds)
+from .utils import patch_tqdm, print_error
+from .version import version
+
+# Number of merged rows assembled at once
+SHARDS_BAND_SIZE = 256
+
+# Supported extensions of the merge result, *.npy is a north-up int16 raster
+MERGE_EXTENSIONS = ('.csv', '.grd', '.npy')
+
+
+def parse_range(value):
+    """Parse inclusive tile coordinates range `START:END`, any end could be omitted.
+
+    Returns:
+        Tuple of range ends, `None` for open ones.
+    """
+    if value is None:
+        return None, None
+    try:
+        start, end = value.split(':')
+        return (int(start) if start.strip() else None), (int(end) if end.strip() else None)
+    except ValueError:
+        raise ValueError(_('Tile range must be in START:END format, got %s') % value)
+
+
+def parse_shard(value):
+    """Parse shard number `K/N` where `K` is in range [1, N]."""
+    try:
+        index, count = map(int, value.split('/'))
+    except ValueError:
+        raise ValueError(_('Shard must be in K/N format, got %s') % value)
+    if not 1 <= index <= count:
+        raise ValueError(_('Shard number must be in range [1, %d], got %d') % (count, index))
+    return index, count
+
+
+def get_shard_y_range(tiles, index, count):
+    """Get range of tile rows of the shard.
+
+    Distinct tile rows are split in `count` nearly equal parts.
+
+    Args:
+        tiles (list): All tiles of the layer.
+        index (int): Shard number starting from 1.
+        count (int): Number of shards.
+
+    Returns:
+        Inclusive range of Y tile coordinates or `None` if the shard is empty.
+    """
+    tile_rows = np.array_split(np.unique([tile.y for tile in tiles]), count)[index - 1]
+    if not tile_rows.size:
+        return None
+    return int(tile_rows[0]), int(tile_rows[-1])
+
+
+def in_range(value, value_range):
+    """Check if value is in inclusive range with optional ends."""
+    start, end = value_range
+    return (start is None or value >= start) and (end is None or value <= end)
+
+
+def build_shard(qdc_folder_path, layer, validity_codes, quite, x_range=None, y_range=None, shard=None):
+    """Decode tiles within tile coordinates ranges into a partial raster.
+
+    Args:
+        qdc_folder_path (str): Path to folder with QDC files.
+        layer (int): Data layer.
+        validity_codes (bool): Write validity codes instead of depth.
+        quite (bool): Quite mode.
+        x_range (str): Range of X tile coordinates as `START:END`.
+        y_range (str): Range of Y tile coordinates as `START:END`.
+        shard (str): Shard number as `K/N`, splits tile rows between `N` shards.
+
+    Returns:
+        Tuple of north-up depth array (`None` for empty shard) and shard metadata.
+    """
+    layer_parameters = get_layer_parameters(layer)
+    x_range, y_range = parse_range(x_range), parse_range(y_range)
+
+    tiles = scan_layer_tiles(qdc_folder_path, layer_parameters, quite)
+    if shard:
+        index, count = parse_shard(shard)
+        y_range = get_shard_y_range(tiles, index, count) if tiles else None
+    if y_range is not None:
+        tiles = [tile for tile in tiles if in_range(tile.x, x_range) and in_range(tile.y, y_range)]
+    else:
+        tiles = []
+
+    meta = {'version': version, 'layer': layer, 'validity_codes': validity_codes, 'tiles': len(tiles)}
+    if not tiles:
+        return None, meta
+
+    bounds = get_tiles_bounds(tiles)
+    x_min, y_min = bounds[:2]
+    arr_depth = np.zeros(get_grid_size(bounds, layer_parameters), dtype=np.int16)
+    fill_depth_array(arr_depth, tqdm(tiles, desc=_('Calculating depth map'), disable=quite),
+                     x_min, y_min, layer_parameters, validity_codes)
+
+    meta.update(dict(zip(('x_min', 'y_min', 'x_max', 'y_max'), bounds)))
+    meta['shape'] = list(arr_depth.shape)
+    return arr_depth, meta
+
+
+def run_shard(qdc_folder_path, output_path, layer, validity_codes, quite, x_range=None, y_range=None, shard=None,
+              message_queue=None):
+    """Convert a shard into partial raster `<output_path>.npy` and metadata `<output_path>.json`.
+
+    Raster is written before metadata, both through temporary files,
+    so a shard with metadata is always complete.
+    """
+    # Patch tqdm to duplicate messages up to the passed message queue.
+    if message_queue:
+        patch_tqdm(tqdm, message_queue)
+
+    try:
+        output_path = os.path.splitext(output_path)[0]
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        arr_depth, meta = build_shard(qdc_folder_path, layer, validity_codes, quite, x_range, y_range, shard)
+
+        if arr_depth is not None:
+            meta['grid_path'] = os.path.basename(output_path) + '.npy'
+            Checkpoint.write_atomic(output_path + '.npy', lambda f: np.save(f, arr_depth))
+        Checkpoint.write_atomic(output_path + '.json', lambda f: f.write(json.dumps(meta, indent=2).encode()))
+
+    except Exception as e:
+        print_error(f'{_("Error")}: {e}', message_queue)
+        raise
+
+
+class ShardedGrid:
+    """North-up depth array assembled from shards on demand.
+
+    Supports `shape` and slicing by rows, so it could be saved the same
+    way as a regular array without loading all shards into memory.
+    Shards are memory mapped, non-zero cells of later shards win
+    where shards overlap.
+
+    Args:
+        shard_paths (list): Paths to shards metadata files or folders with them.
+    """
+    def __init__(self, shard_paths):
+        meta_paths = []
+        for shard_path in shard_paths:
+            if os.path.isdir(shard_path):
+                meta_paths.extend(sorted(glob.glob(os.path.join(shard_path, '*.json'))))
+            else:
+                meta_paths.append(shard_path)
+        if not meta_paths:
+            raise RuntimeError(_('No shards found!'))
+
+        self.shards = []
+        metas = []
+        for meta_path in meta_paths:
+            with open(meta_path, 'r') as f_meta:
+                meta = json.load(f_meta)
+            metas.append(meta)
+            if meta['tiles']:
+                grid_path = os.path.join(os.path.dirname(meta_path), meta['grid_path'])
+                self.shards.append((meta, np.load(grid_path, mmap_mode='r')))
+
+        if len({(meta['layer'], meta['validity_codes']) for meta in metas}) > 1:
+            raise ValueError(_('Shards have different layers or validity codes mode'))
+        if not self.shards:
+            raise RuntimeError(_('No valid QDC files found!'))
+
+        self.layer, self.validity_codes = metas[0]['layer'], metas[0]['validity_codes']
+        self.layer_parameters = get_layer_parameters(self.layer)
+
+        self.x_min = min(meta['x_min'] for meta, arr in self.shards)
+        self.y_min = min(meta['y_min'] for meta, arr in self.shards)
+        bounds = (self.x_min, self.y_min,
+                  max(meta['x_max'] for meta, arr in self.shards), max(meta['y_max'] for meta, arr in self.shards))
+        self.shape = get_grid_size(bounds, self.layer_parameters)
+        self.dtype = np.dtype(np.int16)
+        self.band, self.band_start = None, None
+
+    def get_rows(self, row_start, row_end):
+        """Assemble rows of the merged array."""
+        y_size = self.shape[0]
+        l_size2 = self.layer_parameters.l_size2
+        rows = np.zeros((row_end - row_start, self.shape[1]), dtype=self.dtype)
+
+        for meta, arr_shard in self.shards:
+            # Shard's south-west corner in cells of the merged array
+            shard_row_end = y_size - (meta['y_min'] - self.y_min) * l_size2
+            shard_row_start = shard_row_end - arr_shard.shape[0]
+            col_start = (meta['x_min'] - self.x_min) * l_size2
+
+            start, end = max(row_start, shard_row_start), min(row_end, shard_row_end)
+            if start >= end:
+                continue
+            src = arr_shard[start - shard_row_start:end - shard_row_start]
+            dst = rows[start - row_start:end - row_start, col_start:col_start + arr_shard.shape[1]]
+            np.copyto(dst, src, where=src != 0)
+
+        return rows
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError(_('Sharded grid supports only rows slices'))
+        row_start, row_end, _step = key.indices(self.shape[0])
+        row_end = max(row_start, row_end)
+
+        # Rows are read sequentially, so they're assembled in bands
+        if self.band is None or not (self.band_start <= row_start and row_end <= self.band_start + len(self.band)):
+            self.band_start = row_start
+            self.band = self.get_rows(row_start, min(max(row_end, row_start + SHARDS_BAND_SIZE), self.shape[0]))
+        return self.band[row_start - self.band_start:row_end - self.band_start]
+
+
+def run_merge(shard_paths, output_path, quite, x_correction, y_correction, z_correction, csv_delimiter,
+              csv_skip_headers, csv_yxz, message_queue=None):
+    """Merge shards into *.csv, *.grd or *.npy streaming rows."""
+    # Patch tqdm to duplicate messages up to the passed message queue.
+    if message_queue:
+        patch_tqdm(tqdm, message_queue)
+
+    try:
+        output_path_ext = os.path.splitext(output_path)[-1].lower()
+        if output_path_ext not in MERGE_EXTENSIONS:
+            raise ValueError(_('Merge result file extension must be *.csv (CSV table), *.grd (ESRI ASCII grid) '
+                               'or *.npy (raster)'))
+
+        grid = ShardedGrid(shard_paths)
+
+        if output_path_ext == '.npy':
+            arr_output = np.lib.format.open_memmap(output_path, mode='w+', dtype=grid.dtype, shape=grid.shape)
+            for row_start in tqdm(range(0, grid.shape[0], SHARDS_BAND_SIZE), desc=_('Merging shards'),
+                                  disable=quite):
+                row_end = min(row_start + SHARDS_BAND_SIZE, grid.shape[0])
+                arr_output[row_start:row_end] = grid[row_start:row_end]
+            arr_output.flush()
+            del arr_output
+        else:
+            check_output_path(output_path, grid.validity_codes)
+            save_depth_array(grid, output_path, grid.x_min, grid.y_min, grid.layer, grid.validity_codes, quite,
+                             x_correction, y_correction, z_correction, csv_delimiter, csv_skip_headers, csv_yxz)
+
+    except Exception as e:
+        print_error(f'{_("Error")}: {e}', message_queue)
+        raise
@@ -0,0 +1,198 @@
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+from .tiles import (LAYER_PARAMETERS, TILE_STEP, Tile, decode_tile,
+                    deduplicate_tiles, get_grid_size, get_layer_parameters,
+                    get_tile_offset, get_tile_slices, get_tiles_bounds,
+                    get_z_values, read_tile_coordinates)
+from .utils import PROGRESS_FREQUENCY, iter_files_recursively
+
+# Default number of depth histogram bins
+DEFAULT_HISTOGRAM_BINS = 20
+
+# Reported depth percentiles
+DEPTH_PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+
+def scan_layers_tiles(qdc_folder_path, layers, on_update=None, stop_event=None):
+    """Find QDC files and read their headers once for all layers.
+
+    Args:
+        qdc_folder_path (str): Path to folder with QDC files.
+        layers (list): Data layers.
+        on_update (callable): Called as `on_update(files_count, layers_tiles)` with partial
+            result not more often than `PROGRESS_FREQUENCY` times per second.
+        stop_event (threading.Event): Scan is stopped as soon as the event is set.
+
+    Returns:
+        Tuple of number of found QDC files and dict of tiles lists by layer.
+    """
+    layers_parameters = {layer: get_layer_parameters(layer) for layer in layers}
+    layers_tiles = {layer: [] for layer in layers}
+    files_count = 0
+    time_updated = None
+
+    for entry in iter_files_recursively(qdc_folder_path, '.qdc'):
+        if on_update and (time_updated is None or time.monotonic() - time_updated >= 1 / PROGRESS_FREQUENCY):
+            on_update(files_count, layers_tiles)
+            time_updated = time.monotonic()
+        if stop_event is not None and stop_event.is_set():
+            break
+
+        files_count += 1
+        qdc_file_stat = entry.stat()
+        offsets = {layer: get_tile_offset(qdc_file_stat.st_size, layer_parameters)
+                   for layer, layer_parameters in layers_parameters.items()}
+        offsets = {layer: offset for layer, offset in offsets.items() if offset is not None}
+        if not offsets:
+            continue
+
+        with open(entry.path, 'rb') as f_qdc:
+            x, y = read_tile_coordinates(f_qdc)
+        for layer, offset in offsets.items():
+            layers_tiles[layer].append(Tile(entry.path, qdc_file_stat.st_size, qdc_file_stat.st_mtime, x, y, offset))
+
+    return files_count, layers_tiles
+
+
+def get_layer_summary(tiles, layer_parameters):
+    """Get extent of the layer without decoding tiles.
+
+    Args:
+        tiles (list): Tiles of the layer.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Returns:
+        Dict with tile count, tile coordinates bounds, bounding box in degrees and grid size.
+    """
+    bounds = get_tiles_bounds(tiles)
+    y_size, x_size = get_grid_size(bounds, layer_parameters)
+    west, south = bounds[0] * TILE_STEP, bounds[1] * TILE_STEP
+    return {
+        'tiles': len(tiles),
+        'tile_bounds': dict(zip(('x_min', 'y_min', 'x_max', 'y_max'), bounds)),
+        'bbox': [west, south, west + x_size * layer_parameters.a_step, south + y_size * layer_parameters.a_step],
+        'grid': {'rows': y_size, 'cols': x_size, 'cell_size': layer_parameters.a_step},
+    }
+
+
+def get_values_summary(values):
+    """Get min, max, mean and percentiles of the values."""
+    if not values.size:
+        return None
+    percentiles = np.percentile(values, DEPTH_PERCENTILES)
+    return {
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'mean': float(values.mean()),
+        'percentiles': {str(p): float(v) for p, v in zip(DEPTH_PERCENTILES, percentiles)},
+    }
+
+
+def calculate_layer_stats(tiles, layer_parameters, bins=DEFAULT_HISTOGRAM_BINS, per_tile=False, quite=False):
+    """Decode tiles of the layer and calculate coverage, depth and validity codes statistics.
+
+    Tiles are merged the same way as for export, so overlapping
+    cells are counted once.
+
+    Args:
+        tiles (list): Tiles of the layer.
+        layer_parameters (SimpleNamespace): Layer parameters.
+        bins (int): Number of depth histogram bins.
+        per_tile (bool): Add statistics of every tile.
+        quite (bool): Quite mode.
+
+    Returns:
+        Dict of statistics.
+    """
+    bounds = get_tiles_bounds(tiles)
+    x_min, y_min = bounds[:2]
+    grid_size = get_grid_size(bounds, layer_parameters)
+    arr_depth = np.zeros(grid_size, dtype=np.int16)
+    arr_code = np.zeros(grid_size, dtype=np.int16)
+    tiles_stats = []
+
+    progress_bar = tqdm(tiles, desc=_('Calculating statistics'), disable=quite)
+    progress_bar.nbytes = 0
+    for tile in progress_bar:
+        progress_bar.nbytes += tile.size
+        tile_depth, tile_code = decode_tile(tile, layer_parameters)
+        tile_valid = tile_code != 0
+
+        block = get_tile_slices(tile, x_min, y_min, grid_size[0], layer_parameters)
+        np.copyto(arr_depth[block], tile_depth, where=tile_valid)
+        np.copyto(arr_code[block], tile_code, where=tile_valid)
+
+        if per_tile:
+            tiles_stats.append({
+                'path': tile.path, 'x': tile.x, 'y': tile.y, 'size': tile.size,
+                'valid_cells': int(tile_valid.sum()),
+                'depth': get_values_summary(tile_depth[tile_valid] / 100),
+            })
+
+    valid = arr_code != 0
+    valid_cells = int(valid.sum())
+    depth = arr_depth[valid] / 100
+
+    if depth.size:
+        histogram, edges = np.histogram(depth, bins=bins)
+    else:
+        histogram, edges = np.empty(0, dtype=int), np.empty(0)
+    codes, codes_counts = np.unique(arr_code[valid], return_counts=True)
+
+    result = {
+        'coverage': {'valid_cells': valid_cells, 'cells': valid.size, 'ratio': valid_cells / valid.size},
+        'depth': get_values_summary(depth),
+        'depth_histogram': {'edges': edges.tolist(), 'counts': histogram.tolist()},
+        'validity_codes': [
+            {'code': int(code), 'value': float(value), 'count': int(count)}
+            for code, value, count in zip(codes, get_z_values(codes, validity_codes=True), codes_counts)
+        ],
+    }
+    if per_tile:
+        result['tile_stats'] = tiles_stats
+    return result
+
+
+def inspect_qdc(qdc_folder_path, layers=None, stats=False, bins=DEFAULT_HISTOGRAM_BINS, per_tile=False,
+                quite=False):
+    """Collect extent and, optionally, statistics of QDC layers.
+
+    Without `stats` only headers of QDC files are read.
+
+    Args:
+        qdc_folder_path (str): Path to folder with QDC files.
+        layers (list): Data layers, all layers by default.
+        stats (bool): Decode tiles and calculate statistics.
+        bins (int): Number of depth histogram bins.
+        per_tile (bool): Add summary of every tile.
+        quite (bool): Quite mode.
+
+    Returns:
+        JSON serializable report.
+    """
+    layers = sorted(LAYER_PARAMETERS) if layers is None else list(layers)
+    files_count, layers_tiles = scan_layers_tiles(qdc_folder_path, layers)
+
+    report = {'qdc_folder_path': qdc_folder_path, 'files': files_count, 'layers': {}}
+    for layer, tiles in layers_tiles.items():
+        if not tiles:
+            report['layers'][str(layer)] = {'tiles': 0}
+            continue
+
+        layer_parameters = get_layer_parameters(layer)
+        tiles, duplicates = deduplicate_tiles(tiles, layer_parameters)
+        layer_report = get_layer_summary(tiles, layer_parameters)
+        layer_report['skipped'] = {
+            'duplicates': {'files': len(duplicates), 'bytes': sum(tile.size for tile in duplicates)},
+        }
+        if stats:
+            layer_report.update(calculate_layer_stats(tiles, layer_parameters, bins, per_tile, quite))
+        elif per_tile:
+            layer_report['tile_stats'] = [{'path': tile.path, 'x': tile.x, 'y': tile.y, 'size': tile.size}
+                                          for tile in tiles]
+        report['layers'][str(layer)] = layer_report
+
+    return report
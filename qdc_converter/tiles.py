@@ -0,0 +1,379 @@
+import hashlib
+import struct
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+
+from .utils import iter_files_recursively
+
+LAYER_PARAMETERS = {
+    0: {
+        'a_step': 90 / 2 ** 22,
+        'n_sectors': 7,
+        'f_size1': 372736,
+        'f_offset1': 4097,
+        'f_size2': 352256,
+        'f_offset2': 4097,
+        'f_size3': -1,
+        'f_offset3': 0,
+        'f_size4': -1,
+        'f_offset4': 0,
+        'l_size': 256,
+        'l_size2': 256,
+    },
+    1: {
+        'a_step': 90 / 2 ** 21,
+        'n_sectors': 3,
+        'f_size1': 372736,
+        'f_offset1': 266241,
+        'f_size2': 352256,
+        'f_offset2': 266241,
+        'f_size3': 110592,
+        'f_offset3': 4097,
+        'f_size4': 90112,
+        'f_offset4': 4097,
+        'l_size': 128,
+        'l_size2': 128,
+    },
+    2: {
+        'a_step': 90 / 2 ** 20,
+        'n_sectors': 1,
+        'f_size1': 372736,
+        'f_offset1': 331777,
+        'f_size2': 352256,
+        'f_offset2': 331777,
+        'f_size3': 110592,
+        'f_offset3': 69633,
+        'f_size4': 90112,
+        'f_offset4': 69633,
+        'l_size': 64,
+        'l_size2': 64,
+    },
+    3: {
+        'a_step': 90 / 2 ** 19,
+        'n_sectors': 0,
+        'f_size1': 372736,
+        'f_offset1': 348161,
+        'f_size2': 352256,
+        'f_offset2': 348161,
+        'f_size3': 110592,
+        'f_offset3': 86017,
+        'f_size4': 90112,
+        'f_offset4': 86017,
+        'l_size': 32,
+        'l_size2': 32,
+    },
+    4: {
+        'a_step': 90 / 2 ** 18,
+        'n_sectors': 1,
+        'f_size1': 372736,
+        'f_offset1': 352257,
+        'f_size2': -1,
+        'f_offset2': 0,
+        'f_size3': 110592,
+        'f_offset3': 90113,
+        'f_size4': -1,
+        'f_offset4': 0,
+        'l_size': 64,
+        'l_size2': 16,
+    },
+    5: {
+        'a_step': 90 / 2 ** 17,
+        'n_sectors': 0,
+        'f_size1': 372736,
+        'f_offset1': 368641,
+        'f_size2': -1,
+        'f_offset2': 0,
+        'f_size3': 110592,
+        'f_offset3': 106497,
+        'f_size4': -1,
+        'f_offset4': 0,
+        'l_size': 32,
+        'l_size2': 8,
+    },
+}
+
+# Size of a tile coordinate unit (offsets 160 and 164 of QDC header) in degrees
+TILE_STEP = 90 / 2 ** 14
+
+# Size of a cells sector side
+SECTOR_SIZE = 32
+
+# QDC cell record, starts at `f_offsetN - 1`
+CELL_DTYPE = np.dtype([('depth', '<i2'), ('code', '<i2')])
+
+# Found QDC tile
+Tile = namedtuple('Tile', 'path size mtime x y offset')
+
+
+def get_layer_parameters(layer):
+    """Get parameters of the layer.
+
+    Args:
+        layer (int): Data layer.
+
+    Returns:
+        Layer parameters as namespace.
+    """
+    return SimpleNamespace(**LAYER_PARAMETERS[layer])
+
+
+def get_tile_offset(file_size, layer_parameters):
+    """Get offset of the cells data by QDC file size.
+
+    Args:
+        file_size (int): QDC file size.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Returns:
+        Offset of the first cell or `None` if file doesn't contain the layer.
+    """
+    for n in range(1, 5):
+        if file_size == getattr(layer_parameters, f'f_size{n}'):
+            return getattr(layer_parameters, f'f_offset{n}')
+    return None
+
+
+def read_tile_coordinates(f_qdc):
+    """Read tile coordinates from QDC header.
+
+    Args:
+        f_qdc (file): QDC file opened in binary mode.
+
+    Returns:
+        Tuple of X and Y tile coordinates.
+    """
+    f_qdc.seek(160)
+    y, _x_pad, x = struct.unpack('<hhh', f_qdc.read(6))
+    return x, y
+
+
+def iter_tiles(qdc_folder_path, layer_parameters):
+    """Find QDC files of the layer and read their headers while walking the folder.
+
+    Files of other layers are dropped by their size
+    before being opened.
+
+    Args:
+        qdc_folder_path (str): Path to folder with QDC files.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Yields:
+        Found tiles.
+    """
+    for entry in iter_files_recursively(qdc_folder_path, '.qdc'):
+        qdc_file_stat = entry.stat()
+        offset = get_tile_offset(qdc_file_stat.st_size, layer_parameters)
+        if offset is not None:
+            with open(entry.path, 'rb') as f_qdc:
+                x, y = read_tile_coordinates(f_qdc)
+            yield Tile(entry.path, qdc_file_stat.st_size, qdc_file_stat.st_mtime, x, y, offset)
+
+
+def scan_tiles(qdc_folder_path, layer_parameters):
+    """Find QDC files of the layer and read their headers.
+
+    Args:
+        qdc_folder_path (str): Path to folder with QDC files.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Returns:
+        List of tiles.
+    """
+    return list(iter_tiles(qdc_folder_path, layer_parameters))
+
+
+def get_tile_fingerprint(tile, layer_parameters):
+    """Get hash of the tile cells region.
+
+    Args:
+        tile (Tile): QDC tile.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Returns:
+        Digest of the cells data.
+    """
+    n = layer_parameters.n_sectors + 1
+    with open(tile.path, 'rb') as f_qdc:
+        f_qdc.seek(tile.offset - 1)
+        return hashlib.blake2b(f_qdc.read(n * n * SECTOR_SIZE * SECTOR_SIZE * CELL_DTYPE.itemsize),
+                               digest_size=16).digest()
+
+
+def deduplicate_tiles(tiles, layer_parameters):
+    """Skip copies of the same tiles.
+
+    Tiles with the same coordinates are compared by size first and then
+    by hash of the cells region, only the newest copy is kept. Different
+    versions of the same tile are all kept, they take places of each other
+    from the oldest to the newest by modification time (then by path),
+    so newer valid cells win and cells valid only in older versions are kept
+    regardless of folders walk order.
+
+    Args:
+        tiles (list): Found tiles.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Returns:
+        Tuple of kept tiles and skipped duplicates.
+    """
+    groups = {}
+    for n, tile in enumerate(tiles):
+        groups.setdefault((tile.x, tile.y), []).append(n)
+
+    order, duplicates = list(range(len(tiles))), set()
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+
+        # Versions go from the oldest to the newest on places of the found ones,
+        # so walk order of the other tiles is kept
+        versions = sorted(group, key=lambda n: (tiles[n].mtime, tiles[n].path))
+        for n, version in zip(group, versions):
+            order[n] = version
+
+        # Only tiles of the same size could be copies
+        sizes = {}
+        for n in versions:
+            sizes.setdefault(tiles[n].size, []).append(n)
+        for same_size in sizes.values():
+            fingerprints = set()
+            if len(same_size) < 2:
+                continue
+            for n in reversed(same_size):
+                fingerprint = get_tile_fingerprint(tiles[n], layer_parameters)
+                if fingerprint in fingerprints:
+                    duplicates.add(n)
+                fingerprints.add(fingerprint)
+
+    return [tiles[n] for n in order if n not in duplicates], [tiles[n] for n in sorted(duplicates)]
+
+
+def get_tiles_bounds(tiles):
+    """Get tile coordinates bounds.
+
+    Args:
+        tiles (list): List of tiles.
+
+    Returns:
+        Tuple of `x_min`, `y_min`, `x_max`, `y_max`.
+    """
+    if not tiles:
+        raise RuntimeError(_('No valid QDC files found!'))
+
+    xs = [tile.x for tile in tiles]
+    ys = [tile.y for tile in tiles]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def get_grid_size(bounds, layer_parameters):
+    """Get depth array shape in cells.
+
+    Args:
+        bounds (tuple): Tile coordinates bounds.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Returns:
+        Tuple of `y_size` (rows) and `x_size` (columns).
+    """
+    x_min, y_min, x_max, y_max = bounds
+    return ((y_max - y_min + 1) * layer_parameters.l_size,
+            (x_max - x_min + 1) * layer_parameters.l_size)
+
+
+def get_tile_slices(tile, x_min, y_min, y_size, layer_parameters):
+    """Get position of the tile cells in the north-up depth array.
+
+    Args:
+        tile (Tile): QDC tile.
+        x_min (int): Minimal X tile coordinate.
+        y_min (int): Minimal Y tile coordinate.
+        y_size (int): Number of rows of the depth array.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Returns:
+        Tuple of rows and columns slices.
+    """
+    x_orig = (tile.x - x_min) * layer_parameters.l_size2
+    y_orig = (tile.y - y_min) * layer_parameters.l_size2
+    size = (layer_parameters.n_sectors + 1) * SECTOR_SIZE
+    row_orig = y_size - y_orig - size
+    return slice(row_orig, row_orig + size), slice(x_orig, x_orig + size)
+
+
+def decode_tile(tile, layer_parameters):
+    """Decode QDC tile cells.
+
+    Args:
+        tile (Tile): QDC tile.
+        layer_parameters (SimpleNamespace): Layer parameters.
+
+    Returns:
+        Tuple of depth (in cm) and validity code arrays,
+        both are north-up and indexed as `[row, column]`.
+    """
+    n = layer_parameters.n_sectors + 1
+    with open(tile.path, 'rb') as f_qdc:
+        f_qdc.seek(tile.offset - 1)
+        cells = np.fromfile(f_qdc, dtype=CELL_DTYPE, count=n * n * SECTOR_SIZE * SECTOR_SIZE)
+
+    # Cells are stored as sectors (yy, xx), each sector is stored as rows (y, x),
+    # rows are going from south to north.
+    cells = cells.reshape(n, n, SECTOR_SIZE, SECTOR_SIZE).transpose(0, 2, 1, 3)
+    cells = cells.reshape(n * SECTOR_SIZE, n * SECTOR_SIZE)[::-1]
+    return cells['depth'], cells['code']
+
+
+def fill_depth_array(arr_depth, tiles, x_min, y_min, layer_parameters, validity_codes, tile_cache=None,
+                     arr_code=None):
+    """Decode tiles into the north-up depth array.
+
+    Tiles are placed the same way as the cell by cell converter does:
+    depth is written where validity code isn't zero, validity codes are
+    written as is.
+
+    Args:
+        arr_depth (np.ndarray): North-up depth array to fill.
+        tiles (iterable): Tiles to decode.
+        x_min (int): Minimal X tile coordinate of the array.
+        y_min (int): Minimal Y tile coordinate of the array.
+        layer_parameters (SimpleNamespace): Layer parameters.
+        validity_codes (bool): Write validity codes instead of depth.
+        tile_cache (LRUCache): Cache of decoded tiles.
+        arr_code (np.ndarray): North-up validity codes array filled in the same pass.
+    """
+    y_size = arr_depth.shape[0]
+    for tile in tiles:
+        cells = tile_cache.get(tile) if tile_cache is not None else None
+        if cells is None:
+            cells = decode_tile(tile, layer_parameters)
+            if tile_cache is not None:
+                # Tile holds size and mtime, so changed files aren't taken from cache
+                tile_cache.put(tile, cells)
+        tile_depth, tile_code = cells
+
+        block = get_tile_slices(tile, x_min, y_min, y_size, layer_parameters)
+        if validity_codes:
+            arr_depth[block] = tile_code
+        else:
+            np.copyto(arr_depth[block], tile_depth, where=tile_code != 0)
+        if arr_code is not None:
+            arr_code[block] = tile_code
+
+
+def get_z_values(values, validity_codes):
+    """Convert raw values of the depth array into Z values.
+
+    Args:
+        values (np.ndarray): Depth in cm or validity codes.
+        validity_codes (bool): Values are validity codes.
+
+    Returns:
+        Array of depth in meters or decoded validity codes.
+    """
+    if validity_codes:
+        t_val = values / 4096
+        t_val = np.sign(t_val) * np.abs(t_val).astype(np.int16)
+        return t_val * 10 + (values - t_val * 4096) / 256
+    return values / 100
@@ -1,8 +1,14 @@
 import gettext
 import importlib.util
+import io
+import math
+import multiprocessing as mp
 import os
 import sys
+import threading
+import time
 import warnings
+from collections import OrderedDict
 from itertools import islice
 
 try:
@@ -16,6 +22,12 @@ except ImportError as e:
         warnings.warn('Failed to load GUI: %s' % e.msg)
     GUI_ENABLED = False
 
+# Maximal frequency of progress messages
+PROGRESS_FREQUENCY = 5
+
+# Mount point of the cgroup file system limiting CPU usage of containers
+CGROUP_ROOT = '/sys/fs/cgroup'
+
 
 def print_error(error_msg, message_queue=None):
     """Print error message to `stderr` and dublicate it to
@@ -52,35 +64,216 @@ def image_path(image_name):
     return os.path.join(data_path(), 'images', image_name)
 
 
+class ProgressChannel:
+    """Progress channel which coalesces updates.
+
+    Keeps progress of the current stage and sends it to `sink` as
+    `('#Progress', progress)` message not more often than `frequency`
+    times per second, where `progress` is a dict with keys `stage`, `n`,
+    `total`, `nbytes`, `rate` (items per second), `byte_rate`
+    (bytes per second), `elapsed` and `eta` (seconds).
+
+    Args:
+        sink (callable): Message consumer, e.g. `multiprocessing.Queue.put`.
+        frequency (float): Maximal number of messages per second.
+    """
+    def __init__(self, sink, frequency=PROGRESS_FREQUENCY):
+        self.sink = sink
+        self.interval = 1 / frequency
+        self.stage = None
+        self.n, self.total, self.nbytes = 0, None, None
+        self.time_start = self.time_sent = time.monotonic()
+        self.pending = False
+
+    def start(self, stage, total=None):
+        """Start new stage, progress of the previous one gets flushed."""
+        self.flush()
+        self.stage = stage
+        self.n, self.total, self.nbytes = 0, total, None
+        self.time_start = time.monotonic()
+        self.send()
+
+    def update(self, n, total=None, nbytes=None):
+        """Update progress of the current stage.
+
+        Args:
+            n (int): Number of items processed.
+            total (int): Total number of items.
+            nbytes (int): Number of bytes processed.
+        """
+        self.n = n
+        if total is not None:
+            self.total = total
+        if nbytes is not None:
+            self.nbytes = nbytes
+        self.pending = True
+        if time.monotonic() - self.time_sent >= self.interval:
+            self.send()
+
+    def flush(self):
+        """Send coalesced progress if there is any."""
+        if self.pending:
+            self.send()
+
+    def progress(self):
+        """Get progress of the current stage."""
+        elapsed = time.monotonic() - self.time_start
+        rate = self.n / elapsed if elapsed > 0 else None
+        byte_rate = self.nbytes / elapsed if elapsed > 0 and self.nbytes is not None else None
+        eta = (self.total - self.n) / rate if rate and self.total else None
+        return {
+            'stage': self.stage, 'n': self.n, 'total': self.total, 'nbytes': self.nbytes,
+            'rate': rate, 'byte_rate': byte_rate, 'elapsed': elapsed, 'eta': eta,
+        }
+
+    def send(self):
+        """Send progress of the current stage immediately."""
+        self.time_sent = time.monotonic()
+        self.pending = False
+        self.sink(('#Progress', self.progress()))
+
+
+class LRUCache:
+    """Thread-safe dict-like cache keeping `maxsize` recently used items."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+
 def patch_tqdm(tqdm, message_queue):
-    """Patch tqdm to make it dublicate progress to `message_queue`.
+    """Patch tqdm to make it dublicate progress to `message_queue`
+    through `ProgressChannel`.
+
+    Progress bars may set `nbytes` attribute to report amount of processed data.
 
     Args:
         tqdm (tqdm.tqdm) Tqdm class to be patched.
         message_queue (multiprocessing.Queue): Message queue.
     """
+    if hasattr(tqdm, 'progress_channel'):
+        # Already patched, just redirect messages
+        tqdm.progress_channel.sink = message_queue.put
+        return
+
+    channel = tqdm.progress_channel = ProgressChannel(message_queue.put)
+    channel.owner = None
     original_update = tqdm.update
+    original_refresh = tqdm.refresh
     original_close = tqdm.close
     original_init = tqdm.__init__
 
+    def update_channel(tqdm_self):
+        # Skip late updates of previous stages, e.g. on garbage collection
+        if channel.owner is tqdm_self:
+            channel.update(tqdm_self.n, tqdm_self.total, getattr(tqdm_self, 'nbytes', None))
+
     def new_update(tqdm_self, *args, **kwargs):
-        original_update(tqdm_self, *args, **kwargs)
-        message_queue.put(('#UpdateProgressBar', (tqdm_self.n, tqdm_self.total)))
+        result = original_update(tqdm_self, *args, **kwargs)
+        update_channel(tqdm_self)
+        return result
+
+    def new_refresh(tqdm_self, *args, **kwargs):
+        # Iterating over tqdm refreshes it without calling `update`
+        original_refresh(tqdm_self, *args, **kwargs)
+        update_channel(tqdm_self)
 
     def new_close(tqdm_self, *args, **kwargs):
-        message_queue.put(('#UpdateProgressBar', (tqdm_self.n, tqdm_self.total)))
+        update_channel(tqdm_self)
+        if channel.owner is tqdm_self:
+            channel.flush()
+            channel.owner = None
         original_close(tqdm_self, *args, **kwargs)
 
     def new_init(tqdm_self, *args, **kwargs):
         original_init(tqdm_self, *args, **kwargs)
-        message_queue.put(('#UpdateProgressBarTitle', tqdm_self.desc))
-        message_queue.put(('#UpdateProgressBar', (tqdm_self.n, tqdm_self.total)))
+        channel.owner = tqdm_self
+        channel.start(getattr(tqdm_self, 'desc', kwargs.get('desc')), tqdm_self.total)
 
     tqdm.update = new_update
+    tqdm.refresh = new_refresh
     tqdm.close = new_close
     tqdm.__init__ = new_init
 
 
+class NullWriter(io.TextIOBase):
+    """Text stream dropping everything written to it."""
+    def write(self, text):
+        return len(text)
+
+
+def mute_tqdm(tqdm):
+    """Patch tqdm to make progress bars write nowhere unless `file` is passed.
+
+    Other output isn't touched, progress is still duplicated
+    to message queue by `patch_tqdm`.
+
+    Args:
+        tqdm (tqdm.tqdm) Tqdm class to be patched.
+    """
+    original_init = tqdm.__init__
+
+    def new_init(tqdm_self, *args, **kwargs):
+        kwargs.setdefault('file', NullWriter())
+        original_init(tqdm_self, *args, **kwargs)
+
+    tqdm.__init__ = new_init
+
+
+def iter_files_recursively(root_path, exts):
+    """Recursively search for files with the extension
+    specified in `exts` yielding them as soon as they are found.
+
+    Files are yielded in the same order as `os.walk` lists them,
+    symbolic links to folders are not followed.
+
+    Args:
+        root_path (str): Root path.
+        exts (str): Files extension.
+
+    Yields:
+        `os.DirEntry` of found file, its `stat()` result is cached.
+    """
+    if type(exts) not in (list, tuple):
+        exts = (exts,)
+    exts = tuple(exts)
+
+    folders = []
+    try:
+        with os.scandir(root_path) as entries:
+            for entry in entries:
+                try:
+                    is_folder = entry.is_dir()
+                except OSError:
+                    is_folder = False
+
+                if is_folder:
+                    if not entry.is_symlink():
+                        folders.append(entry.path)
+                elif entry.name.endswith(exts):
+                    yield entry
+    except OSError:
+        # Same as `os.walk`, unreadable folders are skipped
+        return
+
+    for folder in folders:
+        yield from iter_files_recursively(folder, exts)
+
+
 def get_files_recursively(root_path, exts):
     """Recursively search for files with the extension
     specified in `exts`.
@@ -92,15 +285,7 @@ def get_files_recursively(root_path, exts):
     Returns:
         List of found files.
     """
-    if type(exts) not in (list, tuple):
-        exts = (exts,)
-    result = []
-    files = [os.path.join(dp, f) for dp, _, fn in os.walk(root_path) for f in fn]
-    for f in files:
-        if any(f.endswith(ext) for ext in exts):
-            full_path_f = os.path.join(root_path, f)
-            result.append(full_path_f)
-    return result
+    return [entry.path for entry in iter_files_recursively(root_path, exts)]
 
 
 def install_i18n():
@@ -118,6 +303,61 @@ def install_i18n():
     gettext.install('messages', locale_dir)
 
 
+def read_cgroup_values(file_path):
+    """Read whitespace separated values of the cgroup file, `None` if there is no such file."""
+    try:
+        with open(file_path, 'r') as f:
+            return f.read().split()
+    except (OSError, ValueError):
+        return None
+
+
+def get_cgroup_cpu_limit(cgroup_root=CGROUP_ROOT):
+    """Get CPU limit of the cgroup quota, both cgroup v2 and v1 are supported.
+
+    Args:
+        cgroup_root (str): Mount point of the cgroup file system.
+
+    Returns:
+        Number of CPUs the quota allows (rounded up) or `None` if there is no quota.
+    """
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    values = read_cgroup_values(os.path.join(cgroup_root, 'cpu.max'))
+    if values is None:
+        # cgroup v1: quota and period in separate files, quota is -1 if unlimited
+        for controller in ('cpu', 'cpu,cpuacct'):
+            quota = read_cgroup_values(os.path.join(cgroup_root, controller, 'cpu.cfs_quota_us'))
+            period = read_cgroup_values(os.path.join(cgroup_root, controller, 'cpu.cfs_period_us'))
+            if quota and period:
+                values = quota[:1] + period[:1]
+                break
+
+    try:
+        quota, period = map(int, values)
+    except (TypeError, ValueError):
+        return None  # No cgroup, unlimited quota or unknown format
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, math.ceil(quota / period))
+
+
+def get_cpu_count():
+    """Get number of CPUs available to the process.
+
+    Unlike `multiprocessing.cpu_count` takes into account CPU affinity
+    and cgroup quota of containers.
+    """
+    try:
+        cpu_count = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpu_count = mp.cpu_count()  # No affinity on Windows and macOS
+
+    cpu_limit = get_cgroup_cpu_limit()
+    if cpu_limit:
+        cpu_count = min(cpu_count, cpu_limit)
+    return max(1, cpu_count)
+
+
 def chunks(iterable, n):
     """Split iterable in batches."""
     it_len = len(iterable)
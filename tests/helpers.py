@@ -0,0 +1,61 @@
+"""Helpers shared by the tests."""
+import csv
+import os
+import struct
+
+import numpy as np
+from qdc_converter.tiles import (CELL_DTYPE, LAYER_PARAMETERS, SECTOR_SIZE,
+                                 get_layer_parameters, get_tile_offset)
+
+
+def compare_two_csv(csv_one, csv_two):
+    """Compare 2 CSV files.
+
+    Args:
+        csv_one (str): Path to 1st csv.
+        csv_two (str): Path to 2nd csv.
+    """
+    with open(csv_one, 'r') as f1, open(csv_two, 'r') as f2:
+        data1 = list(csv.reader(f1))
+        data2 = list(csv.reader(f2))
+        assert len(data1) == len(data2)
+        for v1, v2 in zip(data1, data2):
+            assert v1 == v2
+
+
+def read_csv_points(csv_path):
+    """Read X, Y and Z columns of CSV table with header."""
+    with open(csv_path, 'r', newline='') as f_csv:
+        rows = list(csv.reader(f_csv))[1:]
+    return np.array(rows, dtype=np.float64).T
+
+
+def get_file_sizes(layer):
+    """Get all QDC file sizes of the layer."""
+    parameters = LAYER_PARAMETERS[layer]
+    return [parameters[f'f_size{n}'] for n in range(1, 5) if parameters[f'f_size{n}'] > 0]
+
+
+def make_tiles(folder_path, layer, seed):
+    """Generate QDC files of every file size of the layer.
+
+    Tiles are placed on two columns of tile coordinates starting from negative X,
+    about a half of cells are invalid.
+    """
+    rng = np.random.default_rng(seed)
+    layer_parameters = get_layer_parameters(layer)
+    n = layer_parameters.n_sectors + 1
+    os.makedirs(folder_path)
+
+    for k, file_size in enumerate(get_file_sizes(layer)):
+        data = rng.integers(0, 256, file_size, dtype=np.uint8)
+        offset = get_tile_offset(file_size, layer_parameters)
+        cells = data[offset - 1:offset - 1 + n * n * SECTOR_SIZE * SECTOR_SIZE * CELL_DTYPE.itemsize].view(CELL_DTYPE)
+        cells['depth'] = rng.integers(-500, 3000, cells.size)
+        cells['code'][rng.random(cells.size) < 0.5] = 0
+
+        file_path = os.path.join(folder_path, f'{k}.qdc')
+        data.tofile(file_path)
+        with open(file_path, 'r+b') as f_qdc:
+            f_qdc.seek(160)
+            f_qdc.write(struct.pack('<hhh', 17000 + k // 2, 0, -1 + k % 2))
@@ -0,0 +1,120 @@
+"""Reference copy of the original cell by cell converter.
+
+Kept as it was before the vectorized decoder and the bulk writers,
+results of both engines must be byte identical to it.
+"""
+import csv
+import os
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+from qdc_converter.tiles import LAYER_PARAMETERS
+from qdc_converter.utils import get_files_recursively
+
+
+def reference_export(qdc_folder_path, output_path, layer, validity_codes=False, x_correction=0.0, y_correction=0.0,
+                     z_correction=0.0, csv_delimiter=',', csv_skip_headers=False, csv_yxz=False):
+    """Convert QDC files of the layer into *.csv or *.grd cell by cell."""
+    output_path_ext = os.path.splitext(output_path)[-1]
+    layer_parameters = SimpleNamespace(**LAYER_PARAMETERS[layer])
+    qdc_files = get_files_recursively(qdc_folder_path, '.qdc')
+    file_sizes = (layer_parameters.f_size1, layer_parameters.f_size2,
+                  layer_parameters.f_size3, layer_parameters.f_size4)
+
+    # Calculate boundaries
+    x_min, y_min = 32000, 32000
+    x_max, y_max = -32000, -32000
+    for qdc_file in qdc_files:
+        if os.path.getsize(qdc_file) in file_sizes:
+            with open(qdc_file, 'rb') as f_qdc:
+                f_qdc.seek(164)
+                val = struct.unpack('<h', f_qdc.read(2))[0]
+                x_min = min(val, x_min)
+                x_max = max(val, x_max)
+
+                f_qdc.seek(160)
+                val = struct.unpack('<h', f_qdc.read(2))[0]
+                y_min = min(val, y_min)
+                y_max = max(val, y_max)
+
+    x_size = (x_max - x_min + 1) * layer_parameters.l_size
+    y_size = (y_max - y_min + 1) * layer_parameters.l_size
+    arr_depth = np.zeros((x_size, y_size), dtype=np.int16)
+
+    # Calculate depth array
+    for qdc_file in qdc_files:
+        qdc_file_size = os.path.getsize(qdc_file)
+        if qdc_file_size in file_sizes:
+            with open(qdc_file, 'rb') as f_qdc:
+                f_qdc.seek(164)
+                val = struct.unpack('<h', f_qdc.read(2))[0]
+                x_orig = (val - x_min) * layer_parameters.l_size2
+
+                f_qdc.seek(160)
+                val = struct.unpack('<h', f_qdc.read(2))[0]
+                y_orig = (val - y_min) * layer_parameters.l_size2
+
+                i = getattr(layer_parameters, f'f_offset{file_sizes.index(qdc_file_size) + 1}')
+                for yy in range(layer_parameters.n_sectors + 1):
+                    for xx in range(layer_parameters.n_sectors + 1):
+                        for y in range(32):
+                            for x in range(32):
+                                x_abs = xx * 32 + x + x_orig
+                                y_abs = yy * 32 + y + y_orig
+                                f_qdc.seek(i + 1)
+                                val_code = struct.unpack('<h', f_qdc.read(2))[0]  # Read validity code
+
+                                if validity_codes:  # Write validity codes to array instead of depth
+                                    arr_depth[x_abs, y_abs] = val_code
+                                else:
+                                    if val_code != 0:
+                                        f_qdc.seek(i - 1)
+                                        val_depth = struct.unpack('<h', f_qdc.read(2))[0]  # Read depth in cm
+                                        arr_depth[x_abs, y_abs] = val_depth
+                                i += 4
+
+    x_orig = x_min * 90 / 2 ** 14
+    y_orig = y_min * 90 / 2 ** 14
+
+    f_fix = lambda x: np.sign(x) * np.int16(np.abs(x))  # noqa: E731
+
+    def get_z(i, j):
+        if validity_codes:
+            t_val = f_fix(arr_depth[i, j] / 4096)
+            return t_val * 10 + (arr_depth[i, j] - t_val * 4096) / 256
+        return arr_depth[i, j] / 100
+
+    if output_path_ext.lower() == '.grd':
+        with open(output_path, 'w') as f_grd:
+            f_grd.write(f'NCOLS {x_size}\n')
+            f_grd.write(f'NROWS {y_size}\n')
+            f_grd.write(f'XLLCORNER {x_orig}\n')
+            f_grd.write(f'YLLCORNER {y_orig}\n')
+            f_grd.write(f'CELLSIZE {layer_parameters.a_step}\n')
+            f_grd.write('NODATA_VALUE 0\n')
+
+            for j in range(y_size - 1, -1, -1):
+                row_values = [get_z(i, j) + z_correction for i in range(x_size)]
+                f_grd.write(' '.join(str(x) for x in row_values) + '\n')
+
+    elif output_path_ext.lower() == '.csv':
+        with open(output_path, 'w', newline='') as f_csv:
+            writer = csv.writer(f_csv, delimiter=csv_delimiter)
+            if not csv_skip_headers:
+                columns = ['X', 'Y'] if not csv_yxz else ['Y', 'X']
+                writer.writerow(columns + ['ValCode' if validity_codes else 'Depth(m)'])
+
+            for j in range(y_size - 1, -1, -1):
+                for i in range(x_size):
+                    if arr_depth[i, j] > 0:  # Skip all 0 values
+                        z = get_z(i, j)
+
+                        # Adding a_step / 2 to move point to the middle of the cell extent
+                        x = x_orig + layer_parameters.a_step / 2 + i * layer_parameters.a_step
+                        y = y_orig + layer_parameters.a_step / 2 + j * layer_parameters.a_step
+
+                        if csv_yxz:
+                            writer.writerow([y + y_correction, x + x_correction, z + z_correction])
+                        else:
+                            writer.writerow([x + x_correction, y + y_correction, z + z_correction])
@@ -0,0 +1,87 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+
+from click.testing import CliRunner
+from qdc_converter import main as converter_main
+from qdc_converter.batch import run_batch
+
+from helpers import compare_two_csv
+
+
+def test_batch():
+    """Run batch with a failing job and make sure the rest gets converted."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    test_path = os.path.join(here, 'data', 'main')
+    qdc_path = os.path.join(test_path, 'qdc_contours')
+    csv_sample_file = os.path.join(test_path, '0_17902c10.l1.csv')
+
+    with TemporaryDirectory() as tmpdir:
+        manifest_path = os.path.join(tmpdir, 'manifest.json')
+        with open(manifest_path, 'w') as f_manifest:
+            json.dump([
+                {'qdc_folder_path': qdc_path, 'output_path': 'output.csv', 'layer': 1},
+                {'qdc_folder_path': tmpdir, 'output_path': 'empty.csv', 'layer': 1},
+            ], f_manifest)
+
+        result = CliRunner().invoke(converter_main, ['batch', manifest_path, '--workers', '2', '--quite'])
+
+        assert result.exit_code == 1
+        compare_two_csv(csv_sample_file, os.path.join(tmpdir, 'output.csv'))
+        assert not os.path.exists(os.path.join(tmpdir, 'empty.csv'))
+
+
+class ListQueue:
+    """Message queue collecting messages in the list."""
+    def __init__(self):
+        self.messages = []
+
+    def put(self, message):
+        self.messages.append(message)
+
+
+def test_batch_progress_and_errors(capfd):
+    """Progress of the jobs is forwarded to the message queue, a failed job is reported once."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    qdc_path = os.path.join(here, 'data', 'main', 'qdc_contours')
+
+    with TemporaryDirectory() as tmpdir:
+        manifest_path = os.path.join(tmpdir, 'manifest.json')
+        with open(manifest_path, 'w') as f_manifest:
+            json.dump([
+                {'qdc_folder_path': qdc_path, 'output_path': 'output.csv', 'layer': 1},
+                {'qdc_folder_path': tmpdir, 'output_path': 'empty.csv', 'layer': 1},
+            ], f_manifest)
+
+        message_queue = ListQueue()
+        failed = run_batch(manifest_path, workers=2, quite=True, message_queue=message_queue)
+
+        assert [job['output_path'] for job, error in failed] == [os.path.join(tmpdir, 'empty.csv')]
+        errors = [value for key, value in message_queue.messages if key == '#Error']
+        assert len(errors) == 1
+        assert capfd.readouterr().err.count('No valid QDC files found!') == 1
+
+        progress = [value for key, value in message_queue.messages if key == '#Progress']
+        assert os.path.join(tmpdir, 'output.csv') in {value['output_path'] for value in progress}
+        assert all({'stage', 'n', 'total'} <= set(value) for value in progress)
+
+
+def test_batch_worker_output(capfd):
+    """Progress bars of the workers are muted, their errors are printed to stderr."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    qdc_path = os.path.join(here, 'data', 'main', 'qdc_contours')
+
+    with TemporaryDirectory() as tmpdir:
+        manifest_path = os.path.join(tmpdir, 'manifest.json')
+        with open(manifest_path, 'w') as f_manifest:
+            json.dump([
+                {'qdc_folder_path': qdc_path, 'output_path': 'output.csv', 'layer': 1},
+                {'qdc_folder_path': tmpdir, 'output_path': 'empty.csv', 'layer': 1},
+            ], f_manifest)
+
+        run_batch(manifest_path, workers=2, quite=False)
+
+        err = capfd.readouterr().err
+        assert 'Converting jobs' in err
+        assert 'Calculating depth map' not in err
+        assert err.count('No valid QDC files found!') == 1
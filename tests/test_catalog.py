@@ -0,0 +1,61 @@
+import os
+import shutil
+import struct
+import threading
+from tempfile import TemporaryDirectory
+
+import pytest
+from qdc_converter import cli
+from qdc_converter.stats import scan_layers_tiles
+
+from helpers import compare_two_csv
+
+here = os.path.dirname(os.path.abspath(__file__))
+test_path = os.path.join(here, 'data', 'main')
+qdc_path = os.path.join(test_path, 'qdc_contours')
+qdc_file = os.path.join(qdc_path, '0_17902c10.qdc')
+
+
+def test_scan_layers_tiles_updates(monkeypatch):
+    """Partial results are reported while scanning and the scan could be stopped."""
+    from qdc_converter import stats
+    monkeypatch.setattr(stats, 'PROGRESS_FREQUENCY', float('inf'))  # Report every file
+
+    with TemporaryDirectory() as tmpdir:
+        for dx in range(5):
+            tile_path = os.path.join(tmpdir, f'{dx}.qdc')
+            shutil.copy(qdc_file, tile_path)
+            with open(tile_path, 'r+b') as f_qdc:
+                f_qdc.seek(164)
+                f_qdc.write(struct.pack('<h', 6032 + dx))
+
+        updates = []
+        files_count, layers_tiles = scan_layers_tiles(tmpdir, [0, 1], lambda count, tiles: updates.append(
+            (count, len(tiles[1]))))
+        assert files_count == 5 and len(layers_tiles[1]) == 5 and not layers_tiles[0]
+        assert updates == [(count, count) for count in range(5)]
+
+        stop_event = threading.Event()
+
+        def stop_after_two(count, tiles):
+            if count == 2:
+                stop_event.set()
+
+        files_count, layers_tiles = scan_layers_tiles(tmpdir, [1], stop_after_two, stop_event)
+        assert files_count == 2 and len(layers_tiles[1]) == 2
+
+
+@pytest.mark.parametrize('multithreaded', [False, True])
+def test_run_cli_tiles(monkeypatch, multithreaded):
+    """Converter uses tiles found beforehand without walking the folder again."""
+    files_count, layers_tiles = scan_layers_tiles(qdc_path, [1])
+
+    def fail_scan(*args):
+        raise AssertionError('Folder is scanned again')
+
+    monkeypatch.setattr(cli, 'iter_tiles', fail_scan)
+    with TemporaryDirectory() as tmpdir:
+        output_path = os.path.join(tmpdir, 'output.csv')
+        cli.run_cli(qdc_path, output_path, 1, False, True, 0.0, 0.0, 0.0, ',', False, False, multithreaded,
+                    tiles=layers_tiles[1])
+        compare_two_csv(os.path.join(test_path, '0_17902c10.l1.csv'), output_path)
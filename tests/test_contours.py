@@ -0,0 +1,48 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from qdc_converter import contours
+from qdc_converter.contours import calculate_band_segments, join_segments, save_contours
+
+
+def bowl(size=60):
+    """Depth array in cm growing with distance from the center."""
+    rows, cols = np.mgrid[0:size, 0:size]
+    return (np.hypot(rows - size / 2, cols - size / 2) * 100).astype(np.int16) + 100
+
+
+def test_contours_are_closed_circles():
+    arr_depth = bowl()
+    arr_z = arr_depth / 100
+    (edge_ids, points), = calculate_band_segments(arr_z, arr_depth != 0, 0, np.array([11.0]))
+    lines = join_segments(edge_ids, points)
+
+    assert len(lines) == 1
+    line = lines[0]
+    assert np.array_equal(line[0], line[-1])
+
+    radius = np.hypot(line[:, 1] - 30, line[:, 0] - 30)
+    assert np.allclose(radius, 10, atol=0.1)
+
+
+def test_contours_bands_are_joined(monkeypatch):
+    arr_depth = bowl()
+
+    def contours_lines(band_size):
+        monkeypatch.setattr(contours, 'CONTOURS_BAND_SIZE', band_size)
+        with TemporaryDirectory() as tmpdir:
+            output_path = os.path.join(tmpdir, 'contours.geojson')
+            save_contours(arr_depth, output_path, 1000, 17000, 1, True, 0.0, 0.0, 0.0, contour_interval=5.0)
+            with open(output_path) as f_geojson:
+                return json.load(f_geojson)['features']
+
+    def normalized(features):
+        return sorted((feature['properties']['depth'], sorted(map(tuple, feature['geometry']['coordinates'])))
+                      for feature in features)
+
+    features = contours_lines(256)
+    assert {feature['properties']['depth'] for feature in features} == {5.0 * n for n in range(1, 9)}
+    for band_size in (7, 16):
+        assert normalized(contours_lines(band_size)) == normalized(features)
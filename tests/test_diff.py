@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+import struct
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from qdc_converter import diff
+from qdc_converter import main as converter_main
+from qdc_converter.diff import DIFF_NODATA_VALUE, run_diff
+from qdc_converter.tiles import CELL_DTYPE, get_layer_parameters, get_tile_offset
+
+from helpers import make_tiles
+
+LAYER = 1
+
+
+def count_valid_cells(file_path):
+    layer_parameters = get_layer_parameters(LAYER)
+    n = layer_parameters.n_sectors + 1
+    with open(file_path, 'rb') as f_qdc:
+        f_qdc.seek(get_tile_offset(os.path.getsize(file_path), layer_parameters) - 1)
+        cells = np.fromfile(f_qdc, dtype=CELL_DTYPE, count=n * n * 32 * 32)
+    return int(np.count_nonzero(cells['code']))
+
+
+@pytest.fixture
+def snapshots():
+    """Old snapshot and new one with a changed cell, a touched header, removed and added tiles."""
+    with TemporaryDirectory() as tmpdir:
+        old_path, new_path = os.path.join(tmpdir, 'old'), os.path.join(tmpdir, 'new')
+        make_tiles(old_path, LAYER, seed=0)
+        shutil.copytree(old_path, new_path)
+
+        # Increase depth of the first valid cell by 1.23 m
+        file_path = os.path.join(new_path, '0.qdc')
+        offset = get_tile_offset(os.path.getsize(file_path), get_layer_parameters(LAYER)) - 1
+        cells = np.fromfile(file_path, dtype=np.uint8)[offset:].view(CELL_DTYPE)
+        index = int(np.flatnonzero((cells['code'] != 0) & (cells['depth'] < 3000))[0])
+        with open(file_path, 'r+b') as f_qdc:
+            f_qdc.seek(offset + index * CELL_DTYPE.itemsize)
+            f_qdc.write(struct.pack('<h', cells['depth'][index] + 123))
+
+        # Header changes don't make tile changed
+        with open(os.path.join(new_path, '1.qdc'), 'r+b') as f_qdc:
+            f_qdc.write(b'\xff')
+
+        os.remove(os.path.join(new_path, '3.qdc'))
+        shutil.copy(os.path.join(old_path, '2.qdc'), os.path.join(new_path, '4.qdc'))
+        with open(os.path.join(new_path, '4.qdc'), 'r+b') as f_qdc:
+            f_qdc.seek(164)
+            f_qdc.write(struct.pack('<h', 5))
+
+        yield old_path, new_path
+
+
+def test_diff(snapshots, monkeypatch):
+    old_path, new_path = snapshots
+    decoded = []
+
+    def decode_tile(tile, layer_parameters):
+        decoded.append(os.path.relpath(tile.path, os.path.dirname(old_path)))
+        return original_decode_tile(tile, layer_parameters)
+
+    original_decode_tile = diff.decode_tile
+    monkeypatch.setattr(diff, 'decode_tile', decode_tile)
+
+    with TemporaryDirectory() as tmpdir:
+        summary = run_diff(old_path, new_path, LAYER, os.path.join(tmpdir, 'delta.npy'), quite=True)
+        delta = np.load(os.path.join(tmpdir, 'delta.npy'))
+
+    # Unchanged tiles are never decoded
+    assert sorted(decoded) == [os.path.join('new', '0.qdc'), os.path.join('new', '4.qdc'),
+                               os.path.join('old', '0.qdc'), os.path.join('old', '3.qdc')]
+    assert summary['tiles'] == {'unchanged': 2, 'changed': 1, 'added': 1, 'removed': 1}
+
+    gained = count_valid_cells(os.path.join(new_path, '4.qdc'))
+    lost = count_valid_cells(os.path.join(old_path, '3.qdc'))
+    assert (summary['changed_cells'], summary['gained_cells'], summary['lost_cells']) == (1, gained, lost)
+    assert summary['delta']['min'] == summary['delta']['max'] == pytest.approx(1.23)
+
+    tile_changes = {change['status']: change for change in summary['tile_changes']}
+    assert tile_changes['changed']['changed_cells'] == 1 and tile_changes['changed']['gained_cells'] == 0
+    assert tile_changes['added']['gained_cells'] == gained and tile_changes['added']['old_path'] is None
+    assert tile_changes['removed']['lost_cells'] == lost and tile_changes['removed']['new_path'] is None
+
+    assert delta.shape == (summary['grid']['rows'], summary['grid']['cols'])
+    assert np.count_nonzero(np.nan_to_num(delta)) == 1 and np.nanmax(delta) == pytest.approx(1.23)
+
+
+def test_diff_same_snapshots(snapshots):
+    old_path = snapshots[0]
+    summary = run_diff(old_path, old_path, LAYER, quite=True)
+    assert summary['tiles']['unchanged'] == 4 and summary['changed_cells'] == 0
+    assert not summary['tile_changes']
+
+
+def test_diff_command(snapshots):
+    old_path, new_path = snapshots
+    with TemporaryDirectory() as tmpdir:
+        for ext in ('.csv', '.grd'):
+            output_path = os.path.join(tmpdir, 'delta' + ext)
+            result = CliRunner().invoke(converter_main, ['diff', old_path, new_path, '-l', str(LAYER), '-q',
+                                                         '-o', output_path])
+            assert result.exit_code == 0, result.output
+            summary = json.loads(result.output)
+
+            with open(output_path) as f_output:
+                lines = f_output.read().splitlines()
+            if ext == '.csv':
+                assert lines[0] == 'X,Y,Old(m),New(m),Delta(m)'
+                changes = summary['changed_cells'] + summary['gained_cells'] + summary['lost_cells']
+                assert len(lines) == 1 + changes
+                assert [line.split(',')[4] for line in lines[1:] if line.split(',')[4]] == ['1.23']
+            else:
+                assert lines[5] == f'NODATA_VALUE {DIFF_NODATA_VALUE}'
+                assert len(lines) == 6 + summary['grid']['rows']
+
+        result = CliRunner().invoke(converter_main, ['diff', old_path, new_path, '-l', str(LAYER), '-q',
+                                                     '-o', os.path.join(tmpdir, 'delta.txt')])
+        assert result.exit_code != 0
+
+
+def write_cells(file_path, depth, code, layer):
+    """Write north-up depth and validity code arrays to cells of QDC file."""
+    layer_parameters = get_layer_parameters(layer)
+    n = layer_parameters.n_sectors + 1
+    cells = np.zeros(depth.shape, dtype=CELL_DTYPE)
+    cells['depth'], cells['code'] = depth, code
+    cells = cells[::-1].reshape(n, 32, n, 32).transpose(0, 2, 1, 3)
+    with open(file_path, 'r+b') as f_qdc:
+        f_qdc.seek(get_tile_offset(os.path.getsize(file_path), layer_parameters) - 1)
+        f_qdc.write(cells.tobytes())
+
+
+def test_diff_overlapping_tiles():
+    """Cells moved between overlapping tiles of layer 4 aren't changes."""
+    layer = 4
+    shift = get_layer_parameters(layer).l_size2  # Tile 1.qdc is one tile step east of 0.qdc
+    with TemporaryDirectory() as tmpdir:
+        old_path, new_path = os.path.join(tmpdir, 'old'), os.path.join(tmpdir, 'new')
+        make_tiles(old_path, layer, seed=0)
+        shutil.copytree(old_path, new_path)
+
+        rng = np.random.default_rng(0)
+        depth, code = np.zeros((2, 64, 64), dtype=np.int16)
+        depth[:10, 20:30], code[:10, 20:30] = rng.integers(1, 3000, (10, 10)), 0x1234
+        moved = np.roll(depth, -shift, axis=1), np.roll(code, -shift, axis=1)
+        empty = np.zeros_like(depth), np.zeros_like(code)
+        for folder_path, first, second in ((old_path, (depth, code), empty), (new_path, empty, moved)):
+            write_cells(os.path.join(folder_path, '0.qdc'), *first, layer)
+            write_cells(os.path.join(folder_path, '1.qdc'), *second, layer)
+
+        summary = run_diff(old_path, new_path, layer, quite=True)
+        assert summary['tiles'] == {'unchanged': 2, 'changed': 0, 'added': 0, 'removed': 0}
+        assert (summary['changed_cells'], summary['gained_cells'], summary['lost_cells']) == (0, 0, 0)
+        assert not summary['tile_changes']
+
+        # Real change of a moved cell is reported by both tiles covering it
+        depth, code = moved
+        depth[0, 20 - shift] += 100
+        write_cells(os.path.join(new_path, '1.qdc'), depth, code, layer)
+        summary = run_diff(old_path, new_path, layer, quite=True)
+        assert summary['tiles']['changed'] == 2 and summary['changed_cells'] == 1
+        assert summary['delta']['min'] == summary['delta']['max'] == pytest.approx(1)
+        assert [change['changed_cells'] for change in summary['tile_changes']] == [1, 1]
@@ -0,0 +1,198 @@
+"""Differential tests of conversion engines.
+
+Every engine is run on generated tiles of all layers and all QDC file sizes of each layer.
+Both engines are compared cell by cell against the original converter in `reference.py`.
+Mismatched cells are reported with QDC file and offset of the cell record.
+"""
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from qdc_converter import cli, cli_multithreaded
+from qdc_converter import main as converter_main
+from qdc_converter.shards import build_shard
+from qdc_converter.tiles import (CELL_DTYPE, LAYER_PARAMETERS, SECTOR_SIZE,
+                                 get_grid_size, get_layer_parameters,
+                                 get_tile_slices,
+                                 get_tiles_bounds)
+from qdc_converter.utils import LRUCache
+
+from helpers import get_file_sizes, make_tiles
+from reference import reference_export
+
+LAYERS = sorted(LAYER_PARAMETERS)
+
+# Options of the writers, names are the same as `run_cli` arguments
+WRITER_OPTIONS = {
+    'defaults': {},
+    'corrections': dict(x_correction=0.001, y_correction=-0.002, z_correction=0.5),
+    'csv': dict(csv_delimiter=';', csv_skip_headers=True, csv_yxz=True),
+    'fixed-width': dict(fixed_width=True, z_correction=-0.25),
+}
+
+
+@pytest.fixture(scope='module')
+def tiles_folders():
+    """Folders of generated tiles by layer."""
+    with TemporaryDirectory() as tmpdir:
+        folders = {}
+        for layer in LAYERS:
+            folders[layer] = os.path.join(tmpdir, f'l{layer}')
+            make_tiles(folders[layer], layer, seed=layer)
+        yield folders
+
+
+def locate_cell(row, col, tiles, x_min, y_min, y_size, layer_parameters):
+    """Find the QDC file of the depth array cell and offset of the cell record in it.
+
+    Returns:
+        Tuple of the tile and offset of the cell record, `(None, None)` if no tile covers the cell.
+    """
+    size = (layer_parameters.n_sectors + 1) * SECTOR_SIZE
+    for tile in reversed(tiles):  # The last written tile wins
+        rows, cols = get_tile_slices(tile, x_min, y_min, y_size, layer_parameters)
+        if rows.start <= row < rows.stop and cols.start <= col < cols.stop:
+            y, x = size - 1 - (row - rows.start), col - cols.start  # Tile rows go from south to north
+            yy, xx = y // SECTOR_SIZE, x // SECTOR_SIZE
+            index = ((yy * (size // SECTOR_SIZE) + xx) * SECTOR_SIZE + y % SECTOR_SIZE) * SECTOR_SIZE + x % SECTOR_SIZE
+            return tile, tile.offset - 1 + index * CELL_DTYPE.itemsize
+    return None, None
+
+
+def assert_same_grids(expected, actual, tiles, x_min, y_min, layer_parameters, limit=10):
+    """Compare depth arrays reporting mismatched cells with their QDC files and offsets."""
+    assert expected.shape == actual.shape
+    mismatches = np.argwhere(expected != actual)
+    if not mismatches.size:
+        return
+
+    lines = []
+    for row, col in mismatches[:limit].tolist():
+        tile, offset = locate_cell(row, col, tiles, x_min, y_min, expected.shape[0], layer_parameters)
+        source = f'{tile.path} at offset {offset}' if tile else 'no tile'
+        lines.append(f'cell [{row}, {col}]: expected {expected[row, col]}, got {actual[row, col]} ({source})')
+    pytest.fail(f'{len(mismatches)} cells differ:\n' + '\n'.join(lines))
+
+
+def assert_same_files(expected_path, actual_path):
+    """Compare results byte by byte reporting the first mismatched line."""
+    with open(expected_path, 'rb') as f_expected, open(actual_path, 'rb') as f_actual:
+        expected, actual = f_expected.read(), f_actual.read()
+    if expected == actual:
+        return
+
+    expected_lines, actual_lines = expected.split(b'\n'), actual.split(b'\n')
+    for line_number, (expected_line, actual_line) in enumerate(zip(expected_lines, actual_lines), start=1):
+        if expected_line != actual_line:
+            pytest.fail(f'{actual_path} differs at line {line_number}:\n'
+                        f'expected {expected_line[:200]!r}\ngot      {actual_line[:200]!r}')
+    pytest.fail(f'{actual_path} has {len(actual_lines)} lines instead of {len(expected_lines)}')
+
+
+def decode_layer(folder_path, layer, validity_codes, tile_cache=None):
+    """Decode tiles of the layer with the cell by cell or the vectorized decoder."""
+    layer_parameters = get_layer_parameters(layer)
+    tiles = cli.scan_layer_tiles(folder_path, layer_parameters, True)
+    bounds = get_tiles_bounds(tiles)
+    y_size, x_size = get_grid_size(bounds, layer_parameters)
+    arr_depth = cli.calculate_depth_array(tiles, bounds[0], bounds[1], x_size, y_size, layer_parameters,
+                                          validity_codes, True, tile_cache)
+    return arr_depth, tiles, bounds[0], bounds[1]
+
+
+@pytest.mark.parametrize('validity_codes', [False, True])
+@pytest.mark.parametrize('layer', LAYERS)
+def test_decoders(tiles_folders, layer, validity_codes):
+    """Vectorized decoder, its cache and shards give the same grid as the cell by cell decoder."""
+    layer_parameters = get_layer_parameters(layer)
+    expected, tiles, x_min, y_min = decode_layer(tiles_folders[layer], layer, validity_codes)
+    assert len(tiles) == len(get_file_sizes(layer))
+    assert np.count_nonzero(expected)
+
+    tile_cache = LRUCache(16)
+    for _attempt in range(2):  # Decoded and cached tiles
+        actual = decode_layer(tiles_folders[layer], layer, validity_codes, tile_cache)[0]
+        assert_same_grids(expected, actual, tiles, x_min, y_min, layer_parameters)
+
+    actual, meta = build_shard(tiles_folders[layer], layer, validity_codes, True)
+    assert (meta['x_min'], meta['y_min']) == (x_min, y_min)
+    assert_same_grids(expected, actual, tiles, x_min, y_min, layer_parameters)
+
+
+@pytest.mark.parametrize('options', list(WRITER_OPTIONS))
+@pytest.mark.parametrize('output_ext', ['.csv', '.grd'])
+@pytest.mark.parametrize('validity_codes', [False, True])
+@pytest.mark.parametrize('layer', LAYERS)
+def test_writers(tiles_folders, monkeypatch, layer, validity_codes, output_ext, options):
+    """Multiprocess writer gives the same bytes as the single-threaded one."""
+    monkeypatch.setattr(cli_multithreaded, 'CHUNK_CELLS', 2 ** 14)  # Several chunks of every grid
+    arr_depth, tiles, x_min, y_min = decode_layer(tiles_folders[layer], layer, validity_codes)
+
+    kwargs = dict(x_correction=0.0, y_correction=0.0, z_correction=0.0,
+                  csv_delimiter=',', csv_skip_headers=False, csv_yxz=False)
+    kwargs.update(WRITER_OPTIONS[options])
+
+    with TemporaryDirectory() as tmpdir:
+        expected_path = os.path.join(tmpdir, 'expected' + output_ext)
+        actual_path = os.path.join(tmpdir, 'actual' + output_ext)
+        cli.save_depth_array(arr_depth, expected_path, x_min, y_min, layer, validity_codes, True, **kwargs)
+        cli_multithreaded.save_depth_array(arr_depth, actual_path, x_min, y_min, layer, validity_codes, True,
+                                           workers=2, **kwargs)
+        assert_same_files(expected_path, actual_path)
+
+
+@pytest.mark.parametrize('layer', LAYERS)
+def test_engines(tiles_folders, layer):
+    """Single-threaded and multiprocess conversions give the same bytes."""
+    with TemporaryDirectory() as tmpdir:
+        paths = {}
+        for engine, engine_args in (('singlethreaded', ['-st']), ('multiprocess', ['-w', '2'])):
+            paths[engine] = os.path.join(tmpdir, engine + '.csv')
+            result = CliRunner().invoke(converter_main, ['-i', tiles_folders[layer], '-o', paths[engine],
+                                                         '-l', str(layer), '-dz', '0.5', '-q'] + engine_args)
+            assert result.exit_code == 0, result.output
+        assert_same_files(paths['singlethreaded'], paths['multiprocess'])
+
+
+@pytest.mark.parametrize('output_ext, options', [
+    ('.csv', 'defaults'), ('.csv', 'corrections'), ('.csv', 'csv'), ('.grd', 'defaults'), ('.grd', 'corrections'),
+])
+@pytest.mark.parametrize('validity_codes', [False, True])
+@pytest.mark.parametrize('layer', LAYERS)
+def test_reference(tiles_folders, layer, validity_codes, output_ext, options):
+    """Both engines give the same bytes as the original cell by cell converter."""
+    kwargs = dict(dict(x_correction=0.0, y_correction=0.0, z_correction=0.0, csv_delimiter=',',
+                       csv_skip_headers=False, csv_yxz=False), **WRITER_OPTIONS[options])
+    with TemporaryDirectory() as tmpdir:
+        expected_path = os.path.join(tmpdir, 'reference' + output_ext)
+        reference_export(tiles_folders[layer], expected_path, layer, validity_codes, **kwargs)
+        for multithreaded in (False, True):
+            actual_path = os.path.join(tmpdir, f'{multithreaded}{output_ext}')
+            cli.run_cli(tiles_folders[layer], actual_path, layer, validity_codes, True, multithreaded=multithreaded,
+                        workers=2, **kwargs)
+            assert_same_files(expected_path, actual_path)
+
+
+def test_locate_cell(tiles_folders):
+    """Mismatched cells are reported with the QDC file and offset they're read from."""
+    layer = 4  # Overlapping tiles
+    layer_parameters = get_layer_parameters(layer)
+    arr_codes, tiles, x_min, y_min = decode_layer(tiles_folders[layer], layer, True)
+
+    rng = np.random.default_rng(0)
+    for row, col in zip(rng.integers(0, arr_codes.shape[0], 100), rng.integers(0, arr_codes.shape[1], 100)):
+        tile, offset = locate_cell(row, col, tiles, x_min, y_min, arr_codes.shape[0], layer_parameters)
+        if tile is None:
+            assert arr_codes[row, col] == 0
+            continue
+        with open(tile.path, 'rb') as f_qdc:
+            f_qdc.seek(offset)
+            assert np.frombuffer(f_qdc.read(CELL_DTYPE.itemsize), dtype=CELL_DTYPE)['code'][0] == arr_codes[row, col]
+
+    corrupted = arr_codes.copy()
+    corrupted[3, 5] += 1
+    tile, offset = locate_cell(3, 5, tiles, x_min, y_min, arr_codes.shape[0], layer_parameters)
+    with pytest.raises(pytest.fail.Exception, match=f'cell \\[3, 5\\].*{tile.path} at offset {offset}'):
+        assert_same_grids(arr_codes, corrupted, tiles, x_min, y_min, layer_parameters)
@@ -0,0 +1,63 @@
+import csv
+import filecmp
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from qdc_converter import cli_multithreaded
+from qdc_converter import main as converter_main
+
+here = os.path.dirname(os.path.abspath(__file__))
+qdc_path = os.path.join(here, 'data', 'main', 'qdc_contours')
+
+
+def read_values(file_path, skip_lines, delimiter=None):
+    """Read numeric values of the result skipping its header."""
+    with open(file_path, newline='') as f:
+        lines = f.read().splitlines()[skip_lines:]
+    if delimiter:
+        return np.array([list(map(float, row)) for row in csv.reader(lines, delimiter=delimiter)])
+    return np.array([list(map(float, line.split())) for line in lines])
+
+
+@pytest.mark.parametrize('validity_codes', [False, True])
+@pytest.mark.parametrize('output_ext', ['.grd', '.csv'])
+def test_fixed_width(monkeypatch, output_ext, validity_codes):
+    """Rows written by workers at their offsets are the same as sequentially written ones
+    and have the same values as the regular result."""
+    monkeypatch.setattr(cli_multithreaded, 'CHUNK_CELLS', 1000)  # Several chunks of the small grid
+    args = ['-i', qdc_path, '-l', '1', '-dz', '0.5', '-csvd', ';', '-q'] + (['-vc'] if validity_codes else [])
+
+    with TemporaryDirectory() as tmpdir:
+        paths = {name: os.path.join(tmpdir, name + output_ext) for name in ('regular', 'positioned', 'sequential')}
+        for name, extra_args in (('regular', []), ('positioned', ['-fw', '-w', '2']), ('sequential', ['-fw', '-st'])):
+            result = CliRunner().invoke(converter_main, args + ['-o', paths[name]] + extra_args)
+            assert result.exit_code == 0, result.output
+
+        assert filecmp.cmp(paths['positioned'], paths['sequential'], shallow=False)
+
+        skip_lines = 6 if output_ext == '.grd' else 1
+        with open(paths['positioned'], 'rb') as f_result:
+            lines = f_result.read().split(b'\n')[skip_lines:-1]
+        assert len({len(line) for line in lines}) == 1
+
+        delimiter = ';' if output_ext == '.csv' else None
+        regular = read_values(paths['regular'], skip_lines, delimiter)
+        fixed_width = read_values(paths['positioned'], skip_lines, delimiter)
+        assert regular.shape == fixed_width.shape
+        assert np.allclose(regular, fixed_width, rtol=0, atol=0.005)
+
+
+def test_fixed_width_validation():
+    """Fixed-width values are not written to contours and CSV delimiter must not get them quoted."""
+    runner = CliRunner()
+    with TemporaryDirectory() as tmpdir:
+        result = runner.invoke(converter_main, ['-i', qdc_path, '-l', '1', '-fw', '-q',
+                                                '-o', os.path.join(tmpdir, 'output.geojson')])
+        assert 'only to *.csv or *.grd' in result.output
+
+        result = runner.invoke(converter_main, ['-i', qdc_path, '-l', '1', '-fw', '-q', '-csvd', '.',
+                                                '-o', os.path.join(tmpdir, 'output.csv')])
+        assert 'could not be used with fixed-width values' in result.output
@@ -0,0 +1,40 @@
+import csv
+import json
+import os
+
+from click.testing import CliRunner
+from qdc_converter import main as converter_main
+
+
+def test_inspect():
+    """Inspect test qdc and compare statistics with validated CSV sample."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    test_path = os.path.join(here, 'data', 'main')
+    qdc_path = os.path.join(test_path, 'qdc_contours')
+
+    with open(os.path.join(test_path, '0_17902c10.l1.csv'), 'r') as f_csv:
+        depths = [float(row['Depth(m)']) for row in csv.DictReader(f_csv)]
+
+    result = CliRunner().invoke(converter_main, ['inspect', '-i', qdc_path, '-l', '1', '-l', '0', '--stats', '-q'])
+    assert result.exit_code == 0, result.output
+    report = json.loads(result.output)
+
+    assert report['files'] == 1
+    assert report['layers']['0'] == {'tiles': 0}
+
+    layer_report = report['layers']['1']
+    assert layer_report['tiles'] == 1
+    assert layer_report['grid']['rows'] == layer_report['grid']['cols'] == 128
+    assert layer_report['coverage']['valid_cells'] == len(depths)
+    assert layer_report['depth']['min'] == min(depths)
+    assert layer_report['depth']['max'] == max(depths)
+    assert sum(layer_report['depth_histogram']['counts']) == len(depths)
+    assert sum(code['count'] for code in layer_report['validity_codes']) == len(depths)
+
+    # Headers only
+    result = CliRunner().invoke(converter_main, ['inspect', '-i', qdc_path])
+    assert result.exit_code == 0, result.output
+    report = json.loads(result.output)
+    assert sorted(report['layers']) == ['0', '1', '2', '3', '4', '5']
+    assert 'coverage' not in report['layers']['1']
+    assert report['layers']['1']['bbox'] == layer_report['bbox']
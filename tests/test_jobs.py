@@ -0,0 +1,107 @@
+import json
+import os
+import socket
+import threading
+import urllib.error
+import urllib.request
+from tempfile import TemporaryDirectory
+
+import pytest
+from qdc_converter.jobs import (JOB_DONE, JOB_FAILED, JobHTTPServer,
+                                JobService, JobUnixServer)
+
+from helpers import compare_two_csv
+
+here = os.path.dirname(os.path.abspath(__file__))
+test_path = os.path.join(here, 'data', 'main')
+qdc_path = os.path.join(test_path, 'qdc_contours')
+
+
+@pytest.fixture(scope='module')
+def service():
+    service = JobService(concurrency=1)
+    yield service
+    service.close()
+
+
+def request(url, method='GET', content=None):
+    data = json.dumps(content).encode() if content is not None else None
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, method=method)) as response:
+        return response.status, json.loads(response.read())
+
+
+def test_serve_jobs_http(service):
+    server = JobHTTPServer(('127.0.0.1', 0), service, quite=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://%s:%d/jobs' % server.server_address[:2]
+
+    try:
+        with TemporaryDirectory() as tmpdir:
+            # The same tiles are converted twice, the second time they're taken from the worker's cache
+            for n in range(2):
+                output_path = os.path.join(tmpdir, f'output{n}.csv')
+                status, job = request(url, 'POST', {'qdc_folder_path': qdc_path, 'output_path': output_path,
+                                                    'layer': 1})
+                assert status == 202
+                status, job = request(f'{url}/{job["id"]}?wait=60')
+                assert job['status'] == JOB_DONE, job
+                assert job['output_size'] == os.path.getsize(output_path)
+                assert job['timings']['run'] > 0
+                assert job['progress']['stage']
+                compare_two_csv(os.path.join(test_path, '0_17902c10.l1.csv'), output_path)
+
+            status, job = request(url, 'POST', {'qdc_folder_path': tmpdir, 'output_path': 'empty.csv', 'layer': 1})
+            status, job = request(f'{url}/{job["id"]}?wait=60')
+            assert job['status'] == JOB_FAILED
+            assert 'No valid QDC files found' in job['error']
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            request(url, 'POST', {'qdc_folder_path': qdc_path, 'layer': 1})
+        assert e.value.code == 400
+
+        status, jobs = request(url)
+        assert len(jobs) >= 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve_jobs_unix_socket(service):
+    with TemporaryDirectory() as tmpdir:
+        socket_path = os.path.join(tmpdir, 'jobs.sock')
+        server = JobUnixServer(socket_path, service, quite=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socket_path)
+                client.sendall(b'GET /jobs/0 HTTP/1.0\r\n\r\n')
+                response = b''.join(iter(lambda: client.recv(4096), b''))
+            assert response.startswith(b'HTTP/1.0 404')
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert not os.path.exists(socket_path)
+
+
+def test_jobs_history():
+    """Only the latest finished jobs are kept, every finished job has its start time."""
+    service = JobService(concurrency=1, history_size=2)
+    try:
+        with TemporaryDirectory() as tmpdir:
+            jobs = [service.submit({'qdc_folder_path': tmpdir, 'output_path': f'empty{n}.csv', 'layer': 1})
+                    for n in range(4)]
+            for job in jobs:
+                with service.condition:
+                    service.condition.wait_for(lambda: job['id'] not in service.futures, timeout=60)
+
+        kept = service.list()
+        assert [job['id'] for job in kept] == [job['id'] for job in jobs[2:]]
+        assert service.get(jobs[0]['id']) is None
+        for job in kept:
+            assert job['status'] == JOB_FAILED
+            timings = job['timings']
+            assert timings['queued'] <= timings['started'] <= timings['finished']
+            assert timings['wait'] == timings['started'] - timings['queued']
+    finally:
+        service.close()
@@ -0,0 +1,113 @@
+import os
+import struct
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from qdc_converter import cli, resume
+from qdc_converter import main as converter_main
+from qdc_converter.cli import run_cli
+from qdc_converter.las import LAS_POINT_DTYPE
+
+from helpers import read_csv_points
+
+here = os.path.dirname(os.path.abspath(__file__))
+test_path = os.path.join(here, 'data', 'main')
+qdc_path = os.path.join(test_path, 'qdc_contours')
+
+
+def read_las(las_path):
+    """Read header fields and points of LAS 1.2 file with point data format 0."""
+    with open(las_path, 'rb') as f_las:
+        data = f_las.read()
+    assert data[:4] == b'LASF' and data[24:26] == bytes([1, 2])
+    header_size, points_offset, vlrs_count, point_format, record_size, points_count = \
+        struct.unpack_from('<HIIBHI', data, 94)
+    assert (header_size, points_offset, vlrs_count, point_format, record_size) == (227, 227, 0, 0, 20)
+    scales, offsets = struct.unpack_from('<3d', data, 131), struct.unpack_from('<3d', data, 155)
+    bounds = struct.unpack_from('<6d', data, 179)  # Max and min of X, Y and Z
+    points = np.frombuffer(data, dtype=LAS_POINT_DTYPE, offset=points_offset)
+    assert points.size == points_count == struct.unpack_from('<I', data, 111)[0]  # All points are first returns
+
+    coordinates = [offset + points[axis] * scale for axis, scale, offset in zip('xyz', scales, offsets)]
+    for values, max_value, min_value in zip(coordinates, bounds[::2], bounds[1::2]):
+        assert (values.max(), values.min()) == pytest.approx((max_value, min_value))
+    return coordinates, points
+
+
+@pytest.mark.parametrize('multithreaded', [False, True])
+def test_las(multithreaded):
+    """Points are the same as records of CSV table, validity codes go to user data."""
+    xs, ys, zs = read_csv_points(os.path.join(test_path, '0_17902c10.l1.csv'))
+    with TemporaryDirectory() as tmpdir:
+        output_path = os.path.join(tmpdir, 'output.las')
+        run_cli(qdc_path, output_path, 1, False, True, 0.001, -0.002, 0.5, ',', False, False, multithreaded,
+                workers=2)
+        (las_xs, las_ys, las_zs), points = read_las(output_path)
+
+    # Same order of points as in CSV table
+    assert np.allclose(las_xs, xs + 0.001, rtol=0, atol=1e-9)
+    assert np.allclose(las_ys, ys - 0.002, rtol=0, atol=1e-9)
+    assert np.allclose(las_zs, zs + 0.5, rtol=0, atol=1e-9)
+    assert np.all(points['user_data'] == 3) and np.all(points['flags'] == 9)
+
+
+def test_las_validity_codes():
+    with TemporaryDirectory() as tmpdir:
+        output_path = os.path.join(tmpdir, 'output.las')
+        run_cli(qdc_path, output_path, 2, True, True, 0.0, 0.0, 0.0, ',', False, False, False)
+        (las_xs, las_ys, las_zs), points = read_las(output_path)
+    assert points.size and np.all(las_zs == 23.0) and np.all(points['user_data'] == 23)
+
+
+def test_las_fixed_width():
+    with TemporaryDirectory() as tmpdir, pytest.raises(ValueError):
+        run_cli(qdc_path, os.path.join(tmpdir, 'output.las'), 1, False, True, 0.0, 0.0, 0.0, ',', False, False,
+                False, fixed_width=True)
+
+
+@pytest.mark.parametrize('singlethreaded', [False, True])
+def test_las_engines_and_resume(monkeypatch, singlethreaded):
+    """Multiprocess and resumed conversions give the same points and codes as single-threaded one."""
+    with TemporaryDirectory() as tmpdir:
+        expected_path = os.path.join(tmpdir, 'expected.las')
+        result = CliRunner().invoke(converter_main, ['-i', qdc_path, '-o', expected_path, '-l', '1', '-q', '-st'])
+        assert result.exit_code == 0, result.output
+        expected_points = read_las(expected_path)[1]
+        assert expected_points.size and np.all(expected_points['user_data'] == 3)
+
+        output_path = os.path.join(tmpdir, 'output.las')
+        args = ['-i', qdc_path, '-o', output_path, '-l', '1', '-q', '--resume']
+        args += ['-st'] if singlethreaded else ['-w', '2']
+
+        # Crash when the result is written, depth and codes are kept in the checkpoint
+        def crash(self):
+            raise RuntimeError('Interrupted')
+
+        calls = []
+
+        def calculate_depth_array(*args, **kwargs):
+            calls.append(kwargs)
+            return original_calculate_depth_array(*args, **kwargs)
+
+        original_calculate_depth_array = cli.calculate_depth_array
+        monkeypatch.setattr(cli, 'calculate_depth_array', calculate_depth_array)
+        monkeypatch.setattr(resume.Checkpoint, 'finish', crash)
+        result = CliRunner().invoke(converter_main, args)
+        assert isinstance(result.exception, RuntimeError)
+        monkeypatch.undo()
+        assert len(calls) == 1  # Depth and codes are decoded in one pass
+        assert os.path.exists(os.path.join(output_path + '.resume', 'codes.npy'))
+
+        # Resumed conversion doesn't decode tiles again
+        def decode(*args, **kwargs):
+            raise AssertionError('Tiles are decoded again')
+
+        monkeypatch.setattr(cli, 'calculate_depth_array', decode)
+        result = CliRunner().invoke(converter_main, args)
+        assert result.exit_code == 0, result.output
+
+        points = read_las(output_path)[1]
+        assert points.size == expected_points.size
+        assert np.array_equal(points, expected_points)
@@ -1,4 +1,3 @@
-import csv
 import os
 from tempfile import TemporaryDirectory
 
@@ -7,27 +6,14 @@ from click.testing import CliRunner
 from qdc_converter import main as converter_main
 from qdc_converter.utils import get_files_recursively
 
+from helpers import compare_two_csv
+
 
 @pytest.fixture(scope='module')
 def runner():
     return CliRunner()
 
 
-def compare_two_csv(csv_one, csv_two):
-    """Compare 2 CSV files.
-
-    Args:
-        csv_one (str): Path to 1st csv.
-        csv_two (str): Path to 2nd csv.
-    """
-    with open(csv_one, 'r') as f1, open(csv_two, 'r') as f2:
-        data1 = list(csv.reader(f1))
-        data2 = list(csv.reader(f2))
-        assert len(data1) == len(data2)
-        for v1, v2 in zip(data1, data2):
-            assert v1 == v2
-
-
 def test_main(runner):
     """Convert test qdc and compare csv output with validated sample."""
     with TemporaryDirectory() as tmpdir:
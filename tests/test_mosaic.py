@@ -0,0 +1,59 @@
+import os
+import shutil
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from qdc_converter import main as converter_main
+from qdc_converter.mosaic import MOSAIC_POLICIES, build_mosaic
+from qdc_converter.tiles import CELL_DTYPE, get_layer_parameters, scan_tiles
+
+from helpers import compare_two_csv
+
+here = os.path.dirname(os.path.abspath(__file__))
+test_path = os.path.join(here, 'data', 'main')
+qdc_path = os.path.join(test_path, 'qdc_contours')
+
+
+@pytest.fixture(scope='module')
+def deeper_copy():
+    """Copy of test tiles with all valid cells made 1 m deeper and newer mtime."""
+    with TemporaryDirectory() as tmpdir:
+        copy_path = os.path.join(tmpdir, 'deeper')
+        shutil.copytree(qdc_path, copy_path)
+        layer_parameters = get_layer_parameters(1)
+        for tile in scan_tiles(copy_path, layer_parameters):
+            data = np.fromfile(tile.path, dtype=np.uint8)
+            cells = data[tile.offset - 1:].view(CELL_DTYPE)
+            cells['depth'][cells['code'] != 0] += 100
+            data.tofile(tile.path)
+            os.utime(tile.path, (tile.mtime + 60, tile.mtime + 60))
+        yield copy_path
+
+
+def test_mosaic_single_source():
+    """Mosaic of a single folder is the same as plain conversion."""
+    with TemporaryDirectory() as tmpdir:
+        result_csv = os.path.join(tmpdir, 'output.csv')
+        result = CliRunner().invoke(converter_main, [
+            'mosaic', '-i', qdc_path, '-o', result_csv, '-l', '1', '--policy', 'min', '--quite',
+        ])
+        assert result.exit_code == 0, result.output
+        compare_two_csv(os.path.join(test_path, '0_17902c10.l1.csv'), result_csv)
+
+
+@pytest.mark.parametrize('policy', MOSAIC_POLICIES)
+def test_mosaic_policies(deeper_copy, policy):
+    arr_orig, *_ = build_mosaic([qdc_path], 1, 'newest', False, True)
+    arr_deeper, *_ = build_mosaic([deeper_copy], 1, 'newest', False, True)
+    arr_merged, *_ = build_mosaic([qdc_path, deeper_copy], 1, policy, False, True)
+
+    valid = arr_orig != 0
+    expected = {
+        'newest': arr_deeper,
+        'min': arr_orig,
+        'mean': np.where(valid, arr_orig + 50, 0),
+        'max-code': arr_orig,  # same codes, the first one wins
+    }[policy]
+    assert np.array_equal(arr_merged, expected)
@@ -0,0 +1,25 @@
+from qdc_converter.utils import ProgressChannel
+
+
+def test_progress_channel_coalesces_updates():
+    """Updates within the interval are coalesced into one message."""
+    messages = []
+    channel = ProgressChannel(messages.append, frequency=1e-3)
+
+    channel.start('Stage', total=1000)
+    for n in range(1, 1001):
+        channel.update(n, nbytes=n * 10)
+    assert len(messages) == 1
+
+    channel.flush()
+    assert len(messages) == 2
+
+    key, progress = messages[-1]
+    assert key == '#Progress'
+    assert progress['stage'] == 'Stage'
+    assert (progress['n'], progress['total'], progress['nbytes']) == (1000, 1000, 10000)
+    assert progress['eta'] == 0
+
+    # Nothing is pending after flush
+    channel.flush()
+    assert len(messages) == 2
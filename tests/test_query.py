@@ -0,0 +1,82 @@
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from qdc_converter import cli
+from qdc_converter import main as converter_main
+from qdc_converter.query import DepthQuery
+from qdc_converter.tiles import (TILE_STEP, get_grid_size, get_layer_parameters,
+                                 get_tiles_bounds, get_z_values)
+
+from helpers import make_tiles, read_csv_points
+
+here = os.path.dirname(os.path.abspath(__file__))
+test_path = os.path.join(here, 'data', 'main')
+qdc_path = os.path.join(test_path, 'qdc_contours')
+
+
+def test_query_converted_points():
+    """Cells of the converted CSV give their depth back, points outside of data give nothing."""
+    xs, ys, zs = read_csv_points(os.path.join(test_path, '0_17902c10.l1.csv'))
+    depth_query = DepthQuery(qdc_path, 1, tile_cache_size=1, quite=True)
+    depth, code = depth_query.query(xs, ys)
+    assert np.allclose(depth, zs) and np.all(code != 0)
+
+    depth, code = depth_query.query(xs + 0.1, ys - 0.2, x_correction=0.1, y_correction=-0.2, z_correction=1.5)
+    assert np.allclose(depth, zs + 1.5)
+
+    depth, code = depth_query.query([0.0, xs[0] + 1], [0.0, ys[0]])
+    assert np.all(np.isnan(depth)) and np.all(code == 0)
+
+
+@pytest.mark.parametrize('layer', [1, 4])
+def test_query_grid(layer):
+    """Every cell of generated overlapping tiles is the same as in the converted depth arrays."""
+    layer_parameters = get_layer_parameters(layer)
+    with TemporaryDirectory() as tmpdir:
+        folder_path = os.path.join(tmpdir, 'qdc')
+        make_tiles(folder_path, layer, seed=layer)
+        tiles = cli.scan_layer_tiles(folder_path, layer_parameters, True)
+        bounds = get_tiles_bounds(tiles)
+        y_size, x_size = get_grid_size(bounds, layer_parameters)
+        arr_depth, arr_code = (cli.calculate_depth_array(tiles, bounds[0], bounds[1], x_size, y_size,
+                                                         layer_parameters, validity_codes, True)
+                               for validity_codes in (False, True))
+
+        # Cell centers as written by the converter, rows are north-up
+        a_step = layer_parameters.a_step
+        rows, cols = np.indices((y_size, x_size))
+        xs = bounds[0] * TILE_STEP + a_step / 2 + cols * a_step
+        ys = bounds[1] * TILE_STEP + a_step / 2 + (y_size - rows - 1) * a_step
+
+        depth, code = DepthQuery(folder_path, layer, tile_cache_size=2, quite=True).query(xs, ys)
+        assert np.array_equal(code, get_z_values(arr_code, True))
+        # Depth of overlapped cells could come from an earlier tile with valid cell
+        has_depth = ~np.isnan(depth)
+        assert np.all(has_depth[arr_code != 0]) and not np.any(arr_depth[~has_depth])
+        assert np.array_equal(depth[has_depth], get_z_values(arr_depth[has_depth], False))
+
+
+def test_query_command():
+    xs, ys, zs = read_csv_points(os.path.join(test_path, '0_17902c10.l1.csv'))
+    with TemporaryDirectory() as tmpdir:
+        points_path = os.path.join(tmpdir, 'points.csv')
+        with open(points_path, 'w') as f_points:
+            f_points.write('lat;lon\n')
+            f_points.write(''.join(f'{y!r};{x!r}\n' for x, y in zip(xs[:10].tolist(), ys[:10].tolist())))
+            f_points.write('0;0\n')
+
+        result = CliRunner().invoke(converter_main, ['query', points_path, '-i', qdc_path, '-l', '1', '-q',
+                                                     '-csvd', ';', '-csvy'])
+        assert result.exit_code == 0, result.output
+        lines = result.output.splitlines()
+        assert lines[0] == 'y;x;z;code'
+        assert [float(line.split(';')[2]) for line in lines[1:11]] == pytest.approx(zs[:10].tolist())
+        assert lines[-1].split(';')[:3] == ['0.0', '0.0', '']
+
+        with open(points_path, 'w') as f_points:
+            f_points.write('1;2;3\nbad\n')
+        result = CliRunner().invoke(converter_main, ['query', points_path, '-i', qdc_path, '-l', '1', '-q'])
+        assert result.exit_code != 0
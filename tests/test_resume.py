@@ -0,0 +1,54 @@
+import os
+from tempfile import TemporaryDirectory
+
+import pytest
+from click.testing import CliRunner
+from qdc_converter import main as converter_main
+from qdc_converter import cli_multithreaded, resume
+
+from helpers import compare_two_csv
+
+
+@pytest.mark.parametrize('singlethreaded', [False, True])
+def test_resume(monkeypatch, singlethreaded):
+    """Interrupt conversion, damage uncommitted tail and make sure resumed result is complete."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    test_path = os.path.join(here, 'data', 'main')
+    qdc_path = os.path.join(test_path, 'qdc_contours')
+    csv_sample_file = os.path.join(test_path, '0_17902c10.l1.csv')
+
+    with TemporaryDirectory() as tmpdir:
+        output_path = os.path.join(tmpdir, 'output.csv')
+        work_path = output_path + '.resume'
+        args = ['-i', qdc_path, '-o', output_path, '-l', '1', '--resume', '--quite']
+        if singlethreaded:
+            args.append('--singlethreaded')
+
+        # Commit every written row and crash at the very end
+        def crash(self):
+            raise RuntimeError('Interrupted')
+
+        monkeypatch.setattr(resume, 'CHECKPOINT_INTERVAL', 0)
+        monkeypatch.setattr(cli_multithreaded, 'CHUNK_CELLS', 1024)  # Several chunks of the small grid
+        monkeypatch.setattr(resume.Checkpoint, 'finish', crash)
+        result = CliRunner().invoke(converter_main, args)
+        assert isinstance(result.exception, RuntimeError)
+        assert not os.path.exists(output_path)
+        monkeypatch.undo()
+
+        # Keep a half of the journal and write garbage after the last commit
+        journal_path = os.path.join(work_path, 'journal')
+        with open(journal_path) as f_journal:
+            journal = f_journal.readlines()
+        assert len(journal) > 1
+        with open(journal_path, 'w') as f_journal:
+            f_journal.writelines(journal[:len(journal) // 2])
+            f_journal.write('999 99')  # Partially written commit
+        with open(os.path.join(work_path, 'output.csv'), 'a') as f_part:
+            f_part.write('garbage\n' * 10)
+
+        result = CliRunner().invoke(converter_main, args)
+        assert result.exit_code == 0, result.output
+
+        compare_two_csv(csv_sample_file, output_path)
+        assert not os.path.exists(work_path)
@@ -0,0 +1,84 @@
+import math
+import os
+import threading
+import urllib.error
+import urllib.request
+import zlib
+
+import numpy as np
+import pytest
+from qdc_converter.server import TileRenderer, TileServer, encode_png
+
+here = os.path.dirname(os.path.abspath(__file__))
+qdc_path = os.path.join(here, 'data', 'main', 'qdc_contours')
+
+
+def decode_png(png):
+    """Decode unfiltered RGBA PNG written by `encode_png`."""
+    assert png[:8] == b'\x89PNG\r\n\x1a\n'
+    width, height = int.from_bytes(png[16:20], 'big'), int.from_bytes(png[20:24], 'big')
+    idat_length = int.from_bytes(png[33:37], 'big')
+    assert png[37:41] == b'IDAT'
+    scanlines = np.frombuffer(zlib.decompress(png[41:41 + idat_length]), dtype=np.uint8)
+    return scanlines.reshape(height, width * 4 + 1)[:, 1:].reshape(height, width, 4)
+
+
+def get_map_tile(lon, lat, z):
+    """Get web mercator tile containing the point."""
+    n = 2 ** z
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return z, int((lon + 180) / 360 * n), int(y)
+
+
+def test_encode_png():
+    rgba = np.random.default_rng(0).integers(0, 256, (3, 5, 4), dtype=np.uint8)
+    assert np.array_equal(decode_png(encode_png(rgba)), rgba)
+
+
+@pytest.fixture(scope='module')
+def server():
+    renderer = TileRenderer(qdc_path, 1, tile_cache_size=2, png_cache_size=2, quite=True)
+    server = TileServer(('127.0.0.1', 0), renderer, workers=2, quite=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_serve_tiles(server):
+    host, port = server.server_address[:2]
+    z, x, y = get_map_tile(33.1375, 61.9655, 16)
+
+    with urllib.request.urlopen(f'http://{host}:{port}/{z}/{x}/{y}.png') as response:
+        assert response.headers['Content-Type'] == 'image/png'
+        rgba = decode_png(response.read())
+    assert (rgba[..., 3] == 255).any()  # Depth is drawn
+    assert (rgba[..., 3] == 0).any()  # Tile is larger than the data
+
+    # Far away tile is transparent
+    with urllib.request.urlopen(f'http://{host}:{port}/{z}/{x + 10}/{y}.png') as response:
+        assert not decode_png(response.read())[..., 3].any()
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(f'http://{host}:{port}/{z}/{x}/{y}.jpg')
+    assert e.value.code == 404
+
+
+def test_server_close():
+    """Closed server completes requests being handled and stops its threads."""
+    renderer = TileRenderer(qdc_path, 1, tile_cache_size=2, png_cache_size=2, quite=True)
+    server = TileServer(('127.0.0.1', 0), renderer, workers=2, quite=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    host, port = server.server_address[:2]
+    z, x, y = get_map_tile(33.1375, 61.9655, 16)
+    with urllib.request.urlopen(f'http://{host}:{port}/{z}/{x}/{y}.png') as response:
+        assert response.status == 200
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    with pytest.raises(RuntimeError):
+        server.executor.submit(print)
@@ -0,0 +1,68 @@
+import filecmp
+import os
+import shutil
+import struct
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from qdc_converter import main as converter_main
+
+here = os.path.dirname(os.path.abspath(__file__))
+qdc_file = os.path.join(here, 'data', 'main', 'qdc_contours', '0_17902c10.qdc')
+
+
+@pytest.fixture(scope='module')
+def tiles_folder():
+    """Folder with 3x3 copies of the test tile."""
+    with TemporaryDirectory() as tmpdir:
+        for dx in range(3):
+            for dy in range(3):
+                tile_path = os.path.join(tmpdir, f'{dx}_{dy}.qdc')
+                shutil.copy(qdc_file, tile_path)
+                with open(tile_path, 'r+b') as f_qdc:
+                    f_qdc.seek(160)
+                    y, x_pad, x = struct.unpack('<hhh', f_qdc.read(6))
+                    f_qdc.seek(160)
+                    f_qdc.write(struct.pack('<hhh', y + dy, x_pad, x + dx))
+        yield tmpdir
+
+
+@pytest.mark.parametrize('output_ext', ['.grd', '.csv'])
+def test_shards_merge(tiles_folder, output_ext):
+    """Merge of shards is the same as plain conversion."""
+    runner = CliRunner()
+    with TemporaryDirectory() as tmpdir:
+        expected_path = os.path.join(tmpdir, 'expected' + output_ext)
+        result = runner.invoke(converter_main, ['-i', tiles_folder, '-o', expected_path, '-l', '1', '-st', '-q'])
+        assert result.exit_code == 0, result.output
+
+        # Two shards of tile rows, the second one is split by columns
+        shards_path = os.path.join(tmpdir, 'shards')
+        for name, args in (('1', ['--shard', '1/2']), ('2a', ['--shard', '2/2', '-x', ':6032']),
+                           ('2b', ['--shard', '2/2', '-x', '6033:']), ('empty', ['-y', '0:0'])):
+            result = runner.invoke(converter_main, ['shard', '-i', tiles_folder, '-l', '1', '-q',
+                                                    '-o', os.path.join(shards_path, name)] + args)
+            assert result.exit_code == 0, result.output
+
+        merged_path = os.path.join(tmpdir, 'merged' + output_ext)
+        result = runner.invoke(converter_main, ['merge', shards_path, '-o', merged_path, '-q'])
+        assert result.exit_code == 0, result.output
+        assert filecmp.cmp(expected_path, merged_path, shallow=False)
+
+
+def test_shards_merge_npy(tiles_folder, monkeypatch):
+    """Merge into raster assembling rows by small bands."""
+    from qdc_converter import shards
+    monkeypatch.setattr(shards, 'SHARDS_BAND_SIZE', 7)
+
+    with TemporaryDirectory() as tmpdir:
+        whole_path = os.path.join(tmpdir, 'whole')
+        shards.run_shard(tiles_folder, whole_path, 1, False, True)
+        for n in range(1, 4):
+            shards.run_shard(tiles_folder, os.path.join(tmpdir, 'shards', str(n)), 1, False, True, shard=f'{n}/3')
+
+        merged_path = os.path.join(tmpdir, 'merged.npy')
+        shards.run_merge([os.path.join(tmpdir, 'shards')], merged_path, True, 0, 0, 0, ',', False, False)
+        assert np.array_equal(np.load(whole_path + '.npy'), np.load(merged_path))
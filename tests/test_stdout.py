@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+
+import pytest
+from click.testing import CliRunner
+from qdc_converter import main as converter_main
+
+here = os.path.dirname(os.path.abspath(__file__))
+test_path = os.path.join(here, 'data', 'main')
+qdc_path = os.path.join(test_path, 'qdc_contours')
+
+
+@pytest.mark.parametrize('singlethreaded', [False, True])
+@pytest.mark.parametrize('output_format', ['csv', 'grd'])
+def test_stdout(singlethreaded, output_format):
+    """Result streamed to stdout is the same as the result file, messages don't get mixed into it."""
+    args = ['-i', qdc_path, '-l', '1']
+    if singlethreaded:
+        args.append('-st')
+
+    with TemporaryDirectory() as tmpdir:
+        output_path = os.path.join(tmpdir, 'output.' + output_format)
+        result = CliRunner().invoke(converter_main, args + ['-o', output_path, '-q'])
+        assert result.exit_code == 0, result.output
+
+        process = subprocess.run([sys.executable, '-c', 'from qdc_converter import main; main()',
+                                  '-o', '-', '--format', output_format] + args,
+                                 cwd=os.path.dirname(here), capture_output=True, check=True)
+        with open(output_path, 'rb') as f_output:
+            assert process.stdout == f_output.read()
+        assert b'Saving' in process.stderr
+        expected_files = ['output.grd', 'output.prj'] if output_format == 'grd' else ['output.csv']
+        assert sorted(os.listdir(tmpdir)) == expected_files
+
+
+def test_stdout_validation():
+    """Format is required for stdout and must match extension of the result file."""
+    runner = CliRunner()
+    result = runner.invoke(converter_main, ['-i', qdc_path, '-l', '1', '-o', '-', '-q'])
+    assert 'must be set to csv or grd' in result.output
+
+    result = runner.invoke(converter_main, ['-i', qdc_path, '-l', '1', '-o', '-', '-f', 'csv', '-r', '-q'])
+    assert 'could not be resumed' in result.output
+
+    with TemporaryDirectory() as tmpdir:
+        result = runner.invoke(converter_main, ['-i', qdc_path, '-l', '1', '-o', os.path.join(tmpdir, 'output.csv'),
+                                                '-f', 'grd', '-q'])
+        assert 'does not match format grd' in result.output
+        assert not os.listdir(tmpdir)
@@ -0,0 +1,112 @@
+import os
+import shutil
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from click.testing import CliRunner
+from qdc_converter import main as converter_main
+from qdc_converter.tiles import (CELL_DTYPE, deduplicate_tiles,
+                                 get_layer_parameters, scan_tiles)
+from qdc_converter.utils import get_files_recursively
+
+from helpers import compare_two_csv
+from reference import reference_export
+
+
+def test_scan_tiles(monkeypatch):
+    """Scan relative path with nested folders, foreign files and QDC files of other layers."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    qdc_file = os.path.join(here, 'data', 'main', 'qdc_contours', '0_17902c10.qdc')
+
+    with TemporaryDirectory() as tmpdir:
+        monkeypatch.chdir(tmpdir)
+        os.makedirs(os.path.join('dump', 'a', 'b'))
+        shutil.copy(qdc_file, os.path.join('dump', 'a', 'b', 'tile.qdc'))
+        with open(os.path.join('dump', 'a', 'small.qdc'), 'wb') as f_qdc:
+            f_qdc.write(b'\0' * 1024)
+        with open(os.path.join('dump', 'notes.txt'), 'w') as f_txt:
+            f_txt.write('not a tile')
+
+        # Same files and order as `os.walk` gives
+        walk_files = [os.path.join(dp, f) for dp, _, fn in os.walk('dump') for f in fn if f.endswith('.qdc')]
+        assert get_files_recursively('dump', '.qdc') == walk_files
+
+        tiles = scan_tiles('dump', get_layer_parameters(1))
+        assert [tile.path for tile in tiles] == [os.path.join('dump', 'a', 'b', 'tile.qdc')]
+        assert (tiles[0].x, tiles[0].y) == (6032, 11280)
+
+        assert scan_tiles('dump', get_layer_parameters(0)) == []
+
+
+def test_deduplicate_tiles():
+    """Copies of the tile are skipped, versions of the tile go from the oldest to the newest whatever walk order is."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    test_path = os.path.join(here, 'data', 'main')
+    qdc_file = os.path.join(test_path, 'qdc_contours', '0_17902c10.qdc')
+    layer_parameters = get_layer_parameters(1)
+
+    with TemporaryDirectory() as tmpdir:
+        dump_path = os.path.join(tmpdir, 'dump')
+        for folder in ('a', 'backup', 'old'):
+            os.makedirs(os.path.join(dump_path, folder))
+            shutil.copy(qdc_file, os.path.join(dump_path, folder, 'tile.qdc'))
+
+        # Older version of the tile with all valid cells 1 m deeper
+        old_tile_path = os.path.join(dump_path, 'old', 'tile.qdc')
+        tile, = scan_tiles(os.path.dirname(old_tile_path), layer_parameters)
+        data = np.fromfile(old_tile_path, dtype=np.uint8)
+        cells = data[tile.offset - 1:].view(CELL_DTYPE)
+        cells['depth'][cells['code'] != 0] += 100
+        data.tofile(old_tile_path)
+        os.utime(old_tile_path, (tile.mtime - 60, tile.mtime - 60))
+
+        tiles, duplicates = deduplicate_tiles(scan_tiles(dump_path, layer_parameters), layer_parameters)
+        assert len(tiles) == 2 and len(duplicates) == 1
+        assert tiles[0].path == old_tile_path
+
+        # Newer version covers all valid cells of the older one
+        result_csv = os.path.join(tmpdir, 'output.csv')
+        result = CliRunner().invoke(converter_main, ['-i', dump_path, '-o', result_csv, '-l', '1', '-st'])
+        assert result.exit_code == 0, result.output
+        assert 'Skipped 1 duplicate QDC files' in result.output
+        compare_two_csv(os.path.join(test_path, '0_17902c10.l1.csv'), result_csv)
+
+        # Make modified version the newest one
+        os.utime(old_tile_path, (tile.mtime + 60, tile.mtime + 60))
+        tiles, duplicates = deduplicate_tiles(scan_tiles(dump_path, layer_parameters), layer_parameters)
+        assert tiles[-1].path == old_tile_path
+
+
+def test_deduplicate_tiles_partial_versions():
+    """Cells valid only in the older version of the tile are kept the same way as by the original converter."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    test_path = os.path.join(here, 'data', 'main')
+    qdc_file = os.path.join(test_path, 'qdc_contours', '0_17902c10.qdc')
+    layer_parameters = get_layer_parameters(1)
+
+    with TemporaryDirectory() as tmpdir:
+        dump_path = os.path.join(tmpdir, 'dump')
+        for folder in ('new', 'old'):
+            os.makedirs(os.path.join(dump_path, folder))
+            shutil.copy(qdc_file, os.path.join(dump_path, folder, 'tile.qdc'))
+
+        # Newer version of the tile has only a half of valid cells of the older one
+        new_tile_path = os.path.join(dump_path, 'new', 'tile.qdc')
+        tile, = scan_tiles(os.path.dirname(new_tile_path), layer_parameters)
+        data = np.fromfile(new_tile_path, dtype=np.uint8)
+        cells = data[tile.offset - 1:].view(CELL_DTYPE)
+        valid = np.flatnonzero(cells['code'] != 0)
+        cells['code'][valid[::2]] = 0
+        data.tofile(new_tile_path)
+        os.utime(new_tile_path, (tile.mtime + 60, tile.mtime + 60))
+
+        expected_csv = os.path.join(tmpdir, 'expected.csv')
+        reference_export(dump_path, expected_csv, 1)
+        compare_two_csv(os.path.join(test_path, '0_17902c10.l1.csv'), expected_csv)
+
+        for engine_args in (['-st'], ['-w', '2']):
+            result_csv = os.path.join(tmpdir, 'output.csv')
+            args = ['-i', dump_path, '-o', result_csv, '-l', '1', '-q'] + engine_args
+            result = CliRunner().invoke(converter_main, args)
+            assert result.exit_code == 0, result.output
+            compare_two_csv(expected_csv, result_csv)
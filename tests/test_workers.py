@@ -0,0 +1,82 @@
+import filecmp
+import os
+from tempfile import TemporaryDirectory
+
+import pytest
+from click.testing import CliRunner
+from qdc_converter import cli_multithreaded, utils
+from qdc_converter import main as converter_main
+
+
+def write_file(file_path, content):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as f:
+        f.write(content)
+
+
+@pytest.mark.parametrize('files, limit', [
+    ({'cpu.max': '400000 100000\n'}, 4),
+    ({'cpu.max': '150000 100000\n'}, 2),
+    ({'cpu.max': 'max 100000\n'}, None),
+    ({'cpu/cpu.cfs_quota_us': '200000\n', 'cpu/cpu.cfs_period_us': '100000\n'}, 2),
+    ({'cpu,cpuacct/cpu.cfs_quota_us': '-1\n', 'cpu,cpuacct/cpu.cfs_period_us': '100000\n'}, None),
+    ({'cpu.max': 'garbage\n'}, None),
+    ({}, None),
+])
+def test_cgroup_cpu_limit(files, limit):
+    """CPU limit is read from cgroup v2 and v1 quota."""
+    with TemporaryDirectory() as tmpdir:
+        for file_name, content in files.items():
+            write_file(os.path.join(tmpdir, file_name), content)
+        assert utils.get_cgroup_cpu_limit(tmpdir) == limit
+
+
+def test_cpu_count(monkeypatch):
+    """Number of workers is limited by both affinity and quota."""
+    monkeypatch.setattr(utils.os, 'sched_getaffinity', lambda pid: set(range(96)), raising=False)
+    monkeypatch.setattr(utils, 'get_cgroup_cpu_limit', lambda: 4)
+    assert utils.get_cpu_count() == 4
+
+    monkeypatch.setattr(utils.os, 'sched_getaffinity', lambda pid: {0, 1}, raising=False)
+    assert utils.get_cpu_count() == 2
+
+    monkeypatch.setattr(utils, 'get_cgroup_cpu_limit', lambda: None)
+    monkeypatch.setattr(utils.os, 'sched_getaffinity', lambda pid: set(range(8)), raising=False)
+    assert utils.get_cpu_count() == 8
+
+
+def test_chunk_sizer(monkeypatch):
+    """Chunks are sized by cells first and then tuned by processing time within growth limits."""
+    monkeypatch.setattr(cli_multithreaded, 'CHUNK_CELLS', 1000)
+    monkeypatch.setattr(cli_multithreaded, 'CHUNK_TIME', 1.0)
+    monkeypatch.setattr(cli_multithreaded, 'CHUNK_GROWTH', 4)
+
+    assert cli_multithreaded.ChunkSizer(10).rows == 100
+    assert cli_multithreaded.ChunkSizer(5000).rows == 1
+
+    sizer = cli_multithreaded.ChunkSizer(10)
+    sizer.update(100, 0.5)
+    assert sizer.rows == 200
+    sizer.update(200, 0.001)
+    assert sizer.rows == 800
+    sizer.update(800, 100.0)
+    assert sizer.rows == 200
+    sizer.update(200, 0.0)
+    assert sizer.rows == 800
+
+
+def test_workers_option(monkeypatch):
+    """Result doesn't depend on number of workers and chunk sizes."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    qdc_path = os.path.join(here, 'data', 'main', 'qdc_contours')
+
+    with TemporaryDirectory() as tmpdir:
+        expected_path = os.path.join(tmpdir, 'expected.grd')
+        result = CliRunner().invoke(converter_main, ['-i', qdc_path, '-o', expected_path, '-l', '1', '-st', '-q'])
+        assert result.exit_code == 0, result.output
+
+        monkeypatch.setattr(cli_multithreaded, 'CHUNK_CELLS', 300)
+        output_path = os.path.join(tmpdir, 'output.grd')
+        result = CliRunner().invoke(converter_main, ['-i', qdc_path, '-o', output_path, '-l', '1', '-w', '2', '-q'])
+        assert result.exit_code == 0, result.output
+        assert filecmp.cmp(expected_path, output_path, shallow=False)